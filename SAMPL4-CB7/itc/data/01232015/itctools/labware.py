@@ -1,3 +1,6 @@
+from collections import deque
+
+
 class Labware(object):
 
     def __init__(self, RackLabel, RackType, RackID=None):
@@ -26,3 +29,128 @@ class PipettingLocation(object):
         self.RackLabel = RackLabel
         self.RackType = RackType
         self.Position = Position
+
+
+# Well names of an 'ITC Plate' (8 rows A-H by 12 columns), indexed by Tecan well index - 1.
+# Tecan numbers wells back to front, then left to right.
+ITC_PLATE_WELL_NAMES = ['%s%d' % (row, column + 1) for column in range(12) for row in 'ABCDEFGH']
+
+
+class PlateAllocator(object):
+
+    def __init__(self, plates):
+        """
+        Allocate the wells of a set of ITC plates as pipetting destinations.
+
+        Wells are handed out plate by plate in Tecan well order; released wells are reused first.
+        Reserving, releasing and querying a well take constant time.
+
+        Parameters
+        ----------
+        plates : list of Labware
+           The empty ITC plates, numbered from 1 in the order given.
+
+        Examples
+        --------
+
+        >>> allocator = PlateAllocator([Labware('DestinationPlate', 'ITC Plate')])
+        >>> well = allocator.reserve()
+        >>> print('%d %s %d' % (well.PlateNumber, well.WellName, allocator.available()))
+        1 A1 95
+        >>> allocator.release(well)
+        >>> print(allocator.reserve() is well)
+        True
+
+        """
+        self.plates = list(plates)
+        self.nwells = len(ITC_PLATE_WELL_NAMES)
+
+        # Pipetting locations of all wells, with plate number and well name for Auto iTC-200.
+        self.locations = list()
+        for (plate_index, plate) in enumerate(self.plates):
+            for (index, well_name) in enumerate(ITC_PLATE_WELL_NAMES):
+                location = PipettingLocation(plate.RackLabel, plate.RackType, index + 1)
+                location.PlateNumber = plate_index + 1
+                location.WellName = well_name
+                self.locations.append(location)
+
+        self.reset()
+
+    def reset(self):
+        """
+        Mark all wells free.
+
+        """
+        self._cursor = 0  # first well never reserved since the last reset
+        self._released = deque()
+        self._reserved = bytearray(len(self.locations))
+        self._nreserved = 0
+
+    def _slot(self, location):
+        return (location.PlateNumber - 1) * self.nwells + location.Position - 1
+
+    def available(self):
+        """
+        Return the number of free wells.
+
+        """
+        return len(self.locations) - self._nreserved
+
+    def location(self, plate_number, position):
+        """
+        Return the pipetting location of a well.
+
+        Parameters
+        ----------
+        plate_number : int
+           Plate number, from 1.
+        position : int
+           Tecan well index, from 1.
+
+        """
+        return self.locations[(plate_number - 1) * self.nwells + position - 1]
+
+    def is_reserved(self, location):
+        """
+        Return True if the well of a pipetting location from this allocator is reserved.
+
+        """
+        return bool(self._reserved[self._slot(location)])
+
+    def reserve(self):
+        """
+        Reserve a free well.
+
+        Returns
+        -------
+        location : PipettingLocation
+           The reserved well, with plate number and well name in PlateNumber and WellName.
+
+        """
+        if self._released:
+            slot = self._released.popleft()
+        elif self._cursor < len(self.locations):
+            slot = self._cursor
+            self._cursor += 1
+        else:
+            raise Exception("All %d wells of %d destination plates are reserved." % (len(self.locations), len(self.plates)))
+        self._reserved[slot] = 1
+        self._nreserved += 1
+        return self.locations[slot]
+
+    def release(self, location):
+        """
+        Release a reserved well.
+
+        Parameters
+        ----------
+        location : PipettingLocation
+           The well, as returned by reserve().
+
+        """
+        slot = self._slot(location)
+        if not self._reserved[slot]:
+            raise Exception("Well %s of plate %d is not reserved." % (location.WellName, location.PlateNumber))
+        self._reserved[slot] = 0
+        self._nreserved -= 1
+        self._released.append(slot)
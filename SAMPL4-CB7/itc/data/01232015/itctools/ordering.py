@@ -0,0 +1,161 @@
+"""
+Ordering of the Auto iTC-200 queue to minimize cleaning and changeover time.
+
+The queue time of an order is timing.queue_time().  optimize_order() improves an order by moving blocks of
+consecutive experiments, keeping precedence constraints such as a blank running before its matched titration.
+"""
+from .timing import changeover_time
+
+
+def matched_blanks(experiments):
+    """
+    Match each titration with the blank that measures the heat of injecting buffer into the same cell solution.
+
+    A titration has both syringe and cell concentrations; a blank has a cell concentration, a syringe source
+    without concentration (buffer), and the same cell source.  Each titration is matched with the closest blank
+    before it, or else after it.
+
+    Parameters
+    ----------
+    experiments : list of ITCExperiment
+        The experiments, in queue order.
+
+    Returns
+    -------
+    pairs : list of (int, int)
+        Indices of (blank, titration) pairs.
+
+    """
+    def cell(experiment):
+        return getattr(experiment, 'cell_source', None), getattr(experiment, 'cell_concentration', None)
+
+    blanks = list()
+    titrations = list()
+    for (index, experiment) in enumerate(experiments):
+        cell_source, cell_concentration = cell(experiment)
+        if cell_source is None or cell_concentration is None:
+            continue
+        if getattr(experiment, 'syringe_concentration', None) is not None:
+            titrations.append(index)
+        elif getattr(experiment.syringe_source, 'concentration', None) is None:
+            blanks.append(index)
+
+    pairs = list()
+    for titration in titrations:
+        candidates = [blank for blank in blanks if cell(experiments[blank])[0] is cell(experiments[titration])[0]]
+        if not candidates:
+            continue
+        before = [blank for blank in candidates if blank < titration]
+        if before:
+            pairs.append((before[-1], titration))
+        else:
+            pairs.append((candidates[0], titration))
+    return pairs
+
+
+def _changeover_total(order, changeover):
+    total = 0.0
+    previous = None
+    for index in order:
+        total += changeover[previous, index]
+        previous = index
+    return total
+
+
+def _feasible(order, constraints):
+    position = dict((index, rank) for (rank, index) in enumerate(order))
+    return all(position[before] < position[after] for (before, after) in constraints)
+
+
+def _feasible_order(order, constraints):
+    # Closest order to the given one that keeps the constraints among its experiments: each experiment is
+    # placed as early as it was, unless an experiment that must run before it comes later.  None if impossible.
+    members = set(order)
+    predecessors = dict((index, set()) for index in order)
+    for (before, after) in constraints:
+        if before in members and after in members:
+            predecessors[after].add(before)
+    feasible = list()
+    placed = set()
+    remaining = list(order)
+    while remaining:
+        for index in remaining:
+            if predecessors[index] <= placed:
+                break
+        else:
+            return None
+        remaining.remove(index)
+        feasible.append(index)
+        placed.add(index)
+    return feasible
+
+
+def optimize_order(experiments, constraints=(), fixed_head=0, fixed_tail=0, max_block=3):
+    """
+    Find a queue order with less total changeover time.
+
+    If the given order violates the constraints, such as a titration queued before its blank, the experiments
+    that must run earlier are first moved ahead.  Starting from this order, a block of up to max_block
+    consecutive experiments is moved wherever that reduces the changeover time and keeps the constraints, until
+    no such move is left.  Sample prep and run times do not depend on the order, so this reduces the queue time
+    by the same amount.
+
+    Parameters
+    ----------
+    experiments : list of ITCExperiment
+        The experiments, in their current order.
+    constraints : list of (int, int), optional, default=()
+        Pairs (before, after) of experiment indices that must stay in this order.
+    fixed_head : int, optional, default=0
+        Number of experiments kept at the start of the queue, such as initial cleaning runs.
+    fixed_tail : int, optional, default=0
+        Number of experiments kept at the end of the queue, such as final control runs.
+    max_block : int, optional, default=3
+        Largest number of consecutive experiments moved together.
+
+    Returns
+    -------
+    order : list of int
+        Indices of the experiments in the optimized order.
+
+    """
+    nexperiments = len(experiments)
+    head = list(range(fixed_head))
+    tail = list(range(nexperiments - fixed_tail, nexperiments))
+    order = _feasible_order(list(range(fixed_head, nexperiments - fixed_tail)), constraints)
+    if order is None or not _feasible(head + order + tail, constraints):
+        raise Exception("The ordering constraints cannot be satisfied with the fixed experiments.")
+
+    # Changeover times between all pairs, with None for the start of the queue.
+    changeover = dict()
+    for j in range(nexperiments):
+        changeover[None, j] = changeover_time(None, experiments[j])
+        for i in range(nexperiments):
+            if i != j:
+                changeover[i, j] = changeover_time(experiments[i], experiments[j])
+
+    best = _changeover_total(head + order + tail, changeover)
+
+    improved = True
+    while improved:
+        improved = False
+        for length in range(1, max_block + 1):
+            for start in range(len(order) - length + 1):
+                block = order[start:start + length]
+                rest = order[:start] + order[start + length:]
+                for insert in range(len(rest) + 1):
+                    if insert == start:
+                        continue
+                    candidate = rest[:insert] + block + rest[insert:]
+                    total = _changeover_total(head + candidate + tail, changeover)
+                    if total < best - 1.0e-6 and _feasible(head + candidate + tail, constraints):
+                        order = candidate
+                        best = total
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+
+    return head + order + tail
@@ -4,12 +4,16 @@ import openpyxl  # Excel spreadsheet I/O (for Auto iTC-200)
 from openpyxl import Workbook
 from distutils.version import StrictVersion  # For version testing
 from datetime import datetime
-from .labware import PipettingLocation
+from .labware import ITC_PLATE_WELL_NAMES, PlateAllocator
+from .worklist import Worklist, schedule, estimate_time
+from .timing import queue_time
+from .ordering import matched_blanks, optimize_order
 
 
 class ITCProtocol(object):
 
-    def __init__(self, name, sample_prep_method, itc_method, analysis_method):
+    def __init__(self, name, sample_prep_method, itc_method, analysis_method,
+                 experimental_conditions=None, injections=None):
         """
         Parameters
         ----------
@@ -21,12 +25,20 @@ class ITCProtocol(object):
            The name of the 'ItcMethod' to be written to the Excel file for the Auto iTC-200.
         analysis_method : str
            The name of the 'AnalysisMethod' to be written to the Excel file for the Auto iTC-200.
+        experimental_conditions : dict, optional, default=None
+           Conditions of the ITC method, e.g. dict(target_temperature=25, equilibration_time=300, stir_rate=1000, reference_power=5),
+           with the equilibration time in seconds.
+        injections : list of dict, optional, default=None
+           Injections of the ITC method, e.g. dict(volume_inj=3.0, duration_inj=6, spacing=120, filter_period=0.5),
+           with volumes in microliters and times in seconds.
 
         """
         self.name = name
         self.sample_prep_method = sample_prep_method
         self.itc_method = itc_method
         self.analysis_method = analysis_method
+        self.experimental_conditions = experimental_conditions
+        self.injections = injections
 
 # In case these will diverge at some point, declare alias for Mixture usage.
 HeatOfMixingProtocol = ITCProtocol
@@ -259,6 +271,10 @@ class ITCExperimentSet(object):
         self.experiments = list()  # list of experiments to set up
         # ITC plates available for use in experiment
         self.destination_plates = list()
+        # Allocator of destination wells, built on first validation
+        self._destinations = None
+        # Options of the last validation, to validate again after reordering
+        self._validate_options = None
 
         self._validated = False
 
@@ -304,11 +320,7 @@ class ITCExperimentSet(object):
            Well name for ITC plate (e.g. 'A6'), numbered from A1 to H12
 
         """
-        row = int((index - 1) % 8)
-        column = int((index - 1) / 8)
-        rownames = 'ABCDEFGH'
-        well_name = rownames[row] + '%d' % (column + 1)
-        return well_name
+        return ITC_PLATE_WELL_NAMES[index - 1]
 
     class ITCData(object):
 
@@ -344,36 +356,93 @@ class ITCExperimentSet(object):
     def _resetTrackedQuantities(self):
         self._tracked_quantities = dict()
 
-    def _trackQuantities(self, thing, volume):
+    def _liquidName(self, thing):
         try:
-            name = thing.name
+            return thing.name
         except:
-            name = thing.RackLabel
+            return thing.RackLabel
+
+    def _trackQuantities(self, thing, volume):
+        name = self._liquidName(thing)
 
         if name in self._tracked_quantities:
             self._tracked_quantities[name] += volume
         else:
             self._tracked_quantities[name] = volume
 
+    def _sourceLocation(self, source, position):
+        """
+        Return the labware and Tecan well index to aspirate a source from.
+
+        Parameters
+        ----------
+        source : Solution or Labware
+           The source to aspirate from.
+        position : int
+           Tecan well index to use if the source is Labware.
+
+        Returns
+        -------
+        labware : PipettingLocation or Labware
+           The labware to aspirate from.
+        position : int
+           The Tecan well index to aspirate from.
+
+        """
+        try:
+            # Assume source is Solution.
+            return source.location, source.location.Position
+        except AttributeError:
+            # Assume source is Labware.
+            return source, position
+
+    def _scheduleWorklist(self, worklist):
+        """
+        Reschedule the transfers of a worklist on all tips, and report the estimated robot time before and after.
+
+        Parameters
+        ----------
+        worklist : Worklist
+           The worklist, with one wash per transfer.
+
+        Returns
+        -------
+        scheduled : Worklist
+           The worklist with the same transfers, washing only when a tip changes liquid.
+
+        """
+        scheduled = schedule(worklist.transfers)
+        before, washes_before = estimate_time(worklist)
+        after, washes_after = estimate_time(scheduled)
+        print("Estimated robot time: %.0f s with %d washes, scheduled %.0f s with %d washes" % (
+            before, washes_before, after, washes_after))
+        return scheduled
+
+    @property
+    def worklist(self):
+        """
+        The Tecan worklist (.gwl) as a string.
+
+        """
+        return str(self.worklist_commands)
+
     def _allocate_destinations(self):
-        # Make a list of all the possible destination pipetting locations.
+        # Free all destination wells, reusing the allocator unless plates were added.
         # TODO: Change this to go left-to-right in ITC plates?
-        self.destination_locations = list()
-        for (plate_index, plate) in enumerate(self.destination_plates):
-            PlateNumber = plate_index + 1
-            for index in range(96):
-                Position = index + 1
-                WellName = self._wellIndexToName(Position)
-                location = PipettingLocation(
-                    plate.RackLabel,
-                    plate.RackType,
-                    Position)
-                # Add plate number and well name for Auto iTC-200.
-                location.PlateNumber = PlateNumber
-                location.WellName = WellName
-                self.destination_locations.append(location)
-
-    def validate(self, print_volumes=True, omit_zeroes=True, vlimit=10.0):
+        if self._destinations is None or self._destinations.plates != self.destination_plates:
+            self._destinations = PlateAllocator(self.destination_plates)
+        else:
+            self._destinations.reset()
+
+    def _reserveDestination(self, experiment_number):
+        # Reserve the next free destination well.
+        if self._destinations.available() == 0:
+            raise Exception(
+                "Ran out of destination plates for experiment %d / %d" %
+                (experiment_number, len(self.experiments)))
+        return self._destinations.reserve()
+
+    def validate(self, print_volumes=True, omit_zeroes=True, vlimit=10.0, schedule_tips=False):
         """
         Validate that the specified set of ITC experiments can actually be set up, raising an exception if not.
 
@@ -387,15 +456,18 @@ class ITCExperimentSet(object):
             Omit operations with volumes below vlimit (default = True)
         vlimit : float
             Minimal volume for pipetting operation in microliters (default = 10.0)
+        schedule_tips : bool
+            Schedule the transfers on all eight tips, washing only when a tip changes liquid (default = False)
         """
 
         # TODO: Try to set up experiment, throwing exception upon failure.
+        self._validate_options = dict(omit_zeroes=omit_zeroes, vlimit=vlimit, schedule_tips=schedule_tips)
 
-        # Make a list of all the possible destination pipetting locations.
+        # Free all the possible destination pipetting locations.
         self._allocate_destinations()
 
         # Build worklist script.
-        worklist_script = ""
+        worklist = Worklist()
 
         # Reset tracked quantities.
         self._resetTrackedQuantities()
@@ -414,11 +486,7 @@ class ITCExperimentSet(object):
             tecandata = ITCExperimentSet.TecanData()
 
             # Find a place to put cell contents.
-            if len(self.destination_locations) == 0:
-                raise Exception(
-                    "Ran out of destination plates for experiment %d / %d" %
-                    (experiment_number, len(self.experiments)))
-            tecandata.cell_destination = self.destination_locations.pop(0)
+            tecandata.cell_destination = self._reserveDestination(experiment_number)
 
             cell_volume = 400.0  # microliters
             transfer_volume = cell_volume
@@ -450,16 +518,10 @@ class ITCExperimentSet(object):
                 # Schedule buffer transfer.
                 tipmask = 1
                 if buffer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.buffer_source.RackLabel, experiment.
-                        buffer_source.RackType, 1, buffer_volume, tipmask)
-                    worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        tecandata.cell_destination.RackLabel, tecandata.
-                        cell_destination.RackType, tecandata.cell_destination.
-                        Position, buffer_volume, tipmask)
-
-                    # no wash if no actions taken
-                    worklist_script += 'W;\r\n'  # queue wash tips
+                    worklist.transfer(
+                        experiment.buffer_source, 1,
+                        tecandata.cell_destination, buffer_volume, tipmask,
+                        self._liquidName(experiment.buffer_source))
                     self._trackQuantities(
                         experiment.buffer_source,
                         buffer_volume *
@@ -467,38 +529,19 @@ class ITCExperimentSet(object):
 
             # Schedule cell solution transfer.
             tipmask = 2
-            try:
-                # Assume source is Solution.
-                if transfer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.cell_source.location.RackLabel, experiment.
-                        cell_source.location.RackType, experiment.cell_source.
-                        location.Position, transfer_volume, tipmask)
-            except:
-                # Assume source is Labware.
-                if transfer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.cell_source.RackLabel, experiment.cell_source.RackType, 2, transfer_volume, tipmask)
-
             if transfer_volume > 0.01 or not omit_zeroes:
-                worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    tecandata.cell_destination.RackLabel, tecandata.
-                    cell_destination.RackType, tecandata.cell_destination.
-                    Position, transfer_volume, tipmask)
-
-                # no wash if no actions taken
-                worklist_script += 'W;\r\n'  # queue wash tips
+                source, position = self._sourceLocation(experiment.cell_source, 2)
+                worklist.transfer(
+                    source, position,
+                    tecandata.cell_destination, transfer_volume, tipmask,
+                    self._liquidName(experiment.cell_source))
                 self._trackQuantities(
                     experiment.cell_source,
                     transfer_volume *
                     ureg.microliters)
 
             # Find a place to put syringe contents.
-            if len(self.destination_locations) == 0:
-                raise Exception(
-                    "Ran out of destination plates for experiment %d / %d" %
-                    (experiment_number, len(self.experiments)))
-            tecandata.syringe_destination = self.destination_locations.pop(0)
+            tecandata.syringe_destination = self._reserveDestination(experiment_number)
 
             syringe_volume = 120.0  # microliters
             transfer_volume = cell_volume
@@ -532,16 +575,10 @@ class ITCExperimentSet(object):
                 tipmask = 4
 
                 if buffer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.buffer_source.RackLabel, experiment.
-                        buffer_source.RackType, 3, buffer_volume, tipmask)
-                    worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        tecandata.syringe_destination.RackLabel, tecandata.
-                        syringe_destination.RackType, tecandata.
-                        syringe_destination.Position, buffer_volume, tipmask)
-
-                    # no wash if no actions taken
-                    worklist_script += 'W;\r\n'  # queue wash tips
+                    worklist.transfer(
+                        experiment.buffer_source, 3,
+                        tecandata.syringe_destination, buffer_volume, tipmask,
+                        self._liquidName(experiment.buffer_source))
                     self._trackQuantities(
                         experiment.buffer_source,
                         buffer_volume *
@@ -549,27 +586,12 @@ class ITCExperimentSet(object):
 
             # Schedule syringe solution transfer.
             tipmask = 8
-            try:
-                # Assume source is Solution.
-                if transfer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.syringe_source.location.RackLabel,
-                        experiment.syringe_source.location.RackType,
-                        experiment.syringe_source.location.Position,
-                        transfer_volume, tipmask)
-            except:
-                # Assume source is Labware.
-                if transfer_volume > 0.01 or not omit_zeroes:
-                    worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                        experiment.syringe_source.RackLabel, experiment.
-                        syringe_source.RackType, 4, transfer_volume, tipmask)
-
             if transfer_volume > 0.01 or not omit_zeroes:
-                worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    tecandata.syringe_destination.RackLabel, tecandata.
-                    syringe_destination.RackType, tecandata.
-                    syringe_destination.Position, transfer_volume, tipmask)
-                worklist_script += 'W;\r\n'  # queue wash tips
+                source, position = self._sourceLocation(experiment.syringe_source, 4)
+                worklist.transfer(
+                    source, position,
+                    tecandata.syringe_destination, transfer_volume, tipmask,
+                    self._liquidName(experiment.syringe_source))
                 self._trackQuantities(
                     experiment.syringe_source,
                     transfer_volume *
@@ -587,7 +609,7 @@ class ITCExperimentSet(object):
                 sflag, syringe_volume)
 
             # Finish worklist section.
-            worklist_script += 'B;\r\n'  # execute queued batch of commands
+            worklist.flush()  # execute queued batch of commands
 
             # Create datafile name.
             now = datetime.now()
@@ -628,7 +650,9 @@ class ITCExperimentSet(object):
             if print_volumes:
                 print(volume_report)
         # Save Tecan worklist.
-        self.worklist = worklist_script
+        if schedule_tips:
+            worklist = self._scheduleWorklist(worklist)
+        self.worklist_commands = worklist
 
         # Report tracked quantities.
         print("Necessary volumes:")
@@ -645,6 +669,45 @@ class ITCExperimentSet(object):
         # Set validated flag.
         self._validated = True
 
+    def optimizeOrder(self, constraints=None, fixed_head=0, fixed_tail=0):
+        """
+        Reorder the experiments to minimize the cleaning and changeover time of the Auto iTC-200 queue.
+
+        Each blank is kept before its matched titration.  If the set was validated, it is validated again, so the
+        Tecan worklist and the Auto iTC-200 spreadsheet follow the new order.
+
+        Parameters
+        ----------
+        constraints : list of (ITCExperiment, ITCExperiment), optional, default=None
+            Additional pairs of experiments that must run in this order.
+        fixed_head : int, optional, default=0
+            Number of experiments kept at the start of the queue, such as initial cleaning runs.
+        fixed_tail : int, optional, default=0
+            Number of experiments kept at the end of the queue, such as final control runs.
+
+        Returns
+        -------
+        saved : float
+            Estimated queue time saved, in seconds.
+
+        """
+        pairs = matched_blanks(self.experiments)
+        if constraints is not None:
+            pairs += [(self.experiments.index(before), self.experiments.index(after)) for (before, after) in constraints]
+
+        before = queue_time(self.experiments)
+        order = optimize_order(self.experiments, pairs, fixed_head=fixed_head, fixed_tail=fixed_tail)
+        self.experiments = [self.experiments[index] for index in order]
+        after = queue_time(self.experiments)
+
+        print("Estimated Auto iTC-200 queue time: %.1f h, reordered %.1f h, saved %.0f min" % (
+            before / 3600.0, after / 3600.0, (before - after) / 60.0))
+
+        if self._validated:
+            self.validate(print_volumes=False, **self._validate_options)
+
+        return before - after
+
     def writeTecanWorklist(self, filename):
         """
         Write the Tecan worklist for the specified experiment set.
@@ -659,7 +722,7 @@ class ITCExperimentSet(object):
             self.validate()
 
         outfile = open(filename, 'w')
-        outfile.write(self.worklist)
+        self.worklist_commands.write(outfile)
         outfile.close()
 
     def writeAutoITCExcel(self, filename):
@@ -752,7 +815,8 @@ class HeatOfMixingExperimentSet(ITCExperimentSet):
             cell_volume=400.0 *
             ureg.microliters,
             syringe_volume=120.0 *
-            ureg.microliters):
+            ureg.microliters,
+            schedule_tips=False):
         """
         Build the worklist for heat of mixing experiments
 
@@ -762,13 +826,15 @@ class HeatOfMixingExperimentSet(ITCExperimentSet):
             Total volume to prepare for cell in microliters  (opt., default = 400.0 * microliters )
         syringe_volume : pint Quantity with units compatible with microliters
             Total volume to prepare for syringe in microliters (default = 120.0 * microliters )
+        schedule_tips : bool
+            Schedule the transfers on all eight tips, washing only when a tip changes liquid (default = False)
         """
 
-        # Make a list of all the possible destination pipetting locations.
+        # Free all the possible destination pipetting locations.
         self._allocate_destinations()
 
         # Build worklist script.
-        worklist_script = ""
+        worklist = Worklist()
 
         # Reset tracked quantities.
         self._resetTrackedQuantities()
@@ -780,11 +846,7 @@ class HeatOfMixingExperimentSet(ITCExperimentSet):
             tecandata = HeatOfMixingExperimentSet.TecanData()
 
             # Ensure there are ITC wells available
-            if len(self.destination_locations) == 0:
-                raise Exception(
-                    "Ran out of destination plates for experiment %d / %d" %
-                    (experiment_number, len(self.experiments)))
-            tecandata.cell_destination = self.destination_locations.pop(0)
+            tecandata.cell_destination = self._reserveDestination(experiment_number)
 
             # Calculate volumes per component for cell mixture
             cell_volumes = list()
@@ -816,60 +878,43 @@ class HeatOfMixingExperimentSet(ITCExperimentSet):
 
             # Start mixing up our cell volume
             for i in range(len(experiment.cell_mixture.components)):
-                worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    experiment.cell_mixture.locations[i].RackLabel, experiment.
-                    cell_mixture.locations[i].RackType, experiment.
-                    cell_mixture.locations[i].Position, cell_volumes[i],
-                    dictips[experiment.cell_mixture.components[i]])
-
-                worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    tecandata.cell_destination.RackLabel, tecandata.
-                    cell_destination.RackType, tecandata.cell_destination.
-                    Position, cell_volumes[i],
-                    dictips[experiment.cell_mixture.components[i]])
-
-                worklist_script += 'W;\r\n'  # queue wash tips
+                location = experiment.cell_mixture.locations[i]
+                worklist.transfer(
+                    location, location.Position,
+                    tecandata.cell_destination, cell_volumes[i],
+                    dictips[experiment.cell_mixture.components[i]],
+                    self._liquidName(experiment.cell_mixture.components[i]))
                 self._trackQuantities(
                     experiment.cell_mixture.components[i],
                     cell_volumes[i] *
                     ureg.microliters)
 
             # Find a place to put syringe contents.
-            if len(self.destination_locations) == 0:
-                raise Exception(
-                    "Ran out of destination plates for experiment %d / %d" %
-                    (experiment_number, len(self.experiments)))
-            tecandata.syringe_destination = self.destination_locations.pop(0)
+            tecandata.syringe_destination = self._reserveDestination(experiment_number)
 
             # Start mixing up our syringe volume
             for i in range(len(experiment.syringe_mixture.components)):
-                worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    experiment.syringe_mixture.locations[i].RackLabel,
-                    experiment.syringe_mixture.locations[i].RackType,
-                    experiment.syringe_mixture.locations[i].Position,
-                    syr_volumes[i],
-                    dictips[experiment.syringe_mixture.components[i]])
-
-                worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (
-                    tecandata.syringe_destination.RackLabel, tecandata.
-                    syringe_destination.RackType, tecandata.
-                    syringe_destination.Position, syr_volumes[i],
-                    dictips[experiment.syringe_mixture.components[i]])
-
-                worklist_script += 'W;\r\n'  # queue wash tips
+                location = experiment.syringe_mixture.locations[i]
+                worklist.transfer(
+                    location, location.Position,
+                    tecandata.syringe_destination, syr_volumes[i],
+                    dictips[experiment.syringe_mixture.components[i]],
+                    self._liquidName(experiment.syringe_mixture.components[i]))
                 self._trackQuantities(
                     experiment.syringe_mixture.components[i],
                     syr_volumes[i] *
                     ureg.microliters)
 
             # Finish worklist section.
-            worklist_script += 'B;\r\n'  # execute queued batch of commands
+            worklist.flush()  # execute queued batch of commands
 
             # Store Tecan data for this experiment
             experiment.tecandata = tecandata
 
         # Store the completed worklist, containing all experiments
-        self.worklist = worklist_script
+        if schedule_tips:
+            worklist = self._scheduleWorklist(worklist)
+        self.worklist_commands = worklist
         self._worklist_complete = True
 
     def populate_autoitc_spreadsheet(self):
@@ -0,0 +1,235 @@
+"""
+Estimated timelines of ITC experiment sets: Tecan sample preparation followed by the Auto iTC-200 queue.
+
+The duration of each ITC run is computed from the injection list and equilibration time of its protocol.
+The sample preparation (loading and cleaning) done by the Auto iTC-200 before each run depends on the
+sample prep method, and on the previous run through changeover_time().  Its durations below are estimates
+that should be updated from instrument logs.
+"""
+from collections import namedtuple
+
+from .worklist import estimate_time
+
+# Estimated duration of Auto iTC-200 sample prep methods (seconds), including loading and cleaning.
+known_sample_prep_times = {
+    'Plates Quick.setup': 24 * 60.0,
+    'Plates Clean.setup': 45 * 60.0,
+    'Chodera Load Cell Without Cleaning Cell After.setup': 16 * 60.0,
+}
+DEFAULT_SAMPLE_PREP_TIME = 24 * 60.0
+
+# Sample prep methods that leave the cell loaded; the next run cleans it first unless it loads the same solution.
+known_uncleaned_sample_prep_methods = ['Chodera Load Cell Without Cleaning Cell After.setup']
+CELL_CLEANING_TIME = 10 * 60.0
+# Time to equilibrate the cell at a different target temperature (seconds).
+TEMPERATURE_CHANGE_TIME = 20 * 60.0
+
+# Experimental conditions and injections of ITC methods, for protocols that do not specify them.
+known_itc_methods = {
+    'ChoderaWaterWater.inj': dict(
+        experimental_conditions=dict(target_temperature=25, equilibration_time=60, stir_rate=1000, reference_power=5),
+        injections=[dict(volume_inj=0.2, duration_inj=0.4, spacing=60, filter_period=0.5)] +
+        10 * [dict(volume_inj=3.0, duration_inj=6, spacing=120, filter_period=0.5)]),
+    'ChoderaHostGuest.inj': dict(
+        experimental_conditions=dict(target_temperature=25, equilibration_time=300, stir_rate=1000, reference_power=5),
+        injections=[dict(volume_inj=0.2, duration_inj=0.4, spacing=60, filter_period=0.5)] +
+        10 * [dict(volume_inj=3.0, duration_inj=6, spacing=120, filter_period=0.5)]),
+    'water5inj.inj': dict(
+        experimental_conditions=dict(target_temperature=25, equilibration_time=60, stir_rate=1000, reference_power=5),
+        injections=5 * [dict(volume_inj=7.5, duration_inj=15, spacing=150, filter_period=5)]),
+}
+
+# One experiment in a timeline; times are in seconds from the start of the Tecan preparation.
+TimelineEntry = namedtuple('TimelineEntry', ['name', 'start', 'sample_prep_time', 'run_time', 'end'])
+
+
+def _method(protocol):
+    # Experimental conditions and injections of a protocol, completed from its ITC method.
+    injections = protocol.injections
+    conditions = protocol.experimental_conditions
+    if injections is None or conditions is None:
+        try:
+            method = known_itc_methods[protocol.itc_method]
+        except KeyError:
+            raise Exception("Protocol '%s' has no injections, and ITC method '%s' is unknown." % (protocol.name, protocol.itc_method))
+        if injections is None:
+            injections = method['injections']
+        if conditions is None:
+            conditions = method['experimental_conditions']
+    return conditions, injections
+
+
+def run_time(protocol):
+    """
+    Return the duration of the ITC run of a protocol.
+
+    Parameters
+    ----------
+    protocol : ITCProtocol
+        The protocol.  If it has no injections or experimental conditions, those of its itc_method in
+        known_itc_methods are used.
+
+    Returns
+    -------
+    seconds : float
+        Equilibration time followed by the spacing of each injection (at least its duration).
+
+    """
+    conditions, injections = _method(protocol)
+    seconds = float(conditions['equilibration_time'])
+    for injection in injections:
+        seconds += max(injection['spacing'], injection['duration_inj'])
+    return seconds
+
+
+def sample_prep_time(protocol):
+    """
+    Return the estimated duration of the Auto iTC-200 sample prep method of a protocol.
+
+    Parameters
+    ----------
+    protocol : ITCProtocol
+        The protocol.
+
+    Returns
+    -------
+    seconds : float
+        Duration from known_sample_prep_times, or DEFAULT_SAMPLE_PREP_TIME for unknown methods.
+
+    """
+    return known_sample_prep_times.get(protocol.sample_prep_method, DEFAULT_SAMPLE_PREP_TIME)
+
+
+def _same_cell_solution(previous, experiment):
+    # True if two experiments load the same solution into the cell.
+    source = getattr(previous, 'cell_source', None)
+    if source is None or source is not getattr(experiment, 'cell_source', None):
+        return False
+    if previous.cell_concentration is None or experiment.cell_concentration is None:
+        return previous.cell_concentration is experiment.cell_concentration
+    return abs(float(previous.cell_concentration / experiment.cell_concentration) - 1.0) < 1.0e-6
+
+
+def changeover_time(previous, experiment):
+    """
+    Return the additional sample preparation time of an experiment caused by the experiment run before it.
+
+    Parameters
+    ----------
+    previous : ITCExperiment or None
+        The experiment run before, or None for the first experiment.
+    experiment : ITCExperiment
+        The experiment.
+
+    Returns
+    -------
+    seconds : float
+        CELL_CLEANING_TIME if the previous sample prep method left the cell loaded with a different solution,
+        plus TEMPERATURE_CHANGE_TIME if the target temperatures differ.
+
+    """
+    if previous is None:
+        return 0.0
+    seconds = 0.0
+    if previous.protocol.sample_prep_method in known_uncleaned_sample_prep_methods:
+        if not _same_cell_solution(previous, experiment):
+            seconds += CELL_CLEANING_TIME
+    previous_conditions, previous_injections = _method(previous.protocol)
+    conditions, injections = _method(experiment.protocol)
+    if previous_conditions.get('target_temperature') != conditions.get('target_temperature'):
+        seconds += TEMPERATURE_CHANGE_TIME
+    return seconds
+
+
+def queue_time(experiments):
+    """
+    Return the time the Auto iTC-200 takes to run experiments in the order given.
+
+    Parameters
+    ----------
+    experiments : list of ITCExperiment
+        The experiments, in queue order.
+
+    Returns
+    -------
+    seconds : float
+        Sum of the sample prep, changeover and run times.
+
+    """
+    seconds = 0.0
+    previous = None
+    for experiment in experiments:
+        seconds += changeover_time(previous, experiment) + sample_prep_time(experiment.protocol) + run_time(experiment.protocol)
+        previous = experiment
+    return seconds
+
+
+def estimate_timeline(experiment_set):
+    """
+    Estimate when each experiment of a validated experiment set starts and ends.
+
+    The Tecan prepares all cell and syringe solutions first; the Auto iTC-200 then runs the experiments,
+    including cleaning and control runs, one after the other in the order of the set.
+
+    Parameters
+    ----------
+    experiment_set : ITCExperimentSet
+        The experiment set, with a Tecan worklist.
+
+    Returns
+    -------
+    tecan_time : float
+        Estimated duration of the Tecan preparation in seconds.
+    timeline : list of TimelineEntry
+        One entry per experiment, in queue order; the sample prep time includes the changeover time.
+    makespan : float
+        Time from the start of the Tecan preparation to the end of the last experiment, in seconds.
+
+    """
+    tecan_time, nwashes = estimate_time(experiment_set.worklist_commands)
+
+    timeline = list()
+    start = tecan_time
+    previous = None
+    for experiment in experiment_set.experiments:
+        prep = changeover_time(previous, experiment) + sample_prep_time(experiment.protocol)
+        run = run_time(experiment.protocol)
+        timeline.append(TimelineEntry(experiment.name, start, prep, run, start + prep + run))
+        start += prep + run
+        previous = experiment
+
+    return tecan_time, timeline, start
+
+
+def _format_time(seconds):
+    return '%d:%02d' % (int(seconds // 3600), int(seconds % 3600 // 60))
+
+
+def report_timeline(experiment_set, outfile=None):
+    """
+    Print the estimated timeline and makespan of a validated experiment set.
+
+    Parameters
+    ----------
+    experiment_set : ITCExperimentSet
+        The experiment set, with a Tecan worklist.
+    outfile : file, optional, default=None
+        File to write to; if None, print to standard output.
+
+    """
+    tecan_time, timeline, makespan = estimate_timeline(experiment_set)
+
+    lines = list()
+    lines.append("Tecan preparation: %s (h:mm)" % _format_time(tecan_time))
+    lines.append("%5s %-48s %8s %8s %8s" % ('#', 'experiment', 'start', 'prep', 'run'))
+    for (index, entry) in enumerate(timeline, start=1):
+        lines.append("%5d %-48s %8s %8s %8s" % (index, entry.name, _format_time(entry.start),
+                                                _format_time(entry.sample_prep_time), _format_time(entry.run_time)))
+    lines.append("Makespan: %s (h:mm) for %d experiments" % (_format_time(makespan), len(timeline)))
+
+    if outfile is None:
+        for line in lines:
+            print(line)
+    else:
+        for line in lines:
+            outfile.write(line + '\n')
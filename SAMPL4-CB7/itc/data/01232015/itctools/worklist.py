@@ -0,0 +1,337 @@
+"""
+Tecan EVOware worklists (.gwl) built as a buffer of pipetting commands.
+
+A worklist keeps the line format of each command, one format string per command type, and the fields of
+all commands in one flat list.  Nothing is formatted while commands are queued; the worklist is formatted
+when it is serialized, or streamed directly to an open file, one chunk of commands per formatting operation.
+
+The transfers queued on a worklist can be rescheduled by schedule() to use all LiHa channels, and
+worklists are compared with estimate_time().
+"""
+from collections import OrderedDict
+
+# Number of channels (tips) of the liquid handling arm.
+NCHANNELS = 8
+
+# Estimated durations of liquid handling arm operations (seconds), for comparing worklists.
+ASPIRATE_TIME = 6.0  # move to a source and aspirate, with liquid level detection
+DISPENSE_TIME = 4.0  # move to a destination and dispense
+WASH_TIME = 15.0  # wash all tips in the wash station
+
+# Line formats of the pipetting commands of the Tecan liquid handling arm (LiHa), with one '%' per field.
+# The fields of an aspirate or dispense are (RackLabel, RackType, Position, Volume, TipMask).
+ASPIRATE = 'A;%s;;%s;%d;;%f;;;%d\r\n'
+DISPENSE = 'D;%s;;%s;%d;;%f;;;%d\r\n'
+WASH = 'W;\r\n'
+BREAK = 'B;\r\n'
+# A transfer is an aspirate, a dispense and a wash; its fields are those of the aspirate followed by the dispense.
+TRANSFER = ASPIRATE + DISPENSE + WASH
+
+_nfields = dict((line_format, line_format.count('%')) for line_format in [ASPIRATE, DISPENSE, WASH, BREAK, TRANSFER])
+
+
+class Worklist(object):
+
+    def __init__(self):
+        """
+        An ordered list of Tecan pipetting commands.
+
+        Examples
+        --------
+
+        Transfer 100 microliters from a trough into the first well of a plate.
+
+        >>> from .labware import Labware, PipettingLocation
+        >>> worklist = Worklist()
+        >>> worklist.transfer(Labware('Buffer', 'Trough 100ml'), 1, PipettingLocation('DestinationPlate', 'ITC Plate', 1), 100.0, 1)
+        >>> worklist.flush()
+        >>> print(repr(str(worklist)))
+        'A;Buffer;;Trough 100ml;1;;100.000000;;;1\\r\\nD;DestinationPlate;;ITC Plate;1;;100.000000;;;1\\r\\nW;\\r\\nB;\\r\\n'
+
+        """
+        # Line format of each command, and the fields of all commands in order.
+        self.line_formats = list()
+        self.fields = list()
+        # Liquid of each transfer, for schedule().
+        self.liquids = list()
+
+    def __len__(self):
+        return len(self.line_formats)
+
+    def __iter__(self):
+        """
+        Iterate over the commands as (line format, fields) tuples.
+
+        """
+        offset = 0
+        for line_format in self.line_formats:
+            end = offset + _nfields[line_format]
+            yield (line_format, tuple(self.fields[offset:end]))
+            offset = end
+
+    def aspirate(self, labware, position, volume, tipmask):
+        """
+        Queue aspiration of liquid.
+
+        Parameters
+        ----------
+        labware : Labware or PipettingLocation
+           Labware to aspirate from.
+        position : int
+           Tecan well index to aspirate from.
+        volume : float
+           Volume in microliters.
+        tipmask : int
+           Bit mask of the tips to use.
+
+        """
+        self.line_formats.append(ASPIRATE)
+        self.fields += (labware.RackLabel, labware.RackType, position, volume, tipmask)
+
+    def dispense(self, labware, position, volume, tipmask):
+        """
+        Queue dispensing of liquid.
+
+        Parameters
+        ----------
+        labware : Labware or PipettingLocation
+           Labware to dispense into.
+        position : int
+           Tecan well index to dispense into.
+        volume : float
+           Volume in microliters.
+        tipmask : int
+           Bit mask of the tips to use.
+
+        """
+        self.line_formats.append(DISPENSE)
+        self.fields += (labware.RackLabel, labware.RackType, position, volume, tipmask)
+
+    def wash(self):
+        """
+        Queue washing of the tips.
+
+        """
+        self.line_formats.append(WASH)
+
+    def flush(self):
+        """
+        Execute the queued batch of commands.
+
+        """
+        self.line_formats.append(BREAK)
+
+    def transfer(self, source, source_position, destination, volume, tipmask, liquid=None):
+        """
+        Queue a transfer from a source to a destination pipetting location, followed by a tip wash.
+
+        Parameters
+        ----------
+        source : Labware or PipettingLocation
+           Labware to aspirate from.
+        source_position : int
+           Tecan well index to aspirate from.
+        destination : PipettingLocation
+           Location to dispense into.
+        volume : float
+           Volume in microliters.
+        tipmask : int
+           Bit mask of the tips to use.
+        liquid : str, optional, default=None
+           Name of the liquid transferred, which tips may carry without washing when scheduled.
+           If None, each source well is taken to hold a different liquid.
+
+        """
+        self.line_formats.append(TRANSFER)
+        self.fields += (source.RackLabel, source.RackType, source_position, volume, tipmask,
+                        destination.RackLabel, destination.RackType, destination.Position, volume, tipmask)
+        self.liquids.append(liquid)
+
+    @property
+    def transfers(self):
+        """
+        The transfers queued with transfer(), as (liquid, source_label, source_type, source_position,
+        destination_label, destination_type, destination_position, volume) tuples.
+
+        """
+        liquids = iter(self.liquids)
+        transfers = list()
+        for (line_format, fields) in self:
+            if line_format == TRANSFER:
+                liquid = next(liquids)
+                if liquid is None:
+                    liquid = (fields[0], fields[2])
+                transfers.append((liquid,) + fields[:3] + fields[5:8] + (fields[3],))
+        return transfers
+
+    def _chunks(self, chunk_size):
+        offset = 0
+        for start in range(0, len(self.line_formats), chunk_size):
+            line_formats = ''.join(self.line_formats[start:start + chunk_size])
+            end = offset + line_formats.count('%')
+            yield line_formats % tuple(self.fields[offset:end])
+            offset = end
+
+    def __str__(self):
+        return ''.join(self._chunks(4096))
+
+    def write(self, outfile, chunk_size=4096):
+        """
+        Write the worklist to an open file, without building the whole worklist as one string.
+
+        Parameters
+        ----------
+        outfile : file
+           The file to write to.
+        chunk_size : int, optional, default=4096
+           Number of commands formatted per write.
+
+        """
+        for chunk in self._chunks(chunk_size):
+            outfile.write(chunk)
+
+
+def expand(commands):
+    """
+    Iterate over single commands, splitting each transfer into its aspirate, dispense and wash.
+
+    Parameters
+    ----------
+    commands : sequence of (str, tuple)
+        The commands, such as a Worklist.
+
+    Yields
+    ------
+    command : (str, tuple)
+        The line format and fields of an aspirate, dispense, wash or break.
+
+    """
+    for (line_format, fields) in commands:
+        if line_format == TRANSFER:
+            yield (ASPIRATE, fields[:5])
+            yield (DISPENSE, fields[5:])
+            yield (WASH, ())
+        else:
+            yield (line_format, fields)
+
+
+def _parallel_key(line_format, fields):
+    # Commands with equal keys on distinct tips are performed in one movement of the arm:
+    # tips reach a trough together, or the wells of one column of a 96-well plate.
+    (rack_label, rack_type, position) = fields[:3]
+    if 'Trough' in rack_type:
+        return (line_format, rack_label)
+    if rack_type == 'ITC Plate':
+        return (line_format, rack_label, (position - 1) // 8)
+    return (line_format, rack_label, position)
+
+
+def estimate_time(commands):
+    """
+    Estimate the time the liquid handling arm takes to execute a sequence of commands.
+
+    Consecutive aspirates or dispenses that can be done in one movement of the arm by different tips
+    are counted once.
+
+    Parameters
+    ----------
+    commands : sequence of (str, tuple)
+        The commands, such as a Worklist.
+
+    Returns
+    -------
+    seconds : float
+        The estimated time in seconds.
+    nwashes : int
+        The number of wash cycles.
+
+    """
+    seconds = 0.0
+    nwashes = 0
+    key = None
+    tips = 0
+    for (line_format, fields) in expand(commands):
+        if line_format == ASPIRATE or line_format == DISPENSE:
+            command_key = _parallel_key(line_format, fields)
+            tipmask = fields[4]
+            if command_key != key or (tips & tipmask):
+                seconds += ASPIRATE_TIME if line_format == ASPIRATE else DISPENSE_TIME
+                key = command_key
+                tips = 0
+            tips |= tipmask
+        else:
+            if line_format == WASH:
+                seconds += WASH_TIME
+                nwashes += 1
+            key = None
+    return seconds, nwashes
+
+
+def schedule(transfers, nchannels=NCHANNELS):
+    """
+    Schedule transfers on all channels of the liquid handling arm, washing only when a tip changes liquid.
+
+    Transfers of the same liquid are grouped.  A liquid with at least nchannels transfers is pipetted
+    with all tips in rounds, without washing in between; the remaining transfers of all liquids are
+    packed onto distinct tips of shared rounds.  Each round is followed by a wash of the tips it used.
+
+    Parameters
+    ----------
+    transfers : list of tuple
+        The planned transfers, such as Worklist.transfers.
+    nchannels : int, optional, default=NCHANNELS
+        Number of tips.
+
+    Returns
+    -------
+    worklist : Worklist
+        The scheduled worklist, with the same transfers as aspirates and dispenses.
+
+    Notes
+    -----
+    Troughs are aspirated from at the position of each tip.
+    Transfers into the same destination may be reordered.
+
+    """
+    # Group transfers by liquid, in order of first use.
+    liquids = OrderedDict()
+    for transfer in transfers:
+        liquids.setdefault(transfer[0], list()).append(transfer)
+
+    # Each cycle is a list of rounds, with one transfer per tip; tips are washed after each cycle.
+    cycles = list()
+    remainders = list()
+    for group in liquids.values():
+        nfull = len(group) - len(group) % nchannels
+        if nfull > 0:
+            cycles.append([group[start:start + nchannels] for start in range(0, nfull, nchannels)])
+        if nfull < len(group):
+            remainders.append(group[nfull:])
+
+    # Pack the remainders into shared rounds, first fit in decreasing order of size.
+    shared_rounds = list()
+    for group in sorted(remainders, key=len, reverse=True):
+        for shared_round in shared_rounds:
+            if len(shared_round) + len(group) <= nchannels:
+                shared_round.extend(group)
+                break
+        else:
+            shared_rounds.append(list(group))
+    cycles.extend([shared_round] for shared_round in shared_rounds)
+
+    worklist = Worklist()
+    for cycle in cycles:
+        for transfer_round in cycle:
+            for (tip, transfer) in enumerate(transfer_round):
+                (liquid, source_label, source_type, source_position, destination_label, destination_type, destination_position, volume) = transfer
+                if 'Trough' in source_type:
+                    source_position = tip + 1
+                worklist.line_formats.append(ASPIRATE)
+                worklist.fields += (source_label, source_type, source_position, volume, 1 << tip)
+            for (tip, transfer) in enumerate(transfer_round):
+                (liquid, source_label, source_type, source_position, destination_label, destination_type, destination_position, volume) = transfer
+                worklist.line_formats.append(DISPENSE)
+                worklist.fields += (destination_label, destination_type, destination_position, volume, 1 << tip)
+        worklist.wash()
+        worklist.flush()
+    return worklist
@@ -31,6 +31,9 @@ import os
 from os.path import basename, splitext
 import numpy
 import logging
+import multiprocessing
+import functools
+import zlib
 from bitc.units import ureg, Quantity
 import pymc
 from bitc.report import Report, analyze
@@ -40,6 +43,14 @@ from bitc.instruments import known_instruments, Instrument
 from bitc.models import RescalingStep, known_models
 import sys
 
+# The results store is shared with the analysis scripts in the parent directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import results
+import stagecache
+import tracestats
+import convergence
+import chains
+
 try:
     import seaborn
 except ImportError:
@@ -47,23 +58,66 @@ except ImportError:
 
 
 def compute_normal_statistics(x_t):
-
-    # Compute mean.
-    x = x_t.mean()
-
-    # Compute stddev.
-    dx = x_t.std()
-
-    # Compute 95% confidence interval.
-    ci = 0.95
-    N = x_t.size
-    x_sorted = numpy.sort(x_t)
-    low_index = round((0.5-ci/2.0)*N)
-    high_index = round((0.5+ci/2.0)*N)
-    xlow = x_sorted[low_index]
-    xhigh = x_sorted[high_index]
-
-    return [x, dx, xlow, xhigh]
+    """Mean, standard deviation, and 95% confidence interval [x, dx, xlow, xhigh] of a trace."""
+    return tracestats.confidence_interval(x_t, ci=0.95)
+
+
+def pop_option(argv, option, default=None):
+    """Remove an option of the form '--option value' or '--option=value' from argv and return its value.
+
+    The bitc command line parser does not know about options that only this driver handles,
+    so they are taken out of sys.argv before it runs.
+    """
+    value = default
+    for index, argument in enumerate(argv):
+        if argument == option and index + 1 < len(argv):
+            value = argv[index + 1]
+            del argv[index:index + 2]
+            break
+        elif argument.startswith(option + '='):
+            value = argument.split('=', 1)[1]
+            del argv[index]
+            break
+    return value
+
+
+def experiment_seed(seed, experiment_name):
+    """Random number seed for one experiment, independent of the order and number of parallel jobs."""
+    return zlib.crc32(('%d:%s' % (seed, experiment_name)).encode('utf-8')) & 0x7fffffff
+
+
+class RecordCollector(logging.Handler):
+    """Logging handler that keeps records, so a worker's log can be replayed in order by the parent process."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = list()
+
+    def emit(self, record):
+        # Format now, so the record can be pickled back to the parent process.
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+# Options handled by this driver rather than the bitc parser.
+# --jobs N   number of experiments to analyze in parallel worker processes (default 1)
+# --seed S   base random number seed; each experiment derives its own seed from it (default 0)
+# --cache-dir D   directory of the stage cache, relative to the working directory; 'none' disables it (default cache)
+# --cache-size M  size bound of the stage cache in MB (default 1024)
+# --chains K      number of independent chains sampled per experiment, in parallel processes when --jobs is 1 (default 1)
+# --target-ess E  stop sampling once DeltaG and DeltaH reach E effective samples, with --niters as the largest
+#                 number of iterations; 'none' samples exactly --niters iterations (default none)
+njobs = int(pop_option(sys.argv, '--jobs', 1))
+seed = int(pop_option(sys.argv, '--seed', 0))
+cache_directory = pop_option(sys.argv, '--cache-dir', 'cache')
+if cache_directory.lower() in ['', 'none']:
+    cache_directory = None
+cache_bytes = int(float(pop_option(sys.argv, '--cache-size', 1024)) * 1024**2)
+nchains = int(pop_option(sys.argv, '--chains', 1))
+target_ess = pop_option(sys.argv, '--target-ess', 'none')
+target_ess = None if target_ess.lower() in ['', 'none'] else float(target_ess)
 
 validated = optparser()
 
@@ -116,13 +170,23 @@ if validated['mcmc']:
     nburn = validated['--nburn']    # number of burn-in iterations
     nthin = validated['--nthin']    # thinning period
     Model = known_models[validated['--model']]  # Model type for mcmc
+    parameter_names = ['DeltaG', 'DeltaH', 'DeltaH_0', 'Ls', 'P0', 'log_sigma']  # parameters traced by TwoComponent chains
+
+    # Analysis settings, which together with the data file identify the results in the results store.
+    configuration = {'model': validated['--model'], 'nfit': nfit, 'niters': niters, 'nburn': nburn, 'nthin': nthin, 'seed': seed, 'target_ess': target_ess, 'nchains': nchains}
+
+# Results of all experiments are recorded in one indexed store in the working directory.
+results_filename = 'results.db'
+
+# Digest of the analysis code, part of the key of every cached stage.
+code_digest = stagecache.source_digest([__file__, chains, convergence] + [sys.modules[name] for name in ['bitc.experiments', 'bitc.instruments', 'bitc.models', 'bitc.report', 'bitc.units']])
 
 instruments = list()
 
 # todo fix this flag for multiple files
 if validated['--instrument']:
     # Use an instrument from the brochure
-    instrument = [known_instruments[validated['--instrument']]()] * len(filenames)
+    instruments = [known_instruments[validated['--instrument']]()] * len(filenames)
 else:
     # Read instrument properties from the .itc or yml file
     for index, (filename, file_extension) in enumerate(zip(filenames,file_extensions)):
@@ -151,104 +215,236 @@ logging.debug(str(locals()))
 # Close all figure windows.
 import pylab
 pylab.close('all')
-logging.info("Reading ITC data from %s" % filename)
 
-# TODO make this a parallel loop?
-experiments = list()
-for filename, experiment_name, file_extension, instrument in zip(filenames, file_basenames, file_extensions, instruments):
+
+
+def sample_chain(index, chain):
+    """Fit and sample one chain of the two-component binding model for datafile number index.
+
+    The datafile is read by each chain, so that only the index is passed to chain processes.  Chain 0
+    starts sampling from the MAP fit of the model; the other chains start from a draw from the prior,
+    without a fit that would move them back to the same mode, so that they are dispersed.  Returns the
+    posterior samples of each parameter, the CPU time spent sampling, and the starting values.
+    """
+    numpy.random.seed(chains.chain_seed(experiment_seed(seed, file_basenames[index]), chain))
+    experiment = load_experiment(index)
+
+    # Construct a Model from Experiment object.
+    try:
+        model = Model(experiment)
+    except Exception as e:
+        logging.error(str(e))
+        logging.error(traceback.format_exc())
+        raise Exception("MCMC model could not me constructed!\n" + str(e))
+
+    if chain == 0:
+        # First fit the model.
+        # TODO This should be incorporated in the model. Perhaps as a model.getSampler() method?
+        logging.info("Fitting model...")
+        map = pymc.MAP(model)
+        map.fit(iterlim=nfit)
+        logging.info(map)
+    else:
+        model.mcmc.draw_from_prior()
+    initial_values = dict((name, float(model.mcmc.get_node(name).value)) for name in parameter_names)
+    logging.info("Chain %d starts from %s" % (chain, ", ".join("%s=%g" % (name, initial_values[name]) for name in parameter_names)))
+
+    logging.info("Sampling chain %d..." % chain)
+    progress_bar = (njobs == 1) and (nchains == 1)
+    initial_time = convergence.cpu_time()
+    if target_ess is None:
+        model.mcmc.sample(iter=niters, burn=nburn, thin=nthin, progress_bar=progress_bar)
+        traces = dict((name, numpy.asarray(model.mcmc.trace(name)[:])) for name in parameter_names)
+    else:
+        # Sample in chunks until this chain's share of the target effective sample size is reached.
+        monitor = convergence.ConvergenceMonitor(parameter_names, target_ess=target_ess / nchains)
+        traces = convergence.sample_pymc(model.mcmc, monitor, niters, nburn=nburn, nthin=nthin, progress_bar=progress_bar)
+    cpu_time = convergence.cpu_time() - initial_time
+
+    if chain == 0:
+        pymc.graph.dag(model.mcmc, name=model.experiment.name)
+
+    return traces, cpu_time, initial_values
+
+
+def sample_two_component(index, experiment):
+    """Sample the two-component binding model for one experiment in independent chains, writing trace plots.
+
+    Returns the merged posterior samples of all chains, with a 'chain' index, and the convergence
+    diagnostics of DeltaG and DeltaH across chains, so that the result can be cached.
+    """
+    per_chain = chains.run_chains(functools.partial(sample_chain, index), nchains)
+    traces = chains.merge_traces([chain_traces for chain_traces, cpu_time, initial_values in per_chain])
+    if nchains > 1:
+        starts = [tuple(initial_values[name] for name in parameter_names) for chain_traces, cpu_time, initial_values in per_chain]
+        if len(set(starts)) < nchains:
+            logging.warning("%s: chains share starting values, so split-Rhat across chains is not a dispersion test." % experiment.name)
+    #pymc.Matplot.plot(mcmc)
+
+    monitor = convergence.ConvergenceMonitor(parameter_names)
+    samples = numpy.dstack([chains.chain_array(traces, name) for name in parameter_names])
+    monitor.update(samples, sum(cpu_time for chain_traces, cpu_time, initial_values in per_chain))
+    diagnostics = monitor.diagnostics()
+    for name in monitor.monitored:
+        logging.info("%s %s: ESS %.1f, Rhat %.3f over %d chains, %.1f effective samples per CPU-second" % (experiment.name, name, diagnostics['effective_sample_size'][name],
+                     diagnostics['potential_scale_reduction'][name], nchains, diagnostics['effective_samples_per_second'][name]))
+
+    # Plot individual terms.
+    if sum(experiment.cell_concentration.values()) > Quantity('0.0 molar'):
+        pymc.Matplot.plot(traces['P0'], '%s-P0' % experiment.name)
+    if sum(experiment.syringe_concentration.values()) > Quantity('0.0 molar'):
+        pymc.Matplot.plot(traces['Ls'], '%s-Ls' % experiment.name)
+    pymc.Matplot.plot(traces['DeltaG'], '%s-DeltaG' % experiment.name)
+    pymc.Matplot.plot(traces['DeltaH'], '%s-DeltaH' % experiment.name)
+    pymc.Matplot.plot(traces['DeltaH_0'], '%s-DeltaH_0' % experiment.name)
+    pymc.Matplot.plot(numpy.exp(traces['log_sigma']), '%s-sigma' % experiment.name)
+
+    #  TODO: Plot fits to enthalpogram.
+    #experiment.plot(model=model, filename='%s-enthalpogram.png' %  experiment_name) # todo fix this
+
+    return traces, diagnostics
+
+
+def record_two_component(experiment_name, data_filename, traces, diagnostics):
+    """Record confidence intervals in thermodynamic parameters and sampler diagnostics in the results store."""
+    posterior_parameters = [
+        ('DeltaG', traces['DeltaG'], 'kcal/mol'),
+        ('DeltaH', traces['DeltaH'], 'kcal/mol'),
+        ('DeltaH_0', traces['DeltaH_0'], 'ucal'),
+        ('Ls', traces['Ls'], 'uM'),
+        ('P0', traces['P0'], 'uM'),
+        ('sigma', numpy.exp(traces['log_sigma']), 'ucal/s^(1/2)'),
+    ]
+    summary = tracestats.summarize(dict((parameter, x_t) for parameter, x_t, unit in posterior_parameters), quantiles=[0.025, 0.975])
+    posteriors = list()
+    for parameter, x_t, unit in posterior_parameters:
+        xlow, xhigh = summary[parameter]['quantiles']
+        posteriors.append({'parameter': parameter, 'unit': unit, 'mean': summary[parameter]['mean'], 'std': summary[parameter]['std'], 'low': xlow, 'high': xhigh, 'nsamples': summary[parameter]['nsamples']})
+    store = results.ResultsStore(results_filename)
+    analysis_id = store.begin_analysis(data_filename, experiment_name, configuration)
+    store.record_posteriors(analysis_id, posteriors)
+    for key, values in diagnostics.items():
+        store.record_diagnostics(analysis_id, key, values)
+    store.close()
+
+
+def run_stage(stage, inputs, compute, experiment_name):
+    """Run one pipeline stage of an experiment, or restore its result and output files from the stage cache.
+
+    The output files of a stage are the files named after the experiment that it writes.
+    """
+    if cache_directory is None:
+        return compute()
+    cache = stagecache.StageCache(cache_directory, max_bytes=cache_bytes, code=code_digest)
+    (key, value) = cache.run(stage, inputs, compute, output_prefix=experiment_name)
+    return value
+
+
+def load_experiment(index):
+    """Construct the experiment for datafile number index."""
+    filename = filenames[index]
+    experiment_name = file_basenames[index]
+    file_extension = file_extensions[index]
+    instrument = instruments[index]
+
     if file_extension in ['.yaml', '.yml']:
         logging.info("Experiment interpreted as literature data: %s" % experiment_name)
-        experiments.append(ExperimentYaml(filename, experiment_name, instrument))
+        return ExperimentYaml(filename, experiment_name, instrument)
     elif file_extension in ['.itc']:
         logging.info("Experiment interpreted as raw .itc data: %s" % experiment_name)
-        experiments.append(ExperimentMicroCal(filename, experiment_name, instrument))
+        return ExperimentMicroCal(filename, experiment_name, instrument)
     else:
         raise ValueError('Unknown file type. Check your file extension')
 
-logging.debug(str(experiments))
 
-# Only need to perform analysis for a .itc file.
-for experiment, file_extension in zip(experiments, file_extensions):
-    if file_extension in ['.itc']:
-        #  TODO work on a markdown version for generating reports. Perhaps use sphinx
-        analyze(experiment_name, experiment)
+def process_experiment(index):
+    """Parse, analyze, and (for the TwoComponent model) sample one datafile.
 
-# Write Origin-style integrated heats.
-for experiment, experiment_name in zip(experiments, file_basenames):
-    filename = experiment_name + '-integrated.txt'
-    experiment.write_integrated_heats(filename)
+    All output files of an experiment are named after it, so experiments can be processed in any
+    order by parallel workers.  The report and sampling stages are cached under a hash of the datafile
+    and the settings they depend on, so only stages whose inputs changed are rerun; changing only the
+    sampler settings does not redraw the report, and the datafile is not parsed at all if every stage
+    is cached.  Returns the log records of the experiment when run in a worker process.
+    """
+    collector = None
+    if multiprocessing.current_process().name != 'MainProcess':
+        # Keep this experiment's log together, to be replayed by the parent in datafile order.
+        collector = RecordCollector()
+        collector.setLevel(loglevel)
+        logging.getLogger().handlers = [collector]
 
-# Override the heats if file specified.
-# TODO deal with flag
-# if integrated_heats_file:
-#     experiment.read_integrated_heats(integrated_heats_file)
+    experiment_name = file_basenames[index]
+    numpy.random.seed(experiment_seed(seed, experiment_name))
 
-# MCMC inference
-if not validated['mcmc']:
-    sys.exit(0)
+    # The datafile is only parsed if a stage that needs the experiment is not cached.
+    loaded = list()
 
-# Construct a Model from Experiment object.
-import traceback
-if validated['--model'] == 'TwoComponent':
+    def experiment():
+        if not loaded:
+            logging.info("Reading ITC data from %s" % filenames[index])
+            loaded.append(load_experiment(index))
+            logging.debug(str(loaded[0]))
+        return loaded[0]
 
-    models = list()
-    try:
-        for experiment in experiments:
-            models.append(Model(experiment))
-    except Exception as e:
-            logging.error(str(e))
-            logging.error(traceback.format_exc())
-            raise Exception("MCMC model could not me constructed!\n" + str(e))
+    # Inputs of the parsed experiment, on which all stages depend.
+    raw = {'data': stagecache.file_digest(filenames[index]), 'extension': file_extensions[index], 'instrument': validated['--instrument']}
 
-    # First fit the model.
-    # TODO This should be incorporated in the model. Perhaps as a model.getSampler() method?
+    def report():
+        # Only need to perform analysis for a .itc file.
+        if file_extensions[index] in ['.itc']:
+            #  TODO work on a markdown version for generating reports. Perhaps use sphinx
+            analyze(experiment_name, experiment())
 
-    for model in models:
-        logging.info("Fitting model...")
-        map = pymc.MAP(model)
-        map.fit(iterlim=nfit)
-        logging.info(map)
+        # Write Origin-style integrated heats.
+        filename = experiment_name + '-integrated.txt'
+        experiment().write_integrated_heats(filename)
+
+    run_stage('report', raw, report, experiment_name)
+
+    # Override the heats if file specified.
+    # TODO deal with flag
+    # if integrated_heats_file:
+    #     experiment.read_integrated_heats(integrated_heats_file)
+
+    if validated['mcmc'] and validated['--model'] == 'TwoComponent':
+        sampling = dict(raw, model=validated['--model'], nfit=nfit, niters=niters, nburn=nburn, nthin=nthin, seed=seed, target_ess=target_ess, nchains=nchains)
+        traces, diagnostics = run_stage('mcmc', sampling, lambda: sample_two_component(index, experiment()), experiment_name)
+        record_two_component(experiment_name, filenames[index], traces, diagnostics)
+
+    pylab.close('all')
+
+    if collector is not None:
+        return collector.records
+    return list()
+
+
+# Analyze each datafile, in parallel worker processes if requested.
+import traceback
+indices = range(len(filenames))
+if njobs > 1:
+    pool = multiprocessing.Pool(njobs)
+    worker_logs = pool.map(process_experiment, indices, chunksize=1)
+    pool.close()
+    pool.join()
+    # Replay worker logs in datafile order.
+    for records in worker_logs:
+        for record in records:
+            logging.getLogger().handle(record)
+else:
+    for index in indices:
+        process_experiment(index)
+
+# MCMC inference
+# TwoComponent models were sampled per experiment above; the Competitive model is fit to all experiments jointly.
+if not validated['mcmc']:
+    sys.exit(0)
 
-        logging.info("Sampling...")
-        model.mcmc.sample(iter=niters, burn=nburn, thin=nthin, progress_bar=True)
-        #pymc.Matplot.plot(mcmc)
-
-        # Plot individual terms.
-        if sum(model.experiment.cell_concentration.values()) > Quantity('0.0 molar'):
-            pymc.Matplot.plot(model.mcmc.trace('P0')[:], '%s-P0' % model.experiment.name)
-        if sum(model.experiment.syringe_concentration.values()) > Quantity('0.0 molar'):
-            pymc.Matplot.plot(model.mcmc.trace('Ls')[:], '%s-Ls' % model.experiment.name)
-        pymc.Matplot.plot(model.mcmc.trace('DeltaG')[:], '%s-DeltaG' % model.experiment.name)
-        pymc.Matplot.plot(model.mcmc.trace('DeltaH')[:], '%s-DeltaH' % model.experiment.name)
-        pymc.Matplot.plot(model.mcmc.trace('DeltaH_0')[:], '%s-DeltaH_0' % model.experiment.name)
-        pymc.Matplot.plot(numpy.exp(model.mcmc.trace('log_sigma')[:]), '%s-sigma' % model.experiment.name)
-
-        #  TODO: Plot fits to enthalpogram.
-        #experiment.plot(model=model, filename='%s-enthalpogram.png' %  experiment_name) # todo fix this
-
-        # Compute confidence intervals in thermodynamic parameters.
-        outfile = open('%s.confidence-intervals.out' % model.experiment.name, 'a+')
-        outfile.write('%s\n' % model.experiment.name)
-        [x, dx, xlow, xhigh] = compute_normal_statistics(model.mcmc.trace('DeltaG')[:] )
-        outfile.write('DG:     %8.2f +- %8.2f kcal/mol     [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_normal_statistics(model.mcmc.trace('DeltaH')[:] )
-        outfile.write('DH:     %8.2f +- %8.2f kcal/mol     [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_normal_statistics(model.mcmc.trace('DeltaH_0')[:] )
-        outfile.write('DH0:    %8.2f +- %8.2f ucal         [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_normal_statistics(model.mcmc.trace('Ls')[:] )
-        outfile.write('Ls:     %8.2f +- %8.2f uM           [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_normal_statistics(model.mcmc.trace('P0')[:] )
-        outfile.write('P0:     %8.2f +- %8.2f uM           [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_normal_statistics(numpy.exp(model.mcmc.trace('log_sigma')[:]) )
-        outfile.write('sigma:  %8.5f +- %8.5f ucal/s^(1/2) [%8.5f, %8.5f] \n' % (x, dx, xlow, xhigh))
-        outfile.write('\n')
-        outfile.close()
-
-elif validated['--model'] == 'Competitive':
+if validated['--model'] == 'Competitive':
     if not validated['--receptor']:
         raise ValueError('Need to specify a receptor for Competitive model')
     else:
         receptor = validated['--receptor']
+    experiments = [load_experiment(index) for index in indices]
     try:
         for experiment in experiments:
             model = Model(experiments, receptor)
@@ -266,4 +462,4 @@ elif validated['--model'] == 'Competitive':
     model.mcmc.sample(iter=niters, burn=nburn, thin=nthin, progress_bar=True)
     pymc.Matplot.plot(model.mcmc, "MCMC.png")
 
-pymc.graph.dag(model.mcmc)
+    pymc.graph.dag(model.mcmc)
@@ -40,6 +40,7 @@
 #=============================================================================================
 
 import os
+import re
 import Units
 import Constants
 
@@ -48,6 +49,18 @@ import scipy.stats
 #from numpy import *
 import pymc
 
+import itcfile
+import binding
+import ensemble
+import posterior
+import convergence
+import baseline
+import integration
+import plots
+import results
+import stagecache
+import tracestats
+
 #=============================================================================================
 # Isothermal titration calorimeter instrument class.
 #=============================================================================================
@@ -78,39 +91,6 @@ class VPITC(Instrument):
         self.V0 = self.V0 - 0.044 * Units.mL # Tellinghuisen volume correction for VP-ITC
         return
     
-#=============================================================================================
-# Injection class.
-#=============================================================================================
-
-class Injection(object):
-    """
-    Data from a single injection.
-
-    Several types of information are stored about each injection:
-
-    * the ordinal number of the injection
-    * the programmed volume of the injection
-    * duration of the injection
-    * time between the beginning of the injection and the beginning of the next injection
-    * filtering period over which data channel is averaged to produce a single measurement of applied power
-
-    EXAMPLES
-
-    """
-    
-    #=============================================================================================
-    # Class data.
-    #=============================================================================================
-
-    number = None # sequence number of injection
-    volume = None # programmed volume of injection
-    duration = None # duration of injection 
-    spacing = None # time between beginning of injection and beginning of next injection
-    filter_period = None # time over which data channel is averaged to produce a single measurement of applied power
-
-    def __init__(self):
-        pass
-
 #=============================================================================================
 # ITC Experiment class
 #=============================================================================================
@@ -137,13 +117,19 @@ class Experiment(object):
     # Methods.
     #=============================================================================================
     
-    def __init__(self, data_filename):
+    def __init__(self, data_filename, cache=True, cache_directory=None, baseline='exponential', quadrature='rectangle'):
         """
         Initialize an experiment from a Microcal VP-ITC formatted .itc file.
 
         ARGUMENTS
           data_filename (String) - the filename of the Microcal VP-ITC formatted .itc file to initialize the experiment from
 
+        OPTIONAL ARGUMENTS
+          cache (bool) - if True, power measurements are memory-mapped from a binary sidecar cache written on first read (default: True)
+          cache_directory (String) - if specified, sidecar caches are kept in this directory instead of alongside the .itc file
+          baseline (String) - baseline model passed to fit_baseline() (default: 'exponential')
+          quadrature (String) - quadrature passed to integrate_heat() (default: 'rectangle')
+
         TODO
           * Add support for other formats of datafiles (XML, etc.).
 
@@ -160,24 +146,15 @@ class Experiment(object):
         self.syringe_contents = list() # concentrations of various species in syringe
         self.sample_cell_contents = list() # concentrations of various species in sample cell
         self.cell_volume = None # volume of liquid in sample cell        
-        self.injections = list() # list of injections (and their associated data)        
+        self.injections = itcfile.InjectionTable() # table of injections (and their associated data)
         self.filter_period_end_time = None      # time at end of filtering period
         self.filter_period_midpoint_time = None # time at midpoint of filtering period
         self.differential_power = None          # "differential" power applied to sample cell
         self.cell_temperature = None            # cell temperature
         
-        # Check to make sure we can access the file.
-        if not os.access(data_filename, os.R_OK):
-            raise "The file '%s' cannot be opened." % data_filename
-        
-        # Open the file and read is contents.
-        infile = open(filename, 'r')
-        lines = infile.readlines()
-        infile.close()
-
-        # Check the header to make sure it is a VP-ITC text-formatted .itc file.
-        if lines[0][0:4] != '$ITC':
-            raise "File '%s' doesn't appear to be a Microcal VP-ITC data file." % filename
+        # Read the header and power measurements.
+        data = itcfile.read_itc_file(data_filename, cache=cache, cache_directory=cache_directory)
+        lines = data['header']
 
         # Store the datafile filename.
         self.data_filename = data_filename
@@ -199,39 +176,7 @@ class Experiment(object):
 #        self.injections.append(injection)
         
         # Extract and store metadata about injections.
-        injection_number = 0
-        for line in lines[10:]:
-            if line[0]=='$':
-                # Increment injection counter.
-                injection_number += 1
-            
-                # Read data about injection.
-                (injection_volume, injection_duration, spacing, filter_period) = line[1:].strip().split(",")
-
-#                # Extract data for injection, applying appropriate unit conversions.
-#                injection = Injection()
-#                injection.number = injection_number # sequence number of injection
-#                injection.volume = float(injection_volume) * Units.ul # volume of injection
-#                injection.duration = float(injection_duration) * Units.s # duration of injection 
-#                injection.spacing = float(spacing) * Units.s # time between beginning of injection and beginning of next injection
-#                injection.filter_period = float(filter_period) * Units.s # time over which data channel is averaged to produce a single measurement
-#
-#                # Store the injection
-#                self.injections.append(injection)
-                
-                # Extract data for injection and apply appropriate unit conversions.                
-                injection = dict()
-                injection['number'] = injection_number
-                injection['volume'] = float(injection_volume) * Units.ul # volume of injection
-                injection['duration'] = float(injection_duration) * Units.s # duration of injection 
-                injection['spacing'] = float(spacing) * Units.s # time between beginning of injection and beginning of next injection
-                injection['filter_period'] = float(filter_period) * Units.s # time over which data channel is averaged to produce a single measurement
-
-                # Store injection.
-                self.injections.append(injection)
-
-            else:
-                break
+        self.injections = itcfile.InjectionTable.from_dicts(itcfile.parse_injections(lines))
 
         # Store additional data about experiment.
         parsecline = 11 + self.number_of_injections
@@ -240,60 +185,15 @@ class Experiment(object):
         self.cell_volume = float(lines[parsecline+2][1:].strip()) * Units.ml # cell volume
         self.injection_tick = [0] 
 
-        # Allocate storage for power measurements.
-        self.time = list() 
-        self.heat = list()
-        self.temperature = list()
-
-        # Extract lines containing heat measurements.
-        for (index,line) in enumerate(lines):
-            if line[:2]=='@0':
-                break
-        measurement_lines = lines[index:]
-
-        # Count number of power measurements.
-        nmeasurements = 0
-        for line in measurement_lines:
-            if line[0] != '@':
-                nmeasurements += 1
-        print "There are %d power measurements." % nmeasurements
-                            
         # Store data about measured heat liberated during each injection.
-        self.filter_period_end_time = numpy.zeros([nmeasurements], numpy.float64) # time at end of filtering period (s)
-        self.differential_power = numpy.zeros([nmeasurements], numpy.float64) # "differential" power applied to sample cell (ucal/s)
-        self.cell_temperature = numpy.zeros([nmeasurements], numpy.float64) # cell temperature (K)
-        self.jacket_temperature = numpy.zeros([nmeasurements], numpy.float64) # adiabatic jacket temperature (K)
-
-        # Process data.
-        nmeasurements = 0
-        injection_labels = list()
-        for (index,line) in enumerate(measurement_lines):
-            if line[0]=='@':
-                injection_labels.append(nmeasurements)
-            else:
-                # Extract data for power measurement.
-                # TODO: Auto-detect file format?
-                #
-                jacket_temperature = 0.0
-                try:
-                    (time, power, temperature, a, jacket_temperature, c, d, e, f) = line.strip().split(",") # Berkeley Auto iTC-200
-                except:
-                    try:
-                        (time, power, temperature, a, jacket_temperature, c, d) = line.strip().split(",") # works with Shoichet lab VP-ITC .itc files---what are other readings (a,b,c,d)?
-                    except:                                                                               # b looks like adiabatic jacket temperature (~1 degree C below sample temperature)
-                        (time, power, temperature) = line.strip().split(",") # works with David Minh's VP-ITC .itc files                
-                
-                # Store data about this measurement.
-                self.filter_period_end_time[nmeasurements] = float(time) * Units.s 
-                self.differential_power[nmeasurements] = float(power) * Units.ucal/Units.s 
-                self.cell_temperature[nmeasurements] = float(temperature) + Constants.absolute_zero  # in Kelvin
-                self.jacket_temperature[nmeasurements] = float(jacket_temperature) + Constants.absolute_zero  # in Kelvin
-
-                nmeasurements += 1
-        number_of_injections_read = len(injection_labels) - 1# number of injections read, not including @0
+        self.filter_period_end_time = data['filter_period_end_time'] # time at end of filtering period (s)
+        self.differential_power = data['differential_power'] # "differential" power applied to sample cell (ucal/s)
+        self.cell_temperature = data['cell_temperature'] # cell temperature (K)
+        self.jacket_temperature = data['jacket_temperature'] # adiabatic jacket temperature (K)
+        nmeasurements = self.filter_period_end_time.size
+        print "There are %d power measurements." % nmeasurements
+        number_of_injections_read = data['first_index'].size # number of injections read, not including @0
 
-        print injection_labels
-                        
         # Perform a self-consistency check on the data to make sure all injections are accounted for.        
         if (number_of_injections_read != self.number_of_injections):
             print 'WARNING'
@@ -309,145 +209,116 @@ class Experiment(object):
         print "self.injections has %d elements" % (len(self.injections))
         
         # Annotate list of injections.
+        self.injections['first_index'] = data['first_index'][self.injections['number'] - 1]
+        self.injections['last_index'] = data['last_index'][self.injections['number'] - 1]
         for injection in self.injections:
-            injection_number = injection['number']
-            print "%5d %8d" % (injection_number, injection_labels[injection_number])
-            injection['first_index'] = injection_labels[injection_number]
-            if (injection_number < len(injection_labels)-1):
-                injection['last_index'] = injection_labels[injection_number+1] - 1
-            else:
-                injection['last_index'] = nmeasurements - 1
+            print "%5d %8d" % (injection['number'], injection['first_index'])
 
         # Fit baseline.
-        self.fit_baseline()
+        self.fit_baseline(model=baseline)
                 
         # Integrate heat evolved from each injection.
-        self.integrate_heat()
+        self.integrate_heat(quadrature=quadrature)
             
         return
 
-    def fit_baseline(self):
+    def fit_baseline(self, model='exponential'):
         """
-        Fit the baseline using a simple shifted exponential functional form:
+        Fit the baseline to the data prior to the first injection and the last 5% of each injection.
+
+        The default model is a simple shifted exponential functional form:
 
         y = c * exp[-k*(x-x0)] + y0
 
         where parameters (c, k, x0, y0) are fit parameters.
 
+        OPTIONAL ARGUMENTS
+          model (String) - baseline model from baseline.known_baseline_models (default: 'exponential')
+
+        NOTES
+          The fitted baseline is kept in self.baseline.  The window or model of single injections can be
+          changed there, followed by self.refit_baseline(), which recomputes only the affected segments.
+
         """
         
-        import scipy.optimize    
-
-        def _eNegX_(p,x):
-            [x0,y0,c,k] = p
-            y = (c * numpy.exp(-k*(x-x0))) + y0
-            return y
-
-        def _eNegX_residuals(p,x,y):
-            return y - _eNegX_(p,x)
-
-        def _eNegX_error(p,x,y):
-            return numpy.sum( (y - _eNegX_(p,x))**2 )
-
-        def Get_eNegX_Coefficients(x,y,p_guess):
-            # Calls the leastsq() function, which calls the residuals function with an initial
-            # guess for the parameters and with the x and y vectors.  Note that the residuals
-            # function also calls the _eNegX_ function.  This will return the parameters p that
-            # minimize the least squares error of the _eNegX_ function with respect to the original
-            # x and y coordinate vectors that are sent to it.
-            #[p, cov, infodict, mesg, ier] = scipy.optimize.leastsq(_eNegX_residuals,p_guess,args=(x,y),full_output=1,warning=True) # works with older scipy
-            [p, cov, infodict, mesg, ier] = scipy.optimize.leastsq(_eNegX_residuals,p_guess,args=(x,y),full_output=1) # works with EPD 7.0 scipy
-
-            return p
-
-        # Form list of data to fit.
-        x = list()
-        y = list()
-        fit_indices = list()
-        # Add data prior to first injection
-        for index in range(0, self.injections[0]['first_index']):
-            x.append(self.filter_period_end_time[index])
-            y.append(self.differential_power[index])
-        # Add last 5% of each injection.
-        for injection in self.injections:
-            start_index = injection['first_index']
-            end_index = injection['last_index'] + 1
-            start_index = end_index - int((end_index - start_index) * 0.05)
-            for index in range(start_index,end_index):                
-                x.append(self.filter_period_end_time[index])
-                y.append(self.differential_power[index])
-                fit_indices.append(index)
-        x = numpy.array(x)
-        y = numpy.array(y)
+        # Select data prior to first injection and last 5% of each injection, and fit.
+        first_index = self.injections['first_index']
+        last_index = self.injections['last_index']
+        self.baseline = baseline.Baseline(self.filter_period_end_time, self.differential_power, first_index, last_index, model=model, fraction=0.05)
 
         # Store list of data to which base line was fitted.
-        self.baseline_fit_data = { 'x' : x, 'y' : y, 'indices' : fit_indices }
+        self.baseline_fit_data = self.baseline.fit_data()
 
-        print "Fitting data:"
-        print x
-        print y
+        print "Fitted %s baseline to %d measurements." % (model, self.baseline_fit_data['x'].size)
 
-        # Perform nonlinear fit using multiple guesses.
+        # Store baseline fit parameters.
         # Parameters are [x0, y0, c, k].
-        p_guesses = list()
-        p_guesses.append( (numpy.median(x), numpy.min(y), numpy.max(y), 0.01) )
-        p_guesses.append( (numpy.median(x), numpy.min(y), -numpy.max(y), -0.01) )
-        p_guesses.append( (numpy.median(x), numpy.min(y), numpy.max(y), -0.01) )
-        p_guesses.append( (numpy.median(x), numpy.min(y), -numpy.max(y), 0.01) )        
-        p_fits = list()
-        for p_guess in p_guesses:
-            p = Get_eNegX_Coefficients(x,y,p_guess)
-            p_fits.append(p)
-        # Find best fit.
-        minimal_error = _eNegX_error(p_fits[0], x, y)
-        minimal_error_index = 0
-        for index in range(1,len(p_fits)):
-            error = _eNegX_error(p_fits[index], x, y)
-            if (error < minimal_error):
-                minimal_error = error
-                minimal_error_index = index
-        p = p_fits[minimal_error_index]
-        # Unpack fit parameters
-        [x0,y0,c,k] = p
-        xfit = self.filter_period_end_time[:]
-        yfit = _eNegX_(p,xfit)
+        self.baseline_fit_parameters = self.baseline.exponential_parameters
 
         # DEBUG
-        print "Fit parameters: [x0, y0, c, k]"
-        print p        
-
-        # Store baseline fit parameters.
-        self.baseline_fit_parameters = p
+        if self.baseline_fit_parameters is not None:
+            print "Fit parameters: [x0, y0, c, k]"
+            print self.baseline_fit_parameters
 
         # Store baseline
-        self.baseline_power = numpy.array(yfit)        
+        self.baseline_power = self.baseline.baseline_power
         
         return 
 
-    def integrate_heat(self):
+    def refit_baseline(self):
+        """
+        Recompute the baseline over segments whose fit window or model was changed in self.baseline,
+        and integrate the heats again with the same quadrature.
+
+        RETURNS
+          segments (list of int) - segments that were recomputed (0 for pre-injection data, n for injection n)
+
+        """
+
+        segments = self.baseline.update()
+        self.baseline_fit_data = self.baseline.fit_data()
+        self.baseline_fit_parameters = self.baseline.exponential_parameters
+
+        # The evolved heats depend on the baseline power.
+        if segments:
+            self.integrate_heat(quadrature=self.quadrature)
+
+        return segments
+
+    def integrate_heat(self, quadrature='rectangle'):
         """
         Compute the heat evolved from each injection from differental power timeseries data.
 
+        OPTIONAL ARGUMENTS
+          quadrature (String) - 'rectangle' to treat each measurement as the average over its filter period,
+            or 'trapezoid' to integrate over the recorded measurement times (default: 'rectangle')
+
+        NOTES
+          Besides setting the 'evolved_heat' column of self.injections, this stores one-dimensional arrays over injections:
+          self.evolved_heats, self.injection_end_times, and self.heat_noise (standard deviation of each heat due
+          to measurement noise).
+
         """
 
-        # Integrate heat produced by each injection.
-        for injection in self.injections:
-            # determine initial and final samples for injection i
-            first_index = injection['first_index'] # index of timepoint for first filtered differential power measurement
-            last_index  = injection['last_index']  # index of timepoint for last filtered differential power measurement
-            
-            # Determine excess energy input into sample cell (with respect to reference cell) throughout this injection and measurement period.
-            #excess_energy_input = injection['filter_period'] * (self.differential_power[first_index:(last_index+1)] - self.reference_power + self.baseline_power[first_index:(last_index+1)]).sum()
-            excess_energy_input = injection['filter_period'] * (self.differential_power[first_index:(last_index+1)] - self.baseline_power[first_index:(last_index+1)]).sum()            
+        # determine initial and final samples for each injection
+        first_index = self.injections['first_index'] # index of timepoint for first filtered differential power measurement
+        last_index = self.injections['last_index'] # index of timepoint for last filtered differential power measurement
+        filter_period = self.injections['filter_period']
 
-            # DEBUG
-            print "injection %d, filter period %f s, integrating sample %d to %d" % (injection['number'], injection['filter_period'] / Units.s, first_index, last_index)
-            
-            # Determine total heat evolved.
-            evolved_heat = - excess_energy_input
-            
-            # Store heat evolved from this injection.
-            injection['evolved_heat'] = evolved_heat
+        # Integrate heat produced by all injections.
+        self.quadrature = quadrature
+        data = integration.integrate_injections(self.filter_period_end_time, self.differential_power, self.baseline_power, first_index, last_index, filter_period, quadrature=quadrature)
+
+        self.evolved_heats = data['evolved_heat']
+        self.injection_end_times = data['end_time']
+        self.heat_noise = data['heat_noise']
+
+        # Store heat evolved from each injection.
+        self.injections['evolved_heat'] = self.evolved_heats
+
+        # DEBUG
+        for injection in self.injections:
+            print "injection %d, filter period %f s, integrating sample %d to %d" % (injection['number'], injection['filter_period'] / Units.s, injection['first_index'], injection['last_index'])
             
         return
 
@@ -492,7 +363,9 @@ class Experiment(object):
         Ls = self.syringe_concentration
         
         string = "%12s %5s %12s %12s %12s %12s\n" % ("DH", "INJV", "Xt", "Mt", "XMt", "NDH")
-        for (n, injection) in enumerate(self.injections):
+        evolved_heat = self.injections['evolved_heat']
+        volume = self.injections['volume']
+        for n in range(len(self.injections)):
             # Instantaneous injection model (perfusion)
 #            d = 1.0 - (DeltaV / V0) # dilution factor (dimensionless)
 #            P = V0 * P0 * d**(n+1) # total quantity of protein in sample cell after n injections (mol)
@@ -507,7 +380,7 @@ class Experiment(object):
             NDH = 0.0 # Not sure what this is
 
             # Form string.
-            string += "%12.5f %5.1f %12.5f %12.5f %12.5f %12.5f\n" % (injection['evolved_heat'] / Units.ucal, injection['volume'] / Units.ul, Pn / Units.mM, Ln / Units.mM, PLn / Units.mM, NDH)
+            string += "%12.5f %5.1f %12.5f %12.5f %12.5f %12.5f\n" % (evolved_heat[n] / Units.ucal, volume[n] / Units.ul, Pn / Units.mM, Ln / Units.mM, PLn / Units.mM, NDH)
 
         # Final line.
         string += "        --      %12.5f %12.5f --\n" % (Pn, Ln)
@@ -533,218 +406,39 @@ class Experiment(object):
 
         return
         
-    def plot(self, filename=None, model=None):
+    def plot(self, filename=None, model=None, trace=None, max_points=None):
         """
         Generate an enthalpogram plot showing fitted models.
 
         OPTIONAL ARGUMENTS
           filename (String) - if specified, the plot will be written to the specified file instead of plotted to the screen.
+          model (dict) - the PyMC model returned by buildModel(); if specified with trace, the posterior predictive median and 95% credible band of the injection heats are overlaid
+          trace (pymc.MCMC or ensemble.EnsembleSampler) - sampler holding posterior samples of the model parameters
+          max_points (int) - maximum number of power measurements plotted; 0 to plot all (default: plots.MAX_POINTS_PER_PANEL if writing a file)
           
         """
 
-        #import matplotlib
-        #if (filename != None): matplotlib.use('pdf')
+        # Summarize model fits, if specified.
+        predictive = None
+        if (model is not None) and (trace is not None):
+            predictive = computePosteriorPredictive(self, model, trace)
 
-        import pylab
-        pylab.figure()
-        fontsize = 8
-        markersize = 5
+        plots.render_enthalpogram(self, filename=filename, predictive=predictive, max_points=max_points)
 
-        #
-        # Plot the raw measurements of differential power versus time and the enthalpogram.
-        #
-
-        pylab.subplot(211)
-        pylab.hold(True)
-
-        # Plot baseline fit.
-        pylab.plot(self.filter_period_end_time / Units.s, self.baseline_power / (Units.ucal/Units.s), 'g-')
-        
-        # Plot differential power.
-        pylab.plot(self.filter_period_end_time / Units.s, self.differential_power / (Units.ucal/Units.s), 'k.', markersize=markersize)
-
-        # Plot injection time markers.
-        [xmin, xmax, ymin, ymax] = pylab.axis()
-        for injection in self.injections:
-            last_index = injection['first_index'] # timepoint at start of syringe injection
-            t = self.filter_period_end_time[last_index] / Units.s
-            pylab.plot([t, t], [ymin, ymax], 'r-')    
-
-        # Label plot axes.
-        xlabel = pylab.xlabel('time / s')
-        xlabel.set_fontsize(fontsize)
-        ylabel = pylab.ylabel('differential power / ucal/s')
-        ylabel.set_fontsize(fontsize)
-
-        # Change tick label font sizes.
-        ax = pylab.gca()
-        for tick in ax.xaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-        for tick in ax.yaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-
-        # title plot
-        title = pylab.title(self.data_filename)
-        title.set_fontsize(fontsize)
-
-        pylab.hold(False)
-
-        #
-        # Plot integrated heats and model fits.
-        #
-        
-        pylab.subplot(212)
-        pylab.hold(True)
-
-        # Determine injection end times.
-        injection_end_times = numpy.zeros([len(self.injections)], numpy.float64)
-        for (index, injection) in enumerate(self.injections):
-            # determine initial and final samples for injection 
-            first_index = injection['first_index'] # index of timepoint for first filtered differential power measurement
-            last_index  = injection['last_index']  # index of timepoint for last filtered differential power measurement
-            # determine time at end of injection period
-            injection_end_times[index] = self.filter_period_end_time[last_index] / Units.s
-
-        # Plot model fits, if specified.
-        if model:            
-            P0_n = model.trace('P0')[:]
-            Ls_n = model.trace('Ls')[:]            
-            DeltaG_n = model.trace('DeltaG')[:]
-            DeltaH_n = model.trace('DeltaH')[:]
-            DeltaH0_n = model.trace('DeltaH_0')[:]
-            N = DeltaG_n.size
-            for n in range(N):
-                expected_injection_heats = mcmc.q_n.parents['mu']._eval_fun
-                q_n = expected_injection_heats(DeltaG=DeltaG_n[n], DeltaH=DeltaH_n[n], DeltaH_0=DeltaH0_n[n], P0=P0_n[n], Ls=Ls_n[n])
-                pylab.plot(injection_end_times/ Units.s, q_n / Units.ucal, 'r-', linewidth=1)
-
-        # Plot integrated heats.
-        for (index, injection) in enumerate(self.injections):
-            # determine time at end of injection period
-            t = injection_end_times[index] / Units.s
-            # plot a point there to represent total heat evolved in injection period
-            y = injection['evolved_heat'] / Units.ucal
-            pylab.plot(t, y, 'k.', markersize=markersize)
-            #pylab.plot([t, t], [0, y], 'k-') # plot bar from zero line
-            # label injection
-            pylab.text(t, y, '%d' % injection['number'], fontsize=6)        
-
-        # Adjust axes to match first plot.
-        [xmin_new, xmax_new, ymin, ymax] = pylab.axis()
-        pylab.axis([xmin, xmax, ymin, ymax])    
-
-        # Label axes.
-        #pylab.title('evolved heat per injection')
-        xlabel = pylab.xlabel('time / s')
-        xlabel.set_fontsize(fontsize)
-        ylabel = pylab.ylabel('evolved heat / ucal')
-        ylabel.set_fontsize(fontsize)
-
-        # Plot zero line.
-        pylab.plot(experiment.filter_period_end_time / Units.s, 0.0*experiment.filter_period_end_time / (Units.ucal/Units.s), 'g-') # plot zero line
-
-        # Adjust font sizes for tick labels.
-        ax = pylab.gca()
-        for tick in ax.xaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-        for tick in ax.yaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-
-        pylab.hold(False)
-
-        #        
-        # Send plot to appropriate output device.
-        #
-
-        if (filename != None):
-            # Save the plot to the specified file.
-            pylab.savefig(filename, dpi=150)
-        else:
-            # Show plot.
-            pylab.show()
-              
         return
 
-    def plot_baseline(self, filename=None):
+    def plot_baseline(self, filename=None, max_points=None):
         """
         Generate an close-up view of the baseline.
 
         OPTIONAL ARGUMENTS
           filename (String) - if specified, the plot will be written to the specified file instead of plotted to the screen.
+          max_points (int) - maximum number of power measurements plotted; 0 to plot all (default: plots.MAX_POINTS_PER_PANEL if writing a file)
           
         """
 
-        #import matplotlib
-        #if (filename != None): matplotlib.use('pdf')
-
-        import pylab
-        pylab.figure()
-        fontsize = 8
-        markersize = 5
+        plots.render_baseline(self, filename=filename, max_points=max_points)
 
-        #
-        # Plot close-up of baseline.
-        #
-        
-        #pylab.subplot(212)
-        pylab.hold(True)
-
-        # Plot baseline fit.
-        pylab.plot(self.filter_period_end_time / Units.s, self.baseline_power / (Units.ucal/Units.s), 'g-')
-        
-        # Plot differential power.
-        indices = list(set(range(len(self.differential_power))) - set(self.baseline_fit_data['indices']))
-        pylab.plot(self.filter_period_end_time[indices] / Units.s, self.differential_power[indices] / (Units.ucal/Units.s), 'k.', markersize=markersize)
-        
-        # Plot differential power.
-        indices = self.baseline_fit_data['indices']
-        pylab.plot(self.filter_period_end_time[indices] / Units.s, self.differential_power[indices] / (Units.ucal/Units.s), 'r.', markeredgecolor='r', markersize=markersize)
-
-        # Plot injection time markers.
-        [xmin, xmax, ymin, ymax] = pylab.axis()
-        for injection in self.injections:
-            last_index = injection['first_index'] # timepoint at start of syringe injection
-            t = self.filter_period_end_time[last_index] / Units.s
-            pylab.plot([t, t], [ymin, ymax], 'r-')    
-
-        # Adjust axis to zoom in on baseline.
-        ymax = self.baseline_power.max() / (Units.ucal/Units.s)
-        ymin = self.baseline_power.min() / (Units.ucal/Units.s)
-        width = ymax - ymin
-        ymax += width/2
-        ymin -= width/2
-        pylab.axis([xmin, xmax, ymin, ymax]) 
-
-        # Label plot axes.
-        xlabel = pylab.xlabel('time / s')
-        xlabel.set_fontsize(fontsize)
-        ylabel = pylab.ylabel('differential power / ucal/s')
-        ylabel.set_fontsize(fontsize)
-
-        # Change tick label font sizes.
-        ax = pylab.gca()
-        for tick in ax.xaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-        for tick in ax.yaxis.get_major_ticks():
-            tick.label1.set_fontsize(fontsize)
-
-        # title plot
-        title = pylab.title(self.data_filename)
-        title.set_fontsize(fontsize)
-
-        pylab.hold(False)
-
-        #        
-        # Send plot to appropriate output device.
-        #
-
-        if (filename != None):
-            # Save the plot to the specified file.
-            pylab.savefig(filename, dpi=150)
-        else:
-            # Show plot.
-            pylab.show()
-              
         return
 
 #=============================================================================================
@@ -911,12 +605,11 @@ reference power & %(reference_power).3f $\mu$cal/s \\
         
         return
     
-def analyze(name, experiment, output_filename):
+def analyze(name, experiment, output_filename, max_points=None):
     
     # Write text-based rendering of experimental data.
-    for (index, experiment) in enumerate(experiments):
-        print "EXPERIMENT %d" % index
-        print str(experiment)
+    print "EXPERIMENT %s" % name
+    print str(experiment)
 
     # DEBUG: Write power
     #experiment.write_power('realtime.dat')
@@ -943,127 +636,8 @@ def analyze(name, experiment, output_filename):
     #report.writeLaTeX('report.tex')
     #exit(1)
 
-    # Plot the raw measurements of differential power versus time and the enthalpogram.
-    import pylab
-    pylab.figure()
-
-    fontsize = 8
-
-    # Plot differential power versus time.
-    pylab.subplot(411)
-
-    # plot baseline fit
-    pylab.hold(True)
-    pylab.plot(experiment.filter_period_end_time / Units.s, experiment.baseline_power / (Units.ucal/Units.s), 'g-') # plot baseline fit
-
-    # differential power
-    pylab.plot(experiment.filter_period_end_time / Units.s, experiment.differential_power / (Units.ucal/Units.s), 'k.', markersize=1)
-    # plot red vertical line to mark injection times
-    pylab.hold(True)    
-    [xmin, xmax, ymin, ymax] = pylab.axis()
-
-    # DEBUG
-#    ymax = experiment.differential_power.max() / (Units.ucal/Units.s)
-#    ymin = ymax - 0.3
-#    pylab.axis([xmin, xmax, ymin, ymax]) 
-    
-    for injection in experiment.injections:
-        last_index = injection['first_index'] # timepoint at start of syringe injection
-        t = experiment.filter_period_end_time[last_index] / Units.s
-        pylab.plot([t, t], [ymin, ymax], 'r-')    
-    pylab.hold(False)
-    xlabel = pylab.xlabel('time / s')
-    xlabel.set_fontsize(fontsize)
-    ylabel = pylab.ylabel('differential power / ucal/s')
-    ylabel.set_fontsize(fontsize)
-
-    ax = pylab.gca()
-    for tick in ax.xaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-    for tick in ax.yaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-
-    # title plot
-    title = pylab.title(name)
-    title.set_fontsize(fontsize)
-    
-    # Plot enthalpogram.
-    pylab.subplot(412)
-    pylab.hold(True)
-    for injection in experiment.injections:
-        # determine initial and final samples for injection i
-        first_index = injection['first_index'] # index of timepoint for first filtered differential power measurement
-        last_index  = injection['last_index']  # index of timepoint for last filtered differential power measurement
-        # determine time at end of injection period
-        t = experiment.filter_period_end_time[last_index] / Units.s
-        # plot a point there to represent total heat evolved in injection period
-        y = injection['evolved_heat'] / Units.ucal
-        pylab.plot([t, t], [0, y], 'k-')
-        # label injection
-        pylab.text(t, y, '%d' % injection['number'], fontsize=6)        
-    # adjust axes to match first plot
-    [xmin_new, xmax_new, ymin, ymax] = pylab.axis()
-    pylab.axis([xmin, xmax, ymin, ymax])    
-    pylab.hold(False)
-    #pylab.title('evolved heat per injection')
-    xlabel = pylab.xlabel('time / s')
-    xlabel.set_fontsize(fontsize)
-    ylabel = pylab.ylabel('evolved heat / ucal')
-    ylabel.set_fontsize(fontsize)
-    # plot zero
-    pylab.hold(True)
-    pylab.plot(experiment.filter_period_end_time / Units.s, 0.0*experiment.filter_period_end_time / (Units.ucal/Units.s), 'g-') # plot zero line
-
-
-    ax = pylab.gca()
-    for tick in ax.xaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-    for tick in ax.yaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-                    
-    # Plot cell temperature.
-    pylab.subplot(413)
-    pylab.hold(True)
-    pylab.plot(experiment.filter_period_end_time / Units.s, experiment.cell_temperature/Units.K - Constants.absolute_zero, 'r.', markersize=1)
-    # adjust axes to match first plot
-    [xmin_new, xmax_new, ymin, ymax] = pylab.axis()
-    pylab.axis([xmin, xmax, ymin, ymax])    
-    pylab.hold(False)
-    #pylab.title('evolved heat per injection')
-    xlabel = pylab.xlabel('time / s')
-    xlabel.set_fontsize(fontsize)
-    ylabel = pylab.ylabel('cell temperature / C')
-    ylabel.set_fontsize(fontsize)
-
-    ax = pylab.gca()
-    for tick in ax.xaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-    for tick in ax.yaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-
-    # Plot adiabatic jacket temperature.
-    pylab.subplot(414)
-    pylab.hold(True)
-    pylab.plot(experiment.filter_period_end_time / Units.s, experiment.jacket_temperature/Units.K - Constants.absolute_zero, 'b.', markersize=1)    
-    # adjust axes to match first plot
-    [xmin_new, xmax_new, ymin, ymax] = pylab.axis()
-    pylab.axis([xmin, xmax, ymin, ymax])    
-    pylab.hold(False)
-    #pylab.title('evolved heat per injection')
-    xlabel = pylab.xlabel('time / s')
-    xlabel.set_fontsize(fontsize)
-    ylabel = pylab.ylabel('jacket temperature / C')
-    ylabel.set_fontsize(fontsize)
-    
-    ax = pylab.gca()
-    for tick in ax.xaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-    for tick in ax.yaxis.get_major_ticks():
-        tick.label1.set_fontsize(fontsize)
-
-    # show plot
-    #pylab.show()
-    pylab.savefig(output_filename, orientation='landscape', papertype='letter', format='pdf')
+    # Plot the raw measurements of differential power versus time, the enthalpogram, and the cell and jacket temperatures.
+    plots.render_analysis(experiment, name, output_filename, max_points=max_points)
 
     #=============================================================================================
     # Binding model.
@@ -1134,15 +708,11 @@ def buildModel(experiment):
     dLs = 0.0049 * Ls_stated # uncertainty in ligand stated concentration (M) - from gravimetric/volumetric preparation
 
     # Extract evolved injection heats.
-    injection_heats = numpy.zeros([N], numpy.float64)
-    for (n, injection) in enumerate(experiment.injections):
-        injection_heats[n] = injection['evolved_heat']
+    injection_heats = numpy.array(experiment.injections['evolved_heat'][:N], numpy.float64)
         
     # Determine guesses for initial values
     nlast = 4 # number of injections to use
-    duration_n = numpy.zeros([N], numpy.float64) # duration_n[n] is the duration of injection n
-    for n in range(N):
-        duration_n[n] = experiment.injections[n]['duration']    
+    duration_n = numpy.array(experiment.injections['duration'][:N], numpy.float64) # duration_n[n] is the duration of injection n
     sigma2 = injection_heats[N-nlast:N].var() / duration_n[N-nlast:N].sum()
     log_sigma_guess = numpy.log(numpy.sqrt(sigma2 / Units.cal**2 * Units.second)) # cal/s # TODO: Use std of individual filtered measurements instead
 
@@ -1167,6 +737,9 @@ def buildModel(experiment):
     DeltaH_0_min = injection_heats.min() - heat_interval # 
     DeltaH_0_max = injection_heats.max() + heat_interval # 
 
+    # Compute dilution factors for instantaneous injection model (perfusion), which are fixed for the experiment.
+    (d_n, dcum_n) = binding.compute_dilution_factors(experiment.injections['volume'][:N], V0)
+
     # Create model.
     model = dict()
 
@@ -1198,44 +771,11 @@ def buildModel(experiment):
 
         debug = False
 
-        Kd = numpy.exp(beta * DeltaG) * C0 # dissociation constant (M)
-
-        # Compute dilution factor for instantaneous injection model (perfusion).
-        d_n = numpy.zeros([N], numpy.float64) # d_n[n] is the dilution factor for injection n
-        dcum_n = numpy.ones([N], numpy.float64) # dcum_n[n] is the cumulative dilution factor for injection n
-        if debug: print "%5s %24s %24s" % ('n', 'd_n', 'dcum_n')
-        for n in range(N):
-            d_n[n] = 1.0 - (experiment.injections[n]['volume'] / V0) # dimensionless dilution factor for injection n
-            dcum_n[n:] *= d_n[n]
-            if debug: print "%5d %24f %24f" % (n, d_n[n], dcum_n[n])
-        if debug: print ""
-        
-        # Compute complex concentrations.
-        Pn = numpy.zeros([N], numpy.float64) # Pn[n] is the protein concentration in sample cell after n injections (M)
-        Ln = numpy.zeros([N], numpy.float64) # Ln[n] is the ligand concentration in sample cell after n injections (M)
-        PLn = numpy.zeros([N], numpy.float64) # PLn[n] is the complex concentration in sample cell after n injections (M)
-        if debug: print "%5s %24s %24s %24s %24s %24s" % ('n', 'P (umol)', 'L (umol)', 'Pn (uM)', 'Ln (uM)', 'PLn (uM)')
-        for n in range(N):
-            # Instantaneous injection model (perfusion)
-            P = V0 * P0 * dcum_n[n] # total quantity of protein in sample cell after n injections (mol)
-            L = V0 * Ls * (1. - dcum_n[n]) # total quantity of ligand in sample cell after n injections (mol)
-            PLn[n] = 0.5/V0 * ((P + L + Kd*V0) - numpy.sqrt((P + L + Kd*V0)**2 - 4*P*L));  # complex concentration (M)
-            Pn[n] = P/V0 - PLn[n]; # free protein concentration in sample cell after n injections (M)
-            Ln[n] = L/V0 - PLn[n]; # free ligand concentration in sample cell after n injections (M)
-            if debug: print "%5d %24f %24f %24f %24f %24f" % (n, P / Units.umol, L / Units.umol, Pn[n] / Units.uM, Ln[n] / Units.uM, PLn[n] / Units.uM)
-            
-        # Compute expected injection heats.
-        q_n = numpy.zeros([N], numpy.float64) # q_n_model[n] is the expected heat from injection n
-        q_n[0] = (-DeltaH) * V0 * (PLn[0] - d_n[0]*0.0) + (-DeltaH_0) # first injection
-        for n in range(1,N):
-            q_n[n] = (-DeltaH) * V0 * (PLn[n] - d_n[n]*PLn[n-1]) + (-DeltaH_0) # subsequent injections
+        q_n = binding.two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, d_n, dcum_n, beta, C0)
 
         # Debug output
         if debug:
             print "DeltaG = %6.1f kcal/mol ; DeltaH = %6.1f kcal/mol ; DeltaH_0 = %6.1f ucal/injection" % (DeltaG / (Units.kcal/Units.mol), DeltaH / (Units.kcal/Units.mol), DeltaH_0 / Units.ucal)
-            for n in range(N):
-                print "%6.1f" % (PLn[n] / Units.uM),
-            print ""
             for n in range(N):
                 print "%6.1f" % (q_n[n] / Units.ucal),
             print ""
@@ -1264,6 +804,335 @@ def buildModel(experiment):
 
     return model              
 
+def _twoComponentPosteriorTerms(experiment, model):
+    """
+    Collect the priors and observed data of the two-component binding model built by buildModel, for evaluation outside PyMC.
+
+    RETURNS
+        terms (dict) - prior bounds and positions 'lower', 'upper', 'uniform_index'; lognormal parameters and positions
+          'mu', 'tau', 'lognormal_index'; and the data 'injection_heats', 'sqrt_duration_n', 'V0', 'd_n', 'dcum_n', 'beta', 'C0'
+
+    """
+
+    parameter_names = posterior.TWO_COMPONENT_PARAMETERS
+    uniform_names = ['DeltaG', 'DeltaH', 'DeltaH_0', 'log_sigma', 'P_purity', 'L_purity']
+    lognormal_names = ['P0', 'Ls']
+
+    terms = dict()
+
+    # Priors.
+    terms['lower'] = numpy.array([model[name].parents['lower'] for name in uniform_names], numpy.float64)
+    terms['upper'] = numpy.array([model[name].parents['upper'] for name in uniform_names], numpy.float64)
+    terms['uniform_index'] = numpy.array([parameter_names.index(name) for name in uniform_names])
+    terms['mu'] = numpy.array([model[name].parents['mu'] for name in lognormal_names], numpy.float64)
+    terms['tau'] = numpy.array([model[name].parents['tau'] for name in lognormal_names], numpy.float64)
+    terms['lognormal_index'] = numpy.array([parameter_names.index(name) for name in lognormal_names])
+
+    # Observed data.
+    terms['injection_heats'] = numpy.asarray(model['q_n'].value, numpy.float64)
+    N = terms['injection_heats'].size
+    terms['sqrt_duration_n'] = numpy.sqrt(experiment.injections['duration'][:N])
+    terms['V0'] = experiment.cell_volume
+    (terms['d_n'], terms['dcum_n']) = binding.compute_dilution_factors(experiment.injections['volume'][:N], terms['V0'])
+    terms['beta'] = model['beta']
+    terms['C0'] = 1.0 * Units.M # standard concentration (M)
+
+    return terms
+
+def buildLogPosterior(experiment, model):
+    """
+    Create a vectorized log-posterior for the two-component binding model built by buildModel.
+
+    The priors and observed heats are taken from the PyMC model, so that ensemble samplers target the
+    same posterior as pymc.MCMC.
+
+    ARGUMENTS
+        experiment (Experiment) - the experiment to analyze
+        model (dict) - the PyMC model returned by buildModel(experiment)
+
+    RETURNS
+        log_posterior (function) - log_posterior(x) returns the log-posterior of each row of x (M x nparameters)
+        parameter_names (list of String) - names of the parameters, in the order of the columns of x
+        initial_values (numpy array) - current values of the parameters in the PyMC model
+
+    """
+
+    parameter_names = list(posterior.TWO_COMPONENT_PARAMETERS)
+    terms = _twoComponentPosteriorTerms(experiment, model)
+    (lower, upper, uniform_index) = (terms['lower'], terms['upper'], terms['uniform_index'])
+    (mu, tau, lognormal_index) = (terms['mu'], terms['tau'], terms['lognormal_index'])
+    log_uniform_density = -numpy.log(upper - lower).sum()
+    (injection_heats, sqrt_duration_n) = (terms['injection_heats'], terms['sqrt_duration_n'])
+    (V0, d_n, dcum_n, beta, C0) = (terms['V0'], terms['d_n'], terms['dcum_n'], terms['beta'], terms['C0'])
+
+    def log_posterior(x):
+        x = numpy.atleast_2d(numpy.asarray(x, numpy.float64))
+        (DeltaG, DeltaH, DeltaH_0, P0, Ls, log_sigma, P_purity, L_purity) = x.T
+
+        # Support of the priors.
+        inside = numpy.all((x[:, uniform_index] >= lower) & (x[:, uniform_index] <= upper), axis=1)
+        inside &= numpy.all(x[:, lognormal_index] > 0.0, axis=1)
+
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # Lognormal priors on concentrations.
+            log_x = numpy.log(x[:, lognormal_index])
+            logp = (0.5 * numpy.log(0.5 * tau / numpy.pi) - log_x - 0.5 * tau * (log_x - mu)**2).sum(axis=1) + log_uniform_density
+
+            # Normal likelihood of integrated injection heats.
+            q_n = binding.two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0 * P_purity, Ls * L_purity, V0, d_n, dcum_n, beta, C0)
+            tau_n = numpy.exp(-2.0 * log_sigma)[:, numpy.newaxis] / (Units.cal**2 / Units.second) * sqrt_duration_n
+            logp += (0.5 * numpy.log(0.5 * tau_n / numpy.pi) - 0.5 * tau_n * (injection_heats - q_n)**2).sum(axis=1)
+
+        logp[~inside | numpy.isnan(logp)] = -numpy.inf
+        return logp
+
+    initial_values = numpy.array([model[name].value for name in parameter_names], numpy.float64)
+
+    return (log_posterior, parameter_names, initial_values)
+
+def compileLogPosterior(experiment, model, use_numba=None):
+    """
+    Create a compiled log-posterior of one flat parameter vector for the two-component binding model built by buildModel.
+
+    This is the same posterior as buildLogPosterior(), evaluated by posterior.compile_two_component() as one loop over the
+    injections (JIT-compiled if numba is installed), for optimizers and samplers that propose one vector at a time.
+
+    ARGUMENTS
+        experiment (Experiment) - the experiment to analyze
+        model (dict) - the PyMC model returned by buildModel(experiment)
+
+    OPTIONAL ARGUMENTS
+        use_numba (bool) - if True, require numba; if False, do not use it (default: use numba if it is installed)
+
+    RETURNS
+        log_posterior (function) - log_posterior(x) returns the log-posterior (float) of the parameter vector x
+        parameter_names (list of String) - names of the parameters, in the order of the entries of x
+        initial_values (numpy array) - current values of the parameters in the PyMC model
+
+    """
+
+    parameter_names = list(posterior.TWO_COMPONENT_PARAMETERS)
+    terms = _twoComponentPosteriorTerms(experiment, model)
+    log_posterior = posterior.compile_two_component(terms['lower'], terms['upper'], terms['uniform_index'], terms['mu'], terms['tau'], terms['lognormal_index'],
+                                                    terms['injection_heats'], terms['sqrt_duration_n'], terms['V0'], terms['d_n'], terms['dcum_n'], terms['beta'],
+                                                    C0=terms['C0'], use_numba=use_numba)
+    initial_values = numpy.array([model[name].value for name in parameter_names], numpy.float64)
+
+    return (log_posterior, parameter_names, initial_values)
+
+def computePosteriorPredictive(experiment, model, trace, credible_interval=0.95):
+    """
+    Summarize the expected injection heats over all posterior samples of the two-component binding model.
+
+    ARGUMENTS
+        experiment (Experiment) - the experiment analyzed
+        model (dict) - the PyMC model returned by buildModel(experiment)
+        trace (pymc.MCMC or ensemble.EnsembleSampler) - sampler holding posterior samples of the model parameters
+
+    OPTIONAL ARGUMENTS
+        credible_interval (float) - probability mass of the central credible band (default: 0.95)
+
+    RETURNS
+        predictive (dict) - arrays with one entry per injection:
+          'median' - posterior median of the expected heat
+          'lower', 'upper' - bounds of the central credible band of the expected heat
+
+    NOTES
+        The expected heats of all samples are computed with one call to the vectorized binding kernel,
+        so the cost is that of one pass over the trace.
+
+    """
+
+    # Posterior samples, one row per sample.
+    x = dict()
+    for name in ['DeltaG', 'DeltaH', 'DeltaH_0', 'P0', 'Ls', 'P_purity', 'L_purity']:
+        x[name] = numpy.asarray(trace.trace(name)[:], numpy.float64)
+
+    N = numpy.asarray(model['q_n'].value).size
+    V0 = experiment.cell_volume
+    (d_n, dcum_n) = binding.compute_dilution_factors(experiment.injections['volume'][:N], V0)
+    C0 = 1.0 * Units.M # standard concentration (M)
+
+    q_sn = binding.two_component_injection_heats(x['DeltaG'], x['DeltaH'], x['DeltaH_0'], x['P0'] * x['P_purity'], x['Ls'] * x['L_purity'], V0, d_n, dcum_n, model['beta'], C0)
+
+    tail = 50.0 * (1.0 - credible_interval)
+    (lower, median, upper) = numpy.percentile(q_sn, [tail, 50.0, 100.0 - tail], axis=0)
+
+    predictive = dict()
+    predictive['median'] = median
+    predictive['lower'] = lower
+    predictive['upper'] = upper
+    return predictive
+
+def pairBlankTitrations(experiments):
+    """
+    Pair each host-into-guest titration of a day with the buffer-into-guest blank titration into the same guest solution.
+
+    Titrations have both syringe and cell concentrations; blanks have a cell concentration but no syringe
+    concentration.  Each titration is paired with the blank of the same cell concentration run closest
+    before it, or closest after it if none was run before.  Control titrations are not paired.
+
+    ARGUMENTS
+        experiments (list of Experiment) - experiments of the day, in the order they were run
+
+    RETURNS
+        pairs (list of (Experiment, Experiment)) - each titration with its blank, or with None if there is no blank
+
+    """
+
+    blanks = [index for (index, experiment) in enumerate(experiments) if (experiment.syringe_concentration == 0.0) and (experiment.cell_concentration > 0.0)]
+
+    pairs = list()
+    for (index, experiment) in enumerate(experiments):
+        if (experiment.syringe_concentration > 0.0) and (experiment.cell_concentration > 0.0):
+            matching = [blank for blank in blanks if abs(experiments[blank].cell_concentration - experiment.cell_concentration) <= 1.0e-6 * experiment.cell_concentration]
+            matching.sort(key=lambda blank: (blank > index, abs(blank - index)))
+            pairs.append((experiment, experiments[matching[0]] if matching else None))
+
+    return pairs
+
+def buildGlobalLogPosterior(pairs):
+    """
+    Create a vectorized log-posterior for the two-component binding model of all titrations of a day, fitted jointly.
+
+    All titrations are made from the same host stock in the syringe, so they share the host concentration
+    Ls (of the stock as stated for the first titration; the others are fixed dilutions of it), the host
+    purity L_purity, and the measurement noise log_sigma.  Each titration has its own DeltaG, DeltaH, guest
+    concentration P0 and purity P_purity.  The heat of injection DeltaH_0 of a titration is shared with its
+    blank, whose injection heats are all expected to be -DeltaH_0, so the blank constrains it.
+
+    Parameters of titration 'name' are named 'DeltaG[name]' and so on, where name is the base name of the
+    data file; DeltaH_0 is named after the blank if there is one.  The priors are those of buildModel().
+
+    ARGUMENTS
+        pairs (list of (Experiment, Experiment)) - titrations and their blanks (or None), from pairBlankTitrations()
+
+    RETURNS
+        log_posterior (function) - log_posterior(x) returns the log-posterior of each row of x (M x nparameters)
+        parameter_names (list of String) - names of the parameters, in the order of the columns of x
+        initial_values (numpy array) - initial guesses of the parameters
+
+    NOTES
+        The expected heats of all titrations with the same injection schedule are computed in one call of the
+        vectorized binding kernel, over samples and titrations at once, and the blank likelihood is a single
+        array expression, so evaluating the joint posterior costs little more than a single titration.
+
+    """
+
+    # Physical constants, as in buildModel().
+    Na = 6.02214179e23 # Avogadro's number (number/mol)
+    kB = Na * 1.3806504e-23 / 4184.0 * Units.kcal / Units.mol / Units.K # Boltzmann constant (kcal/mol/K)
+    C0 = 1.0 * Units.M # standard concentration (M)
+    beta = 1.0 / (kB * 298.15 * Units.K) # inverse temperature 1/(kcal/mol)
+
+    def name_of(experiment):
+        return os.path.splitext(os.path.basename(experiment.data_filename))[0]
+
+    # Observed data and injection schedules.
+    titrations = [titration for (titration, blank) in pairs]
+    blanks = list()
+    for (titration, blank) in pairs:
+        if (blank is not None) and (blank not in blanks):
+            blanks.append(blank)
+    heats = [numpy.array(e.injections['evolved_heat'][:e.number_of_injections], numpy.float64) for e in titrations + blanks]
+    heat_scale = 2.0 * max(abs(q_n).max() for q_n in heats)
+
+    # Parameters, with lower and upper bounds of the uniform priors (None for lognormal priors).
+    parameters = list() # (name, initial value, lower, upper)
+    Ls_stated = titrations[0].syringe_concentration
+    parameters.append(('Ls', Ls_stated, None, None))
+    parameters.append(('L_purity', 0.975, 0.95, 1.0))
+    log_sigma_guess = numpy.mean([numpy.log(numpy.sqrt(q_n[-4:].var() / numpy.sum(e.injections['duration'][e.number_of_injections-4:e.number_of_injections]) / Units.cal**2 * Units.second)) for (e, q_n) in zip(titrations, heats)])
+    parameters.append(('log_sigma', log_sigma_guess, log_sigma_guess - 10.0, log_sigma_guess + 10.0))
+    for (titration, blank) in pairs:
+        name = name_of(titration)
+        q_n = heats[titrations.index(titration)]
+        DeltaH_guess = q_n[2] / (titration.syringe_concentration * titration.injections[2]['volume'])
+        parameters.append(('DeltaG[%s]' % name, -5.0 * Units.kcal/Units.mol, -40. * Units.kcal/Units.mol, +40. * Units.kcal/Units.mol))
+        parameters.append(('DeltaH[%s]' % name, DeltaH_guess, -100. * Units.kcal/Units.mol, +100. * Units.kcal/Units.mol))
+        parameters.append(('P0[%s]' % name, titration.cell_concentration, None, None))
+        parameters.append(('P_purity[%s]' % name, 0.975, 0.95, 1.0))
+        if blank is None:
+            parameters.append(('DeltaH_0[%s]' % name, -q_n[-1], -heat_scale, heat_scale))
+    for blank in blanks:
+        q_n = heats[len(titrations) + blanks.index(blank)]
+        parameters.append(('DeltaH_0[%s]' % name_of(blank), -numpy.median(q_n), -heat_scale, heat_scale))
+
+    parameter_names = [name for (name, value, lower, upper) in parameters]
+    initial_values = numpy.array([value for (name, value, lower, upper) in parameters], numpy.float64)
+    index = dict((name, i) for (i, name) in enumerate(parameter_names))
+
+    # Priors: uniform with bounds, or lognormal about the stated concentration with the uncertainty of buildModel().
+    uniform_index = numpy.array([i for (i, (name, value, lower, upper)) in enumerate(parameters) if lower is not None])
+    lower = numpy.array([parameters[i][2] for i in uniform_index], numpy.float64)
+    upper = numpy.array([parameters[i][3] for i in uniform_index], numpy.float64)
+    log_uniform_density = -numpy.log(upper - lower).sum()
+    lognormal_index = numpy.array([i for (i, (name, value, l, u)) in enumerate(parameters) if l is None])
+    relative_uncertainty = numpy.array([0.0049 if parameters[i][0] == 'Ls' else 0.0174 for i in lognormal_index])
+    mu = numpy.log(initial_values[lognormal_index])
+    tau = 1.0 / numpy.log(1.0 + relative_uncertainty**2)
+
+    # Columns of the per-titration parameters, and the dilution of each titration's syringe relative to the stock.
+    def columns(parameter, names):
+        return numpy.array([index['%s[%s]' % (parameter, name)] for name in names])
+    titration_names = [name_of(titration) for titration in titrations]
+    DeltaG_index = columns('DeltaG', titration_names)
+    DeltaH_index = columns('DeltaH', titration_names)
+    P0_index = columns('P0', titration_names)
+    P_purity_index = columns('P_purity', titration_names)
+    DeltaH_0_index = columns('DeltaH_0', [name_of(blank) if blank is not None else name_of(titration) for (titration, blank) in pairs])
+    Ls_ratio = numpy.array([titration.syringe_concentration / Ls_stated for titration in titrations])
+
+    # Titrations grouped by injection schedule, so each group is one call of the binding kernel.
+    groups = dict()
+    for (e, titration) in enumerate(titrations):
+        N = titration.number_of_injections
+        key = (titration.cell_volume, tuple(titration.injections['volume'][:N]))
+        groups.setdefault(key, list()).append(e)
+    schedules = list()
+    for ((V0, volumes), members) in groups.items():
+        (d_n, dcum_n) = binding.compute_dilution_factors(numpy.array(volumes), V0)
+        q_en = numpy.array([heats[e] for e in members])
+        sqrt_duration_en = numpy.array([numpy.sqrt(titrations[e].injections['duration'][:titrations[e].number_of_injections]) for e in members])
+        schedules.append((numpy.array(members), V0, d_n, dcum_n, q_en, sqrt_duration_en))
+
+    # Blank injections, concatenated, with the DeltaH_0 column of each.
+    blank_heats = numpy.concatenate([heats[len(titrations) + b] for b in range(len(blanks))]) if blanks else numpy.zeros([0])
+    blank_columns = numpy.concatenate([numpy.zeros([blank.number_of_injections], numpy.int64) + index['DeltaH_0[%s]' % name_of(blank)] for blank in blanks]) if blanks else numpy.zeros([0], numpy.int64)
+    blank_sqrt_duration = numpy.concatenate([numpy.sqrt(blank.injections['duration'][:blank.number_of_injections]) for blank in blanks]) if blanks else numpy.zeros([0])
+
+    def log_posterior(x):
+        x = numpy.atleast_2d(numpy.asarray(x, numpy.float64))
+
+        # Support of the priors.
+        inside = numpy.all((x[:, uniform_index] >= lower) & (x[:, uniform_index] <= upper), axis=1)
+        inside &= numpy.all(x[:, lognormal_index] > 0.0, axis=1)
+
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # Lognormal priors on concentrations.
+            log_x = numpy.log(x[:, lognormal_index])
+            logp = (0.5 * numpy.log(0.5 * tau / numpy.pi) - log_x - 0.5 * tau * (log_x - mu)**2).sum(axis=1) + log_uniform_density
+
+            # Per-titration parameters, samples x titrations.
+            Ls = (x[:, index['Ls']] * x[:, index['L_purity']])[:, numpy.newaxis] * Ls_ratio
+            P0 = x[:, P0_index] * x[:, P_purity_index]
+            precision = numpy.exp(-2.0 * x[:, index['log_sigma']]) / (Units.cal**2 / Units.second)
+
+            # Normal likelihood of integrated injection heats of the titrations.
+            for (members, V0, d_n, dcum_n, q_en, sqrt_duration_en) in schedules:
+                q_men = binding.two_component_injection_heats(x[:, DeltaG_index[members]], x[:, DeltaH_index[members]], x[:, DeltaH_0_index[members]], P0[:, members], Ls[:, members], V0, d_n, dcum_n, beta, C0)
+                tau_men = precision[:, numpy.newaxis, numpy.newaxis] * sqrt_duration_en
+                logp += (0.5 * numpy.log(0.5 * tau_men / numpy.pi) - 0.5 * tau_men * (q_en - q_men)**2).sum(axis=(1, 2))
+
+            # Normal likelihood of the blank injection heats, each expected to be -DeltaH_0.
+            tau_mn = precision[:, numpy.newaxis] * blank_sqrt_duration
+            logp += (0.5 * numpy.log(0.5 * tau_mn / numpy.pi) - 0.5 * tau_mn * (blank_heats + x[:, blank_columns])**2).sum(axis=1)
+
+        logp[~inside | numpy.isnan(logp)] = -numpy.inf
+        return logp
+
+    return (log_posterior, parameter_names, initial_values)
+
 #=============================================================================================
 # Efficient step method
 #=============================================================================================
@@ -1387,23 +1256,14 @@ class RescalingStep(pymc.StepMethod):
       return False                                                                                                                                                                                                                                                                   
 
 def compute_statistics(x_t):
+    """
+    Return the mean, standard deviation, and 95% confidence interval [x, dx, xlow, xhigh] of a trace.
 
-    # Compute mean.
-    x = x_t.mean()
-
-    # Compute stddev.
-    dx = x_t.std()
+    To summarize several traces, tracestats.summarize() computes them all together.
 
-    # Compute 95% confidence interval.
-    ci = 0.95
-    N = x_t.size
-    x_sorted = numpy.sort(x_t)
-    low_index = round((0.5-ci/2.0)*N)
-    high_index = round((0.5+ci/2.0)*N)    
-    xlow = x_sorted[low_index]
-    xhigh = x_sorted[high_index]
+    """
 
-    return [x, dx, xlow, xhigh]
+    return tracestats.confidence_interval(x_t, ci=0.95)
 
 #=============================================================================================
 # MAIN AND TESTS
@@ -1418,7 +1278,8 @@ if __name__ == "__main__":
     # Load experimental data.
     #=============================================================================================
 
-    experiments = list()
+    # Experiments of the day, for the global fit.
+    global_experiments = list()
 
     import commands
 #    directory = '062614'
@@ -1428,13 +1289,41 @@ if __name__ == "__main__":
 
     output_directory = '%s/analysis' % directory
 
+    # MCMC settings.
+    niters = 200 # number of iterations
+    nburn  = 50 # number of burn-in iterations
+    nthin  = 250 # thinning period
+
+    #niters = 50000
+    #nburn = 25000
+    #nthin = 10
+
+    sampler = 'metropolis' # 'metropolis' (PyMC Metropolis with RescalingStep), or 'ensemble' for the affine-invariant ensemble sampler
+
+    # Ensemble sampler settings.
+    nwalkers = 32 # number of walkers
+    niterations = 20000 # largest number of ensemble iterations
+    nburn_ensemble = 500 # number of burn-in iterations
+    target_ess = 1000 # ensemble sampling stops once DeltaG and DeltaH reach this effective sample size
+
+    # Fit all titrations of the day jointly, sharing the host stock and using the blanks for DeltaH_0 (see buildGlobalLogPosterior).
+    global_fit = False
+
+    # Analysis settings, which together with the data file identify the results in the results store.
+    configuration = { 'baseline' : 'exponential', 'quadrature' : 'rectangle', 'model' : 'TwoComponent', 'sampler' : sampler }
+    if sampler == 'ensemble':
+        configuration.update({ 'nwalkers' : nwalkers, 'niterations' : niterations, 'nburn' : nburn_ensemble, 'target_ess' : target_ess })
+    else:
+        configuration.update({ 'niters' : niters, 'nburn' : nburn, 'nthin' : nthin })
+    store = results.ResultsStore(os.path.join(output_directory, 'results.db'))
+
+    # Stages whose inputs and analysis code are unchanged since an earlier run are restored from the stage cache.
+    code = stagecache.source_digest([__file__, itcfile, baseline, integration, plots, Units, Constants])
+    cache = stagecache.StageCache(os.path.join(output_directory, 'cache'), code=code)
+
     print filenames
     for filename in filenames:
 
-        # Close all figure windows.
-        import pylab
-        pylab.close('all')
-        
         #filename = '../data/Mg2-EDTA/Mg2EDTA/%s.itc' % name # Mg2+:EDTA sample dataset
         #filename = os.path.join(directory, name)
 
@@ -1442,19 +1331,22 @@ if __name__ == "__main__":
 
         print "\n"
         print "Reading ITC data from %s" % filename
-        experiment = Experiment(filename)
-        #experiments.append(experiment)
+        raw = { 'data' : stagecache.file_digest(filename), 'baseline' : configuration['baseline'], 'quadrature' : configuration['quadrature'] }
+        (experiment_key, experiment) = cache.run('experiment', raw, lambda : Experiment(filename, baseline=configuration['baseline'], quadrature=configuration['quadrature']))
+        global_experiments.append(experiment)
         print experiment
-        output_filename = os.path.join(output_directory, name + '.pdf')
-        analyze(name, experiment, output_filename)
 
-        # Write Origin-style integrated heats.
-        filename = output_directory + '/' + name + '-integrated.txt'
-        experiment.write_integrated_heats(filename)
-        
-        # Write baseline fit information.
-        filename = output_directory + '/' + name + '-baseline.png'
-        experiment.plot_baseline(filename)
+        # Record experiment settings, baseline, and integrated heats.
+        analysis_id = store.begin_analysis(filename, name, configuration)
+        store.record_experiment(analysis_id, experiment)
+
+        # Write analysis plots, Origin-style integrated heats, and baseline fit information.
+        outputs = [os.path.join(output_directory, name + suffix) for suffix in ['.pdf', '-integrated.txt', '-baseline.png']]
+        def report():
+            analyze(name, experiment, outputs[0])
+            experiment.write_integrated_heats(outputs[1])
+            experiment.plot_baseline(outputs[2])
+        cache.run('report', { 'experiment' : experiment_key }, report, outputs=outputs)
 
         continue # SKIPPING MCMC DEBUG        
 
@@ -1469,31 +1361,41 @@ if __name__ == "__main__":
             print str(e)
             continue
 
-        niters = 200 # number of iterations
-        nburn  = 50 # number of burn-in iterations
-        nthin  = 250 # thinning period
-
-        #niters = 50000
-        #nburn = 25000
-        #nthin = 10
-
-        #mcmc = pymc.MCMC(model, db='pickle')
-        #mcmc = pymc.MCMC(model, db='sqlite')
-        #mcmc = pymc.MCMC(model, db='hdf5')
-        mcmc = pymc.MCMC(model, db='ram')
-
-        mcmc.use_step_method(pymc.Metropolis, model['DeltaG'])
-        mcmc.use_step_method(pymc.Metropolis, model['DeltaH'])
-        mcmc.use_step_method(pymc.Metropolis, model['DeltaH_0'])
-        mcmc.use_step_method(pymc.Metropolis, model['P0'])
-        mcmc.use_step_method(pymc.Metropolis, model['Ls'])
-        mcmc.use_step_method(pymc.Metropolis, model['log_sigma'])
-        
-        mcmc.use_step_method(RescalingStep, [model['Ls'], model['P0'], model['DeltaH'], model['DeltaG'], model['DeltaH_0']], model['beta'])
-        
-        mcmc.sample(iter=niters, burn=nburn, thin=nthin, progress_bar=True)
+        if sampler == 'ensemble':
+            # Affine-invariant ensemble sampler, mixed with the rescaling move, over the same posterior.
+            (log_posterior, parameter_names, initial_values) = buildLogPosterior(experiment, model)
+            moves = [('stretch', 0.9), (ensemble.rescaling_move(parameter_names, model['beta']), 0.1)]
+            mcmc = ensemble.EnsembleSampler(log_posterior, parameter_names, nwalkers=nwalkers, moves=moves)
+            monitor = convergence.ConvergenceMonitor(parameter_names, target_ess=target_ess)
+            mcmc.sample(ensemble.disperse(initial_values, nwalkers), niterations, nburn=nburn_ensemble, monitor=monitor)
+            mcmc.report()
+        else:
+            #mcmc = pymc.MCMC(model, db='pickle')
+            #mcmc = pymc.MCMC(model, db='sqlite')
+            #mcmc = pymc.MCMC(model, db='hdf5')
+            mcmc = pymc.MCMC(model, db='ram')
+
+            mcmc.use_step_method(pymc.Metropolis, model['DeltaG'])
+            mcmc.use_step_method(pymc.Metropolis, model['DeltaH'])
+            mcmc.use_step_method(pymc.Metropolis, model['DeltaH_0'])
+            mcmc.use_step_method(pymc.Metropolis, model['P0'])
+            mcmc.use_step_method(pymc.Metropolis, model['Ls'])
+            mcmc.use_step_method(pymc.Metropolis, model['log_sigma'])
+
+            mcmc.use_step_method(RescalingStep, [model['Ls'], model['P0'], model['DeltaH'], model['DeltaG'], model['DeltaH_0']], model['beta'])
+
+            initial_time = convergence.cpu_time()
+            mcmc.sample(iter=niters, burn=nburn, thin=nthin, progress_bar=True)
+
+            # Diagnose the fixed-length run as a single chain.
+            parameter_names = ['DeltaG', 'DeltaH']
+            monitor = convergence.ConvergenceMonitor(parameter_names)
+            monitor.update(numpy.column_stack([mcmc.trace(name)[:] for name in parameter_names])[:, numpy.newaxis, :], convergence.cpu_time() - initial_time)
         #pymc.Matplot.plot(mcmc)
 
+        # Report convergence and realized effective samples per CPU-second of DeltaG and DeltaH.
+        monitor.report()
+
         # Plot individual terms.
         pymc.Matplot.plot(mcmc.trace('Ls')[:] / Units.uM, output_directory + '/' + '%s-Ls' % name)
         pymc.Matplot.plot(mcmc.trace('P0')[:] / Units.uM, output_directory + '/' + '%s-P0' % name)
@@ -1506,28 +1408,67 @@ if __name__ == "__main__":
         
         # TODO: Plot fits to enthalpogram.
         filename = output_directory + '/' + '%s-enthalpogram.png' % name
-        experiment.plot(model=mcmc, filename=filename)
+        experiment.plot(model=model, trace=mcmc, filename=filename)
         
-        # Compute confidence intervals in thermodynamic parameters.
-        filename = output_directory + '/' + 'confidence-intervals.out'
-        outfile = open(filename,'a')
-        outfile.write('%s\n' % name)        
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('DeltaG')[:] / (Units.kcal/Units.mol))         
-        outfile.write('DG:     %8.2f +- %8.2f kcal/mol     [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('DeltaH')[:] / (Units.kcal/Units.mol))         
-        outfile.write('DH:     %8.2f +- %8.2f kcal/mol     [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('DeltaH_0')[:] / Units.ucal)         
-        outfile.write('DH0:    %8.2f +- %8.2f ucal         [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('Ls')[:] / Units.uM)         
-        outfile.write('Ls:     %8.2f +- %8.2f uM           [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('L_purity')[:])
-        outfile.write('Lpurity:%8.2f +- %8.2f %%            [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('P0')[:] / Units.uM)         
-        outfile.write('P0:     %8.2f +- %8.2f uM           [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(mcmc.trace('P_purity')[:])
-        outfile.write('Ppurity:%8.2f +- %8.2f %%            [%8.2f, %8.2f] \n' % (x, dx, xlow, xhigh))
-        [x, dx, xlow, xhigh] = compute_statistics(numpy.exp(mcmc.trace('log_sigma')[:]) * Units.cal / Units.second**0.5)
-        outfile.write('sigma:  %8.5f +- %8.5f ucal/s^(1/2) [%8.5f, %8.5f] \n' % (x, dx, xlow, xhigh))        
-        outfile.write('\n')
-        outfile.close()
+        # Record confidence intervals in thermodynamic parameters.
+        posterior_parameters = [
+            ('DeltaG', mcmc.trace('DeltaG')[:] / (Units.kcal/Units.mol), 'kcal/mol'),
+            ('DeltaH', mcmc.trace('DeltaH')[:] / (Units.kcal/Units.mol), 'kcal/mol'),
+            ('DeltaH_0', mcmc.trace('DeltaH_0')[:] / Units.ucal, 'ucal'),
+            ('Ls', mcmc.trace('Ls')[:] / Units.uM, 'uM'),
+            ('L_purity', mcmc.trace('L_purity')[:], ''),
+            ('P0', mcmc.trace('P0')[:] / Units.uM, 'uM'),
+            ('P_purity', mcmc.trace('P_purity')[:], ''),
+            ('sigma', numpy.exp(mcmc.trace('log_sigma')[:]) * Units.cal / Units.second**0.5, 'ucal/s^(1/2)'),
+            ]
+        summary = tracestats.summarize(dict((parameter, x_t) for (parameter, x_t, unit) in posterior_parameters), quantiles=[0.025, 0.975])
+        posteriors = list()
+        for (parameter, x_t, unit) in posterior_parameters:
+            (xlow, xhigh) = summary[parameter]['quantiles']
+            posteriors.append({ 'parameter' : parameter, 'unit' : unit, 'mean' : summary[parameter]['mean'], 'std' : summary[parameter]['std'], 'low' : xlow, 'high' : xhigh, 'nsamples' : summary[parameter]['nsamples'] })
+        store.record_posteriors(analysis_id, posteriors)
+
+        # Record sampler diagnostics.
+        for (key, values) in monitor.diagnostics().items():
+            store.record_diagnostics(analysis_id, key, values)
+        if sampler == 'ensemble':
+            store.record_diagnostics(analysis_id, 'autocorrelation_time', mcmc.autocorrelation_times())
+            store.record_diagnostics(analysis_id, 'effective_sample_size', mcmc.effective_sample_sizes())
+            store.record_diagnostics(analysis_id, 'acceptance_fraction', mcmc.acceptance_fraction())
+            store.record_diagnostics(analysis_id, 'cpu_time', mcmc.cpu_time)
         
+    if global_fit:
+        #=============================================================================================
+        # Global fit of all titrations of the day
+        #=============================================================================================
+
+        # Experiments in the order they were run, so each titration is paired with the blank run before it.
+        global_experiments.sort(key=lambda experiment: [int(token) if token.isdigit() else token for token in re.split('(\d+)', experiment.data_filename)])
+        pairs = pairBlankTitrations(global_experiments)
+        (log_posterior, parameter_names, initial_values) = buildGlobalLogPosterior(pairs)
+        for (titration, blank) in pairs:
+            print "%s paired with blank %s" % (titration.data_filename, blank.data_filename if blank is not None else None)
+
+        nwalkers_global = max(nwalkers, 2 * len(parameter_names))
+        monitored = [name for name in parameter_names if name.split('[')[0] in ['DeltaG', 'DeltaH']]
+        monitor = convergence.ConvergenceMonitor(parameter_names, target_ess=target_ess, monitored=monitored)
+        mcmc = ensemble.EnsembleSampler(log_posterior, parameter_names, nwalkers=nwalkers_global, moves=[('stretch', 0.8), ('differential-evolution', 0.2)])
+        mcmc.sample(ensemble.disperse(initial_values, nwalkers_global), niterations, nburn=nburn_ensemble, monitor=monitor)
+        monitor.report()
+        print "%d iterations of %d walkers for %d titrations" % (mcmc.samples.shape[0] + nburn_ensemble, nwalkers_global, len(pairs))
+
+        # Record the joint posterior as one analysis of the day.
+        units = { 'DeltaG' : (Units.kcal/Units.mol, 'kcal/mol'), 'DeltaH' : (Units.kcal/Units.mol, 'kcal/mol'), 'DeltaH_0' : (Units.ucal, 'ucal'),
+                  'Ls' : (Units.uM, 'uM'), 'P0' : (Units.uM, 'uM'), 'L_purity' : (1.0, ''), 'P_purity' : (1.0, ''), 'log_sigma' : (1.0, '') }
+        traces = dict((name, mcmc.trace(name)[:] / units[name.split('[')[0]][0]) for name in parameter_names)
+        summary = tracestats.summarize(traces, quantiles=[0.025, 0.975])
+        posteriors = list()
+        for name in parameter_names:
+            (xlow, xhigh) = summary[name]['quantiles']
+            posteriors.append({ 'parameter' : name, 'unit' : units[name.split('[')[0]][1], 'mean' : summary[name]['mean'], 'std' : summary[name]['std'], 'low' : xlow, 'high' : xhigh, 'nsamples' : summary[name]['nsamples'] })
+        analysis_id = store.begin_analysis(directory, 'global', dict(configuration, model='GlobalTwoComponent', nwalkers=nwalkers_global))
+        store.record_posteriors(analysis_id, posteriors)
+        for (key, values) in monitor.diagnostics().items():
+            store.record_diagnostics(analysis_id, key, values)
+
+    store.close()
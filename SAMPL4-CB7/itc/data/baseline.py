@@ -0,0 +1,487 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# baseline.py
+#
+# Baseline fitting for differential power traces of ITC experiments.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Baseline fitting for differential power traces of ITC experiments.
+
+The baseline is fitted to the measurements collected before the first injection and to the last few
+percent of the measurements following each injection, where the power should have returned to the
+baseline.  These windows are selected with vectorized index arithmetic by fit_window_indices().
+
+The shifted exponential y = c * exp[-k*(x-x0)] + y0 is fitted by fit_exponential(), which supplies the
+analytic Jacobian to scipy.optimize.leastsq and obtains its starting points from linear fits of
+log|y - y0|.  Since a shift of x0 only rescales c, x0 is held at the median time of the data and
+(y0, c, k) are fitted.  Starting points are tried in order of increasing initial error, and fitting
+stops as soon as two starts converge to the same minimum.
+
+EXAMPLES
+
+  import baseline
+  (pre_indices, tail_indices) = baseline.fit_window_indices(first_index, last_index)
+  indices = numpy.concatenate([pre_indices, tail_indices])
+  p = baseline.fit_exponential(time[indices], power[indices])
+  baseline_power = baseline.exponential(p, time)
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import warnings
+
+import numpy
+import scipy.optimize
+
+#=============================================================================================
+# Selection of data to fit
+#=============================================================================================
+
+def fit_window_indices(first_index, last_index, fraction=0.05):
+    """
+    Select the measurements to which the baseline is fitted.
+
+    ARGUMENTS
+      first_index (numpy array of int) - index of the first measurement following each injection
+      last_index (numpy array of int) - index of the last measurement following each injection
+
+    OPTIONAL ARGUMENTS
+      fraction (float) - fraction of the measurements at the end of each injection to use (default: 0.05)
+
+    RETURNS
+      pre_indices (numpy array of int) - indices of all measurements before the first injection
+      tail_indices (numpy array of int) - indices of the last fraction of the measurements of each injection, in order
+
+    """
+
+    first_index = numpy.asarray(first_index, numpy.int64)
+    last_index = numpy.asarray(last_index, numpy.int64)
+
+    pre_indices = numpy.arange(first_index[0] if first_index.size else 0)
+
+    # Tail window [start, end) of each injection.
+    end_index = last_index + 1
+    start_index = end_index - ((end_index - first_index) * fraction).astype(numpy.int64)
+    lengths = end_index - start_index
+    if lengths.sum() == 0:
+        return (pre_indices, numpy.zeros([0], numpy.int64))
+
+    # Concatenate the ranges without a Python loop: a running count, offset by each window's start.
+    offsets = numpy.repeat(start_index - (numpy.cumsum(lengths) - lengths), lengths)
+    tail_indices = numpy.arange(lengths.sum()) + offsets
+
+    return (pre_indices, tail_indices)
+
+#=============================================================================================
+# Shifted exponential baseline
+#=============================================================================================
+
+def exponential(p, x):
+    """
+    Evaluate the shifted exponential baseline y = c * exp[-k*(x-x0)] + y0.
+
+    ARGUMENTS
+      p (sequence of 4 floats) - parameters [x0, y0, c, k]
+      x (numpy array) - times at which to evaluate the baseline
+
+    RETURNS
+      y (numpy array) - baseline at times x
+
+    """
+
+    [x0, y0, c, k] = p
+    return c * numpy.exp(-k * (x - x0)) + y0
+
+def _exponential_residuals(q, x, y, x0):
+    return y - exponential([x0] + list(q), x)
+
+def _exponential_jacobian(q, x, y, x0):
+    # Derivatives of the residuals y - f(p, x) with respect to [y0, c, k], one row per measurement.
+    [y0, c, k] = q
+    e = numpy.exp(-k * (x - x0))
+    jacobian = numpy.empty([x.size, 3], numpy.float64)
+    jacobian[:, 0] = -1.0
+    jacobian[:, 1] = -e
+    jacobian[:, 2] = c * (x - x0) * e
+    return jacobian
+
+def _error(p, x, y):
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        error = numpy.sum((y - exponential(p, x))**2)
+    if not numpy.isfinite(error):
+        return numpy.inf
+    return error
+
+def exponential_guesses(x, y):
+    """
+    Generate starting points for the shifted exponential fit.
+
+    The asymptote y0 is placed just beyond the range of the data, on either side, so that log|y - y0|
+    can be fitted by a straight line in x, giving c and k.  The fixed guesses used historically are
+    appended as fallbacks.
+
+    ARGUMENTS
+      x (numpy array) - times of measurements
+      y (numpy array) - measured power
+
+    RETURNS
+      p_guesses (list of tuples of 4 floats) - starting points [x0, y0, c, k]
+
+    """
+
+    x0 = numpy.median(x)
+    ymin = numpy.min(y)
+    ymax = numpy.max(y)
+    margin = 0.01 * (ymax - ymin) + 1.0e-12 * max(abs(ymin), abs(ymax), 1.0e-300)
+
+    p_guesses = list()
+    for (y0, sign) in [(ymin - margin, +1.0), (ymax + margin, -1.0)]:
+        # log|y - y0| = log|c| - k * (x - x0)
+        (slope, intercept) = numpy.polyfit(x - x0, numpy.log(sign * (y - y0)), 1)
+        p_guesses.append((x0, y0, sign * numpy.exp(intercept), -slope))
+
+    # Fixed guesses, in case both linearized fits are poor.
+    p_guesses.append((x0, ymin, ymax, 0.01))
+    p_guesses.append((x0, ymin, -ymax, -0.01))
+    p_guesses.append((x0, ymin, ymax, -0.01))
+    p_guesses.append((x0, ymin, -ymax, 0.01))
+
+    return p_guesses
+
+def fit_exponential(x, y, rtol=1.0e-6, maxfev=50):
+    """
+    Fit the shifted exponential baseline y = c * exp[-k*(x-x0)] + y0 by least squares from several starting points.
+
+    ARGUMENTS
+      x (numpy array) - times of measurements
+      y (numpy array) - measured power
+
+    OPTIONAL ARGUMENTS
+      rtol (float) - relative tolerance on the sum of squared residuals for two fits to count as the same minimum (default: 1e-6)
+      maxfev (int) - maximum number of function evaluations for each starting point; the best fit is then
+        continued to convergence if it stopped at this limit (default: 50)
+
+    RETURNS
+      p (numpy array of 4 floats) - best-fit parameters [x0, y0, c, k]
+
+    """
+
+    x = numpy.asarray(x, numpy.float64)
+    y = numpy.asarray(y, numpy.float64)
+
+    # Try starting points in order of increasing initial error.
+    p_guesses = exponential_guesses(x, y)
+    p_guesses.sort(key=lambda p_guess: _error(p_guess, x, y))
+
+    p_best = numpy.array(p_guesses[0], numpy.float64)
+    error_best = _error(p_best, x, y)
+    converged_best = False
+    errors = list()
+    for p_guess in p_guesses:
+        # Fits stopped by maxfev are detected from ier, without the warning leastsq gives for them.
+        with numpy.errstate(over='ignore', invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            [q, ier] = scipy.optimize.leastsq(_exponential_residuals, p_guess[1:], args=(x, y, p_guess[0]), Dfun=_exponential_jacobian, maxfev=maxfev)
+        p = numpy.array([p_guess[0]] + list(q), numpy.float64)
+        error = _error(p, x, y)
+        if error < error_best:
+            (p_best, error_best, converged_best) = (p, error, ier in [1, 2, 3, 4])
+
+        # Stop once two starting points agree on the best minimum found.
+        errors.append(error)
+        if sum(1 for other in errors if other <= error_best * (1.0 + rtol)) >= 2:
+            break
+
+    # Continue the best fit if it was stopped by the limit on function evaluations.
+    if not converged_best:
+        with numpy.errstate(over='ignore', invalid='ignore'):
+            [q, ier] = scipy.optimize.leastsq(_exponential_residuals, p_best[1:], args=(x, y, p_best[0]), Dfun=_exponential_jacobian)
+        p = numpy.array([p_best[0]] + list(q), numpy.float64)
+        if _error(p, x, y) < error_best:
+            p_best = p
+
+    return p_best
+
+#=============================================================================================
+# Segmented baseline models
+#=============================================================================================
+
+class BaselineModel(object):
+    """
+    A baseline model, evaluated one segment of the power trace at a time.
+
+    The trace is divided into segments: segment 0 holds the measurements before the first injection,
+    and segment j (j >= 1) the measurements following injection j.  Window 0 holds the pre-injection
+    measurements used for fitting, and window j the tail of injection j.  Segment j (j >= 1) thus lies
+    between windows j-1 and j.
+
+    A model with reach r evaluates segment j from windows j-r to j+r-1, so a change to one window only
+    affects the segments within reach of it.  A reach of None means every window is used.
+
+    The model itself is a single shifted exponential fitted to all windows, as in fit_exponential();
+    the other models derive from it and override reach and evaluate().
+
+    """
+
+    reach = None
+
+    def windows(self, segment, nwindows):
+        """
+        Return the indices of the windows from which a segment is evaluated.
+
+        ARGUMENTS
+          segment (int) - segment index
+          nwindows (int) - total number of windows
+
+        RETURNS
+          windows (list of int) - indices of windows used
+
+        """
+
+        if self.reach is None:
+            return list(range(nwindows))
+        if segment == 0:
+            return list(range(0, min(nwindows, self.reach)))
+        return list(range(max(0, segment - self.reach), min(nwindows, segment + self.reach)))
+
+    def evaluate(self, baseline, segment, windows):
+        """
+        Compute the baseline power over a segment.
+
+        ARGUMENTS
+          baseline (Baseline) - the baseline being fitted, holding the time and power traces
+          segment (int) - segment index
+          windows (list of int) - indices of the windows to fit, from windows()
+
+        RETURNS
+          power (numpy array) - baseline power for each measurement of the segment
+
+        """
+
+        # The exponential is fitted once, to every window, and shared by all segments.
+        if baseline.exponential_parameters is None:
+            indices = numpy.concatenate([baseline.window_indices[window] for window in windows])
+            baseline.exponential_parameters = fit_exponential(baseline.time[indices], baseline.power[indices])
+        return exponential(baseline.exponential_parameters, baseline.time[baseline.segment_slice(segment)])
+
+class PiecewiseLinearBaseline(BaselineModel):
+    """
+    Straight line between the mean power of the windows on either side of each segment.
+
+    """
+
+    reach = 1
+
+    def evaluate(self, baseline, segment, windows):
+        time = baseline.time[baseline.segment_slice(segment)]
+        anchors = [window for window in windows if baseline.window_indices[window].size > 0]
+        if not anchors:
+            return numpy.zeros(time.shape)
+        t = [baseline.time[baseline.window_indices[window]].mean() for window in anchors]
+        y = [baseline.power[baseline.window_indices[window]].mean() for window in anchors]
+        if len(anchors) == 1:
+            return y[0] + 0.0 * time
+        return y[0] + (y[-1] - y[0]) * (time - t[0]) / (t[-1] - t[0])
+
+class LocalPolynomialBaseline(BaselineModel):
+    """
+    Polynomial fitted to the windows within two injections of each segment.
+
+    """
+
+    reach = 2
+
+    def __init__(self, degree=2):
+        self.degree = degree
+
+    def evaluate(self, baseline, segment, windows):
+        time = baseline.time[baseline.segment_slice(segment)]
+        windows = [window for window in windows if baseline.window_indices[window].size > 0]
+        if not windows:
+            return numpy.zeros(time.shape)
+        indices = numpy.concatenate([baseline.window_indices[window] for window in windows])
+        x = baseline.time[indices]
+        y = baseline.power[indices]
+        # The curvature of a window is mostly noise, so use no more than one degree per additional window.
+        degree = min(self.degree, len(windows) - 1, x.size - 1)
+        center = x.mean()
+        coefficients = numpy.polyfit(x - center, y, degree)
+        return numpy.polyval(coefficients, time - center)
+
+class SmoothingSplineBaseline(BaselineModel):
+    """
+    Cubic smoothing spline fitted to the windows within three injections of each segment.
+
+    The smoothing is set from the scatter of the measurements within each window, so the spline follows
+    drift between injections but not measurement noise.
+
+    """
+
+    reach = 3
+
+    def __init__(self, smoothing=1.0):
+        self.smoothing = smoothing
+
+    def evaluate(self, baseline, segment, windows):
+        import scipy.interpolate
+
+        time = baseline.time[baseline.segment_slice(segment)]
+        windows = [window for window in windows if baseline.window_indices[window].size > 0]
+        if not windows:
+            return numpy.zeros(time.shape)
+        x = [baseline.time[baseline.window_indices[window]] for window in windows]
+        y = [baseline.power[baseline.window_indices[window]] for window in windows]
+        k = min(3, len(windows) - 1)
+        if k < 1:
+            return y[0].mean() + 0.0 * time
+
+        # Pooled scatter of the measurements about their window means.
+        residuals = numpy.concatenate([y_window - y_window.mean() for y_window in y])
+        sigma = numpy.sqrt((residuals**2).sum() / max(1, residuals.size - len(windows)))
+        if sigma == 0.0:
+            sigma = 1.0
+        x = numpy.concatenate(x)
+        y = numpy.concatenate(y)
+        spline = scipy.interpolate.UnivariateSpline(x, y, w=numpy.ones(x.size) / sigma, k=k, s=self.smoothing * x.size)
+        return spline(time)
+
+known_baseline_models = {
+    'exponential' : BaselineModel,
+    'piecewise-linear' : PiecewiseLinearBaseline,
+    'local-polynomial' : LocalPolynomialBaseline,
+    'spline' : SmoothingSplineBaseline,
+    }
+
+class Baseline(object):
+    """
+    Baseline of a differential power trace, fitted segment by segment with interchangeable models.
+
+    Each segment of the trace is evaluated by its own model.  Changing the fit window of one injection,
+    or the model of one segment, recomputes only the segments that depend on it; the baseline power
+    array is updated in place.
+
+    EXAMPLES
+
+      b = Baseline(time, power, first_index, last_index, model='piecewise-linear')
+      b.set_model(3, 'spline')
+      b.set_window(5, numpy.arange(1200, 1250))
+      b.update()
+
+    """
+
+    def __init__(self, time, power, first_index, last_index, model='exponential', fraction=0.05):
+        """
+        Select the fit windows and fit the baseline.
+
+        ARGUMENTS
+          time (numpy array) - time of each measurement
+          power (numpy array) - differential power of each measurement
+          first_index (numpy array of int) - index of the first measurement following each injection
+          last_index (numpy array of int) - index of the last measurement following each injection
+
+        OPTIONAL ARGUMENTS
+          model (String or BaselineModel) - model for every segment, by name in known_baseline_models or as an instance (default: 'exponential')
+          fraction (float) - fraction of the measurements at the end of each injection to fit (default: 0.05)
+
+        """
+
+        self.time = numpy.asarray(time, numpy.float64)
+        self.power = numpy.asarray(power, numpy.float64)
+        self.first_index = numpy.asarray(first_index, numpy.int64)
+        self.last_index = numpy.asarray(last_index, numpy.int64)
+
+        # Window 0 holds pre-injection measurements, window j the tail of injection j.
+        (pre_indices, tail_indices) = fit_window_indices(self.first_index, self.last_index, fraction)
+        tail_lengths = ((self.last_index + 1 - self.first_index) * fraction).astype(numpy.int64)
+        self.window_indices = [pre_indices] + numpy.split(tail_indices, numpy.cumsum(tail_lengths)[:-1])
+
+        self.nsegments = self.first_index.size + 1
+        self.models = [self._model(model)] * self.nsegments
+
+        self.baseline_power = numpy.zeros(self.power.shape, numpy.float64)
+        self.exponential_parameters = None
+        self._stale = set(range(self.nsegments))
+        self.update()
+
+    @staticmethod
+    def _model(model):
+        if isinstance(model, BaselineModel):
+            return model
+        return known_baseline_models[model]()
+
+    def segment_slice(self, segment):
+        """
+        Return the slice of measurements in a segment.
+
+        """
+
+        if segment == 0:
+            return slice(0, self.first_index[0] if self.first_index.size else self.power.size)
+        return slice(self.first_index[segment - 1], self.last_index[segment - 1] + 1)
+
+    def _dependent_segments(self, window):
+        return [segment for segment in range(self.nsegments) if window in self.models[segment].windows(segment, len(self.window_indices))]
+
+    def set_window(self, window, indices):
+        """
+        Change the measurements of one fit window, marking the segments that depend on it for recomputation.
+
+        ARGUMENTS
+          window (int) - window index: 0 for pre-injection measurements, j for the tail of injection j
+          indices (numpy array of int) - indices of measurements in the window
+
+        """
+
+        self.window_indices[window] = numpy.asarray(indices, numpy.int64)
+        self.exponential_parameters = None
+        self._stale.update(self._dependent_segments(window))
+
+    def set_model(self, segment, model):
+        """
+        Change the model of one segment, marking it for recomputation.
+
+        ARGUMENTS
+          segment (int) - segment index: 0 for pre-injection measurements, j for injection j
+          model (String or BaselineModel) - model name in known_baseline_models, or an instance
+
+        """
+
+        self.models[segment] = self._model(model)
+        self._stale.add(segment)
+
+    def update(self):
+        """
+        Recompute the baseline over stale segments.
+
+        RETURNS
+          segments (list of int) - segments that were recomputed
+
+        """
+
+        segments = sorted(self._stale)
+        nwindows = len(self.window_indices)
+        for segment in segments:
+            model = self.models[segment]
+            self.baseline_power[self.segment_slice(segment)] = model.evaluate(self, segment, model.windows(segment, nwindows))
+        self._stale = set()
+        return segments
+
+    def fit_data(self):
+        """
+        Return the data to which the baseline is fitted, in the form of Experiment.baseline_fit_data.
+
+        RETURNS
+          fit_data (dict) - 'x' and 'y' for all fit windows, 'indices' of the injection tail windows
+
+        """
+
+        indices = numpy.concatenate(self.window_indices)
+        tail_indices = numpy.concatenate(self.window_indices[1:]) if len(self.window_indices) > 1 else numpy.zeros([0], numpy.int64)
+        return { 'x' : self.time[indices], 'y' : self.power[indices], 'indices' : tail_indices }
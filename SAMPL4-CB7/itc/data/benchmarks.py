@@ -0,0 +1,399 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# benchmarks.py
+#
+# Timing benchmarks for the ITC analysis pipeline.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Timing benchmarks for the ITC analysis pipeline.
+
+Each benchmark compares a current implementation against the reference implementation it replaced,
+checks that both produce the same result, and reports the timings.
+
+USE
+
+  python benchmarks.py parser 01232015/*.itc
+  python benchmarks.py kernel 01232015/*.itc
+  python benchmarks.py logposterior 01232015/*.itc
+  python benchmarks.py worklist 10000 100000
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import os
+import sys
+import imp
+import timeit
+
+import numpy
+
+import Units
+import Constants
+import itcfile
+import binding
+
+#=============================================================================================
+# Helpers
+#=============================================================================================
+
+def _best_time(function, nrepeats):
+    """
+    Return the best wall-clock time (s) out of nrepeats calls to function().
+
+    """
+    timings = list()
+    for repeat in range(nrepeats):
+        initial_time = timeit.default_timer()
+        function()
+        timings.append(timeit.default_timer() - initial_time)
+    return min(timings)
+
+#=============================================================================================
+# .itc file parser
+#=============================================================================================
+
+def _legacy_read_power_data(filename):
+    """
+    Reference per-line parser of power measurements, as originally implemented in Experiment.__init__.
+
+    """
+
+    infile = open(filename, 'r')
+    lines = infile.readlines()
+    infile.close()
+
+    # Extract lines containing heat measurements.
+    for (index,line) in enumerate(lines):
+        if line[:2]=='@0':
+            break
+    measurement_lines = lines[index:]
+
+    # Count number of power measurements.
+    nmeasurements = 0
+    for line in measurement_lines:
+        if line[0] != '@':
+            nmeasurements += 1
+
+    filter_period_end_time = numpy.zeros([nmeasurements], numpy.float64)
+    differential_power = numpy.zeros([nmeasurements], numpy.float64)
+    cell_temperature = numpy.zeros([nmeasurements], numpy.float64)
+    jacket_temperature = numpy.zeros([nmeasurements], numpy.float64)
+
+    # Process data.
+    nmeasurements = 0
+    injection_labels = list()
+    for (index,line) in enumerate(measurement_lines):
+        if line[0]=='@':
+            injection_labels.append(nmeasurements)
+        else:
+            jacket = 0.0
+            try:
+                (time, power, temperature, a, jacket, c, d, e, f) = line.strip().split(",")
+            except:
+                try:
+                    (time, power, temperature, a, jacket, c, d) = line.strip().split(",")
+                except:
+                    (time, power, temperature) = line.strip().split(",")
+
+            filter_period_end_time[nmeasurements] = float(time) * Units.s
+            differential_power[nmeasurements] = float(power) * Units.ucal/Units.s
+            cell_temperature[nmeasurements] = float(temperature) + Constants.absolute_zero
+            jacket_temperature[nmeasurements] = float(jacket) + Constants.absolute_zero
+            nmeasurements += 1
+
+    data = dict()
+    data['filter_period_end_time'] = filter_period_end_time
+    data['differential_power'] = differential_power
+    data['cell_temperature'] = cell_temperature
+    data['jacket_temperature'] = jacket_temperature
+    data['first_index'] = numpy.array(injection_labels[1:])
+    data['last_index'] = numpy.array([label - 1 for label in injection_labels[2:]] + [nmeasurements - 1])
+    return data
+
+def benchmark_parser(filenames, nrepeats=5):
+    """
+    Compare the vectorized .itc parser against the reference per-line loop.
+
+    ARGUMENTS
+      filenames (list of String) - .itc files to parse
+
+    OPTIONAL ARGUMENTS
+      nrepeats (int) - number of timing repeats per file; the best time is reported (default: 5)
+
+    """
+
+    fields = ['filter_period_end_time', 'differential_power', 'cell_temperature', 'jacket_temperature', 'first_index', 'last_index']
+
+    print("%-40s %8s %12s %12s %8s" % ('file', 'rows', 'loop (ms)', 'numpy (ms)', 'speedup'))
+    total_legacy = 0.0
+    total_current = 0.0
+    for filename in filenames:
+        reference = _legacy_read_power_data(filename)
+        data = itcfile.read_itc_file(filename)
+        for field in fields:
+            if not numpy.array_equal(reference[field], data[field]):
+                raise Exception("Field '%s' of '%s' differs from reference parser." % (field, filename))
+
+        legacy_time = _best_time(lambda: _legacy_read_power_data(filename), nrepeats)
+        current_time = _best_time(lambda: itcfile.read_itc_file(filename), nrepeats)
+        total_legacy += legacy_time
+        total_current += current_time
+        print("%-40s %8d %12.3f %12.3f %8.1f" % (filename, data['differential_power'].size, legacy_time * 1000, current_time * 1000, legacy_time / current_time))
+
+    print("%-40s %8s %12.3f %12.3f %8.1f" % ('total', '', total_legacy * 1000, total_current * 1000, total_legacy / total_current))
+
+#=============================================================================================
+# Two-component binding kernel
+#=============================================================================================
+
+def _legacy_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, injection_volumes, beta, C0=1.0*Units.M):
+    """
+    Reference per-injection loop for the expected heats of the two-component binding model,
+    as originally implemented in the expected_injection_heats deterministic of buildModel.
+
+    """
+
+    N = len(injection_volumes)
+
+    Kd = numpy.exp(beta * DeltaG) * C0 # dissociation constant (M)
+
+    # Compute dilution factor for instantaneous injection model (perfusion).
+    d_n = numpy.zeros([N], numpy.float64) # d_n[n] is the dilution factor for injection n
+    dcum_n = numpy.ones([N], numpy.float64) # dcum_n[n] is the cumulative dilution factor for injection n
+    for n in range(N):
+        d_n[n] = 1.0 - (injection_volumes[n] / V0) # dimensionless dilution factor for injection n
+        dcum_n[n:] *= d_n[n]
+
+    # Compute complex concentrations.
+    Pn = numpy.zeros([N], numpy.float64) # Pn[n] is the protein concentration in sample cell after n injections (M)
+    Ln = numpy.zeros([N], numpy.float64) # Ln[n] is the ligand concentration in sample cell after n injections (M)
+    PLn = numpy.zeros([N], numpy.float64) # PLn[n] is the complex concentration in sample cell after n injections (M)
+    for n in range(N):
+        # Instantaneous injection model (perfusion)
+        P = V0 * P0 * dcum_n[n] # total quantity of protein in sample cell after n injections (mol)
+        L = V0 * Ls * (1. - dcum_n[n]) # total quantity of ligand in sample cell after n injections (mol)
+        PLn[n] = 0.5/V0 * ((P + L + Kd*V0) - numpy.sqrt((P + L + Kd*V0)**2 - 4*P*L));  # complex concentration (M)
+        Pn[n] = P/V0 - PLn[n]; # free protein concentration in sample cell after n injections (M)
+        Ln[n] = L/V0 - PLn[n]; # free ligand concentration in sample cell after n injections (M)
+
+    # Compute expected injection heats.
+    q_n = numpy.zeros([N], numpy.float64) # q_n_model[n] is the expected heat from injection n
+    q_n[0] = (-DeltaH) * V0 * (PLn[0] - d_n[0]*0.0) + (-DeltaH_0) # first injection
+    for n in range(1,N):
+        q_n[n] = (-DeltaH) * V0 * (PLn[n] - d_n[n]*PLn[n-1]) + (-DeltaH_0) # subsequent injections
+
+    return q_n
+
+def benchmark_kernel(filenames, nevaluations=2000, batch_size=1000):
+    """
+    Compare the vectorized two-component binding kernel against the reference per-injection loop,
+    in model evaluations per second.
+
+    The injection volumes are taken from each .itc file; the sample cell is that of the VP-ITC.
+    Parameter vectors are drawn around typical CB7 host-guest values.
+
+    ARGUMENTS
+      filenames (list of String) - .itc files providing injection protocols
+
+    OPTIONAL ARGUMENTS
+      nevaluations (int) - number of single evaluations to time for the loop and the kernel (default: 2000)
+      batch_size (int) - number of parameter vectors evaluated per batched kernel call (default: 1000)
+
+    """
+
+    V0 = 1.4301 * Units.ml - 0.044 * Units.ml # VP-ITC sample cell, with Tellinghuisen volume correction
+    kB = 6.02214179e23 * 1.3806504e-23 / 4184.0 * Units.kcal / Units.mol / Units.K # Boltzmann constant (kcal/mol/K)
+    beta = 1.0 / (kB * 298.15 * Units.K) # inverse temperature 1/(kcal/mol)
+
+    random = numpy.random.RandomState(0)
+    DeltaG = random.uniform(-14.0, -6.0, size=batch_size) * Units.kcal/Units.mol
+    DeltaH = random.uniform(-15.0, -2.0, size=batch_size) * Units.kcal/Units.mol
+    DeltaH_0 = random.uniform(-1.0, 1.0, size=batch_size) * Units.ucal
+    P0 = random.lognormal(numpy.log(50.0), 0.02, size=batch_size) * Units.uM
+    Ls = random.lognormal(numpy.log(500.0), 0.005, size=batch_size) * Units.uM
+
+    print("%-40s %4s %14s %14s %14s %8s" % ('file', 'N', 'loop (1/s)', 'kernel (1/s)', 'batch (1/s)', 'speedup'))
+    for filename in filenames:
+        data = itcfile.read_itc_file(filename)
+        injection_volumes = [injection['volume'] for injection in itcfile.parse_injections(data['header'])]
+        (d_n, dcum_n) = binding.compute_dilution_factors(injection_volumes, V0)
+
+        # Check agreement with the reference implementation.
+        q_n = binding.two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, d_n, dcum_n, beta)
+        for index in range(min(batch_size, 100)):
+            reference = _legacy_injection_heats(DeltaG[index], DeltaH[index], DeltaH_0[index], P0[index], Ls[index], V0, injection_volumes, beta)
+            if not numpy.allclose(q_n[index], reference, rtol=1.0e-6, atol=1.0e-6 * numpy.abs(reference).max()):
+                raise Exception("Kernel heats for '%s' differ from reference loop." % filename)
+
+        # The reference loop recomputes the dilution factors on every evaluation, as buildModel did.
+        def loop():
+            for index in range(nevaluations):
+                _legacy_injection_heats(DeltaG[index % batch_size], DeltaH[index % batch_size], DeltaH_0[index % batch_size], P0[index % batch_size], Ls[index % batch_size], V0, injection_volumes, beta)
+        def kernel():
+            for index in range(nevaluations):
+                binding.two_component_injection_heats(DeltaG[index % batch_size], DeltaH[index % batch_size], DeltaH_0[index % batch_size], P0[index % batch_size], Ls[index % batch_size], V0, d_n, dcum_n, beta)
+        def batch():
+            binding.two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, d_n, dcum_n, beta)
+
+        loop_rate = nevaluations / _best_time(loop, 3)
+        kernel_rate = nevaluations / _best_time(kernel, 3)
+        batch_rate = batch_size / _best_time(batch, 10)
+        print("%-40s %4d %14.0f %14.0f %14.0f %8.1f" % (filename, len(injection_volumes), loop_rate, kernel_rate, batch_rate, batch_rate / loop_rate))
+
+#=============================================================================================
+# Two-component log-posterior
+#=============================================================================================
+
+def benchmark_logposterior(filenames, nevaluations=2000, nsamples=1000):
+    """
+    Compare evaluations of the log-posterior of the two-component binding model of buildModel in ITC-sampl4.py, in
+    evaluations per second: the PyMC model graph, the vectorized buildLogPosterior() one vector at a time and in a batch,
+    and the compiled compileLogPosterior() (JIT-compiled if numba is installed).
+
+    Requires pymc.  Parameter vectors are drawn around the initial values of the model.
+
+    ARGUMENTS
+      filenames (list of String) - .itc files to build models for
+
+    OPTIONAL ARGUMENTS
+      nevaluations (int) - number of single evaluations to time (default: 2000)
+      nsamples (int) - number of distinct parameter vectors, also the size of the batch (default: 1000)
+
+    """
+
+    import pymc
+    itc = imp.load_source('itc_sampl4', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ITC-sampl4.py'))
+
+    print("%-40s %4s %12s %12s %12s %14s %8s" % ('file', 'N', 'graph (1/s)', 'row (1/s)', 'batch (1/s)', 'compiled (1/s)', 'speedup'))
+    for filename in filenames:
+        experiment = itc.Experiment(filename)
+        model = itc.buildModel(experiment)
+        graph = pymc.Model(model)
+        (log_posterior, parameter_names, initial_values) = itc.buildLogPosterior(experiment, model)
+        (compiled, parameter_names, initial_values) = itc.compileLogPosterior(experiment, model)
+        stochastics = [model[name] for name in parameter_names]
+
+        random = numpy.random.RandomState(0)
+        x = initial_values * (1.0 + 1.0e-3 * random.standard_normal([nsamples, len(parameter_names)]))
+        for name in ['P_purity', 'L_purity']:
+            x[:, parameter_names.index(name)] = random.uniform(0.951, 0.999, size=nsamples)
+
+        def evaluate_graph(index):
+            for (stochastic, value) in zip(stochastics, x[index % nsamples]):
+                stochastic.value = value
+            return graph.logp
+
+        # Check agreement with the PyMC model.
+        reference = numpy.array([evaluate_graph(index) for index in range(min(nsamples, 100))])
+        if not numpy.allclose(log_posterior(x[:reference.size]), reference, rtol=1.0e-9):
+            raise Exception("Vectorized log-posterior for '%s' differs from PyMC model." % filename)
+        if not numpy.allclose([compiled(x[index]) for index in range(reference.size)], reference, rtol=1.0e-9):
+            raise Exception("Compiled log-posterior for '%s' differs from PyMC model." % filename)
+
+        def graph_loop():
+            for index in range(nevaluations):
+                evaluate_graph(index)
+        def row_loop():
+            for index in range(nevaluations):
+                log_posterior(x[index % nsamples])
+        def batch():
+            log_posterior(x)
+        def compiled_loop():
+            for index in range(nevaluations):
+                compiled(x[index % nsamples])
+
+        graph_rate = nevaluations / _best_time(graph_loop, 3)
+        row_rate = nevaluations / _best_time(row_loop, 3)
+        batch_rate = nsamples / _best_time(batch, 10)
+        compiled_rate = nevaluations / _best_time(compiled_loop, 3)
+        print("%-40s %4d %12.0f %12.0f %12.0f %14.0f %8.1f" % (filename, experiment.number_of_injections, graph_rate, row_rate, batch_rate, compiled_rate, compiled_rate / graph_rate))
+
+#=============================================================================================
+# Tecan worklist
+#=============================================================================================
+
+def _legacy_worklist(transfers):
+    """
+    Build a Tecan worklist by string concatenation, as ITCExperimentSet.validate() in itctools did.
+
+    """
+    worklist_script = ""
+    for (source, source_position, destination, volume, tipmask) in transfers:
+        worklist_script += 'A;%s;;%s;%d;;%f;;;%d\r\n' % (source.RackLabel, source.RackType, source_position, volume, tipmask)
+        worklist_script += 'D;%s;;%s;%d;;%f;;;%d\r\n' % (destination.RackLabel, destination.RackType, destination.Position, volume, tipmask)
+        worklist_script += 'W;\r\n'
+        worklist_script += 'B;\r\n'
+    return worklist_script
+
+def benchmark_worklist(arguments, nrepeats=5):
+    """
+    Compare building and writing Tecan worklists by string concatenation and with itctools.worklist.Worklist.
+
+    Formatting the volumes dominates both.  The Worklist only stores line formats and fields while commands are
+    queued, and formats each chunk of commands in one operation when it is streamed.
+
+    ARGUMENTS
+      arguments (list of String) - numbers of worklist commands to time (default: 10000 and 100000)
+
+    OPTIONAL ARGUMENTS
+      nrepeats (int) - number of repeats, of which the best is reported (default: 5)
+
+    """
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '01232015'))
+    from itctools.labware import Labware, PipettingLocation
+    from itctools.worklist import Worklist
+
+    ncommands_list = [int(argument) for argument in arguments] or [10000, 100000]
+    source = Labware('SourcePlate', '5x3 Vial Holder')
+    devnull = open(os.devnull, 'w')
+
+    print("%10s %16s %16s %16s %16s %8s" % ('commands', 'legacy (s)', 'build (s)', 'serialize (s)', 'stream (s)', 'speedup'))
+    for ncommands in ncommands_list:
+        # Each transfer is an aspirate, dispense, wash, and break.
+        random = numpy.random.RandomState(0)
+        transfers = [(source, random.randint(1, 16), PipettingLocation('DestinationPlate', 'ITC Plate', 1 + index % 96), random.uniform(10.0, 400.0), 2**random.randint(0, 8)) for index in range(ncommands // 4)]
+
+        def build():
+            worklist = Worklist()
+            for (source_labware, source_position, destination, volume, tipmask) in transfers:
+                worklist.transfer(source_labware, source_position, destination, volume, tipmask)
+                worklist.flush()
+            return worklist
+
+        worklist = build()
+        if str(worklist) != _legacy_worklist(transfers):
+            raise Exception("Worklist of %d commands differs from string concatenation." % ncommands)
+
+        legacy_time = _best_time(lambda: devnull.write(_legacy_worklist(transfers)), nrepeats)
+        build_time = _best_time(build, nrepeats)
+        serialize_time = _best_time(lambda: str(worklist), nrepeats)
+        stream_time = _best_time(lambda: worklist.write(devnull), nrepeats)
+        print("%10d %16.4f %16.4f %16.4f %16.4f %8.2f" % (ncommands, legacy_time, build_time, serialize_time, stream_time, legacy_time / (build_time + stream_time)))
+
+    devnull.close()
+
+#=============================================================================================
+# MAIN
+#=============================================================================================
+
+known_benchmarks = {
+    'parser' : benchmark_parser,
+    'kernel' : benchmark_kernel,
+    'logposterior' : benchmark_logposterior,
+    'worklist' : benchmark_worklist,
+    }
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2) or (sys.argv[1] not in known_benchmarks):
+        print("usage: python benchmarks.py {%s} [arguments]" % ','.join(sorted(known_benchmarks.keys())))
+        sys.exit(1)
+
+    known_benchmarks[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# binding.py
+#
+# Vectorized binding models for the expected heats of a sequence of ITC injections.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Vectorized binding models for the expected heats of a sequence of ITC injections.
+
+The dilution of the sample cell depends only on the injection volumes and the cell volume, so it is
+computed once per experiment with compute_dilution_factors().  The expected injection heats are then
+computed for any number of parameter vectors at once: every thermodynamic argument may be a scalar
+or an array, and arrays of shape S produce heats of shape S + (N,) for N injections.
+
+EXAMPLES
+
+  import Units
+  import Constants
+  import binding
+  V0 = 1.3861 * Units.ml
+  (d_n, dcum_n) = binding.compute_dilution_factors([2.0 * Units.ul] + [10.0 * Units.ul] * 28, V0)
+  beta = 1.0 / (Constants.R * 298.15 * Units.K)
+  q_n = binding.two_component_injection_heats(-10.0 * Units.kcal/Units.mol, -5.0 * Units.kcal/Units.mol, 0.0,
+                                              50.0 * Units.uM, 500.0 * Units.uM, V0, d_n, dcum_n, beta)
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import Units
+
+import numpy
+
+#=============================================================================================
+# Dilution of the sample cell
+#=============================================================================================
+
+def compute_dilution_factors(injection_volumes, V0):
+    """
+    Compute the dilution factors for the instantaneous injection (perfusion) model.
+
+    ARGUMENTS
+      injection_volumes (sequence of float) - volume of each injection (L)
+      V0 (float) - volume of the sample cell (L)
+
+    RETURNS
+      d_n (numpy array of N floats) - d_n[n] is the dilution factor for injection n
+      dcum_n (numpy array of N floats) - dcum_n[n] is the cumulative dilution factor after injection n
+
+    """
+
+    d_n = 1.0 - numpy.asarray(injection_volumes, numpy.float64) / V0 # dimensionless dilution factor for injection n
+    dcum_n = numpy.cumprod(d_n) # cumulative dilution factor after injection n
+
+    return (d_n, dcum_n)
+
+#=============================================================================================
+# Two-component binding
+#=============================================================================================
+
+def two_component_complex_concentrations(Kd, P0, Ls, dcum_n):
+    """
+    Compute the complex concentration in the sample cell after each injection for two-component binding.
+
+    ARGUMENTS
+      Kd (float or numpy array) - dissociation constant (M)
+      P0 (float or numpy array) - concentration of macromolecule initially in the sample cell (M)
+      Ls (float or numpy array) - concentration of ligand in the syringe (M)
+      dcum_n (numpy array of N floats) - cumulative dilution factors from compute_dilution_factors()
+
+    RETURNS
+      PLn (numpy array) - PLn[..., n] is the complex concentration in the sample cell after n injections (M)
+
+    NOTES
+      The smaller root of the binding quadratic is evaluated as 2c / (b + sqrt(b^2 - 4c)), which is
+      equal to (b - sqrt(b^2 - 4c)) / 2 but does not lose precision to cancellation when binding is tight.
+
+    """
+
+    Kd = numpy.asarray(Kd, numpy.float64)[..., numpy.newaxis]
+    P0 = numpy.asarray(P0, numpy.float64)[..., numpy.newaxis]
+    Ls = numpy.asarray(Ls, numpy.float64)[..., numpy.newaxis]
+
+    P = P0 * dcum_n # total protein concentration in sample cell after n injections (M)
+    L = Ls * (1.0 - dcum_n) # total ligand concentration in sample cell after n injections (M)
+    b = P + L + Kd
+    c = P * L
+    PLn = 2.0 * c / (b + numpy.sqrt(b * b - 4.0 * c)) # complex concentration (M)
+
+    return PLn
+
+def two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, d_n, dcum_n, beta, C0=1.0*Units.M):
+    """
+    Compute the expected heats of injection for the two-component binding model.
+
+    ARGUMENTS
+      DeltaG (float or numpy array) - free energy of binding (kcal/mol)
+      DeltaH (float or numpy array) - enthalpy of binding (kcal/mol)
+      DeltaH_0 (float or numpy array) - heat of mixing and mechanical injection (cal/injection)
+      P0 (float or numpy array) - concentration of macromolecule initially in the sample cell (M)
+      Ls (float or numpy array) - concentration of ligand in the syringe (M)
+      V0 (float) - volume of the sample cell (L)
+      d_n, dcum_n (numpy arrays of N floats) - dilution factors from compute_dilution_factors()
+      beta (float) - inverse temperature 1/(kcal/mol)
+
+    OPTIONAL ARGUMENTS
+      C0 (float) - standard concentration (default: 1 M)
+
+    RETURNS
+      q_n (numpy array) - q_n[..., n] is the expected heat from injection n (cal); the leading dimensions
+        are those of the broadcast thermodynamic arguments
+
+    """
+
+    Kd = numpy.exp(beta * numpy.asarray(DeltaG, numpy.float64)) * C0 # dissociation constant (M)
+    PLn = two_component_complex_concentrations(Kd, P0, Ls, dcum_n)
+
+    # Complex present before each injection, diluted by the injection.
+    PLn_before = numpy.zeros_like(PLn)
+    PLn_before[..., 1:] = d_n[1:] * PLn[..., :-1]
+
+    DeltaH = numpy.asarray(DeltaH, numpy.float64)[..., numpy.newaxis]
+    DeltaH_0 = numpy.asarray(DeltaH_0, numpy.float64)[..., numpy.newaxis]
+    q_n = (-DeltaH) * V0 * (PLn - PLn_before) + (-DeltaH_0)
+
+    return q_n
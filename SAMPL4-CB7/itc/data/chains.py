@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# chains.py
+#
+# Independent MCMC chains run in parallel processes, with merged traces.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Independent MCMC chains run in parallel processes, with merged traces.
+
+A chain is sampled by a function sample_chain(chain) that builds its own model, starts from a
+dispersed point, and returns a dict of 1D traces.  run_chains() runs K such chains in separate
+processes, each seeded from chain_seed() so that the result does not depend on the number of
+processes, and merge_traces() concatenates their traces into one dict with an integer 'chain'
+index per sample.  Summary statistics and plots consume the merged traces like those of a single
+chain; chain_array() arranges them as nsamples x nchains for diagnostics across chains, such as
+convergence.potential_scale_reduction().
+
+EXAMPLES
+
+  import functools
+  import chains
+  per_chain = chains.run_chains(functools.partial(sample_chain, experiment), nchains=4)
+  traces = chains.merge_traces(per_chain)
+  x_tc = chains.chain_array(traces, 'DeltaG')
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import zlib
+import multiprocessing
+
+import numpy
+
+#=============================================================================================
+# Running chains
+#=============================================================================================
+
+def chain_seed(seed, chain):
+    """
+    Return the random number seed of one chain, derived from a base seed.
+
+    ARGUMENTS
+      seed (int) - base seed, such as the seed of an experiment
+      chain (int) - chain index
+
+    RETURNS
+      seed (int) - seed of the chain
+
+    """
+
+    return zlib.crc32(('%d:chain%d' % (seed, chain)).encode('utf-8')) & 0x7fffffff
+
+def run_chains(sample_chain, nchains, nprocesses=None):
+    """
+    Run independent chains, in parallel processes where possible.
+
+    ARGUMENTS
+      sample_chain (function) - sample_chain(chain) samples chain number chain and returns its result; must be
+        picklable (a module-level function, or a functools.partial of one)
+      nchains (int) - number of chains
+
+    OPTIONAL ARGUMENTS
+      nprocesses (int) - number of processes (default: one per chain, up to the number of CPUs)
+
+    RETURNS
+      results (list) - results of the chains, in chain order
+
+    NOTES
+      Daemonic processes, such as the workers of a multiprocessing.Pool, cannot start processes of their own;
+      chains requested from one are run one after the other.
+
+    """
+
+    if nprocesses is None:
+        nprocesses = min(nchains, multiprocessing.cpu_count())
+    if (nprocesses <= 1) or (nchains <= 1) or multiprocessing.current_process().daemon:
+        return [sample_chain(chain) for chain in range(nchains)]
+
+    pool = multiprocessing.Pool(min(nprocesses, nchains))
+    try:
+        results = pool.map(sample_chain, range(nchains), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+#=============================================================================================
+# Merged traces
+#=============================================================================================
+
+def merge_traces(chain_traces):
+    """
+    Merge the traces of several chains into one set of traces with a chain index.
+
+    ARGUMENTS
+      chain_traces (list of dict) - chain_traces[c][name] is the 1D trace of parameter name in chain c
+
+    RETURNS
+      traces (dict) - traces[name] is the concatenation of the traces of all chains, in chain order, and
+        traces['chain'] is the chain index of each sample
+
+    """
+
+    names = sorted(chain_traces[0].keys())
+    traces = dict((name, numpy.concatenate([numpy.asarray(per_chain[name]) for per_chain in chain_traces])) for name in names)
+    traces['chain'] = numpy.concatenate([numpy.zeros([len(per_chain[names[0]])], numpy.int32) + chain for (chain, per_chain) in enumerate(chain_traces)])
+
+    return traces
+
+def chain_array(traces, name):
+    """
+    Return the samples of one parameter from merged traces as an array of nsamples x nchains.
+
+    ARGUMENTS
+      traces (dict) - merged traces, from merge_traces()
+      name (String) - parameter name
+
+    RETURNS
+      x_tc (numpy array of nsamples x nchains) - x_tc[t,c] is sample t of chain c; chains are truncated
+        to the length of the shortest
+
+    """
+
+    chain = traces['chain']
+    columns = [traces[name][chain == c] for c in numpy.unique(chain)]
+    nsamples = min(len(column) for column in columns)
+
+    return numpy.column_stack([column[:nsamples] for column in columns])
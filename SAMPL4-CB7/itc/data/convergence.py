@@ -0,0 +1,315 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# convergence.py
+#
+# Convergence and efficiency diagnostics of MCMC sampling, with adaptive stopping.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Convergence and efficiency diagnostics of MCMC sampling, with adaptive stopping.
+
+A ConvergenceMonitor follows the growing trace of selected parameters (by default the binding free
+energy and enthalpy) while a sampler runs.  At each check it estimates, from all samples stored so
+far,
+
+  tau  - integrated autocorrelation time of each parameter, in stored samples
+  ESS  - effective sample size, pooled over chains (or ensemble walkers)
+  Rhat - split potential scale reduction factor (Gelman et al., 2013) over the chains
+
+and declares the run converged once every monitored parameter has reached the target ESS with Rhat
+below its threshold.  Checks are spaced geometrically in the number of stored samples, so the cost
+of all checks together is a constant multiple of the cost of the last one.
+
+The sampler is stopped at the first converged check, and the realized effective samples per
+CPU-second are reported, so settings need not be tuned per experiment by hand.
+
+EXAMPLES
+
+  import ensemble
+  import convergence
+  monitor = convergence.ConvergenceMonitor(parameter_names, target_ess=1000)
+  sampler = ensemble.EnsembleSampler(log_posterior, parameter_names, nwalkers=32)
+  sampler.sample(initial_positions, niterations=100000, nburn=500, monitor=monitor)
+  monitor.report()
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import numpy
+
+from ensemble import integrated_autocorrelation_time, cpu_time
+
+#=============================================================================================
+# Constants
+#=============================================================================================
+
+DEFAULT_MONITORED = ('DeltaG', 'DeltaH') # parameters whose ESS decides when to stop
+DEFAULT_MAX_RHAT = 1.1 # largest split-Rhat accepted as converged
+DEFAULT_CHECK_INTERVAL = 100 # stored samples before the first check
+DEFAULT_GROWTH = 1.5 # ratio of the number of stored samples at successive checks
+DEFAULT_MIN_TAU_MULTIPLE = 20.0 # checks need at least this many autocorrelation times per chain
+
+#=============================================================================================
+# Diagnostics of a trace
+#=============================================================================================
+
+def potential_scale_reduction(x_tc):
+    """
+    Estimate the split potential scale reduction factor (Rhat) of a scalar quantity sampled by several chains.
+
+    ARGUMENTS
+      x_tc (numpy array of nsamples x nchains) - x_tc[t,c] is the sample at iteration t of chain c
+
+    RETURNS
+      rhat (float) - split-Rhat; values near 1 indicate the chains sample the same distribution
+
+    NOTES
+      Each chain is split into halves, so that a drift within a single chain is detected too.
+
+    """
+
+    x_tc = numpy.asarray(x_tc, numpy.float64)
+    if x_tc.ndim == 1:
+        x_tc = x_tc[:, numpy.newaxis]
+    n = x_tc.shape[0] // 2
+    if n < 2:
+        return numpy.inf
+
+    x_tc = numpy.hstack([x_tc[:n], x_tc[-n:]])
+    chain_means = x_tc.mean(axis=0)
+    W = x_tc.var(axis=0, ddof=1).mean()
+    B = n * chain_means.var(ddof=1)
+    if W <= 0.0:
+        return 1.0 if B <= 0.0 else numpy.inf
+    variance = (n - 1.0) / n * W + B / n
+
+    return numpy.sqrt(variance / W)
+
+def effective_sample_size(x_tc):
+    """
+    Estimate the effective sample size of a scalar quantity sampled by several chains, pooled over chains.
+
+    ARGUMENTS
+      x_tc (numpy array of nsamples x nchains) - x_tc[t,c] is the sample at iteration t of chain c
+
+    RETURNS
+      ess (float) - effective sample size
+      tau (float) - integrated autocorrelation time, in samples
+
+    """
+
+    x_tc = numpy.asarray(x_tc, numpy.float64)
+    if x_tc.ndim == 1:
+        x_tc = x_tc[:, numpy.newaxis]
+    tau = max(1.0, integrated_autocorrelation_time(x_tc))
+
+    return (x_tc.size / tau, tau)
+
+#=============================================================================================
+# Convergence monitor
+#=============================================================================================
+
+class ConvergenceMonitor(object):
+    """
+    Follow the convergence of selected parameters during sampling and decide when to stop.
+
+    The sampler calls update() with all samples stored so far whenever the number of stored samples
+    reaches next_check().  The history of checks is kept in self.history.
+
+    """
+
+    def __init__(self, parameter_names, target_ess=None, monitored=DEFAULT_MONITORED, max_rhat=DEFAULT_MAX_RHAT,
+                 check_interval=DEFAULT_CHECK_INTERVAL, growth=DEFAULT_GROWTH, min_tau_multiple=DEFAULT_MIN_TAU_MULTIPLE, verbose=False):
+        """
+        ARGUMENTS
+          parameter_names (list of String) - names of the parameters, in the order of the last axis of the samples
+
+        OPTIONAL ARGUMENTS
+          target_ess (float) - effective sample size every monitored parameter must reach; if None, diagnostics
+            are computed but sampling is never stopped early (default: None)
+          monitored (sequence of String) - parameters whose diagnostics decide convergence; names not in
+            parameter_names are ignored (default: DEFAULT_MONITORED)
+          max_rhat (float) - largest split-Rhat accepted as converged (default: DEFAULT_MAX_RHAT)
+          check_interval (int) - number of stored samples per chain at the first check (default: DEFAULT_CHECK_INTERVAL)
+          growth (float) - ratio of the numbers of stored samples at successive checks (default: DEFAULT_GROWTH)
+          min_tau_multiple (float) - a check only counts as converged if each chain is at least this many
+            autocorrelation times long, so that tau itself is reliable (default: DEFAULT_MIN_TAU_MULTIPLE)
+          verbose (bool) - if True, print each check (default: False)
+
+        """
+
+        self.parameter_names = list(parameter_names)
+        self.monitored = [name for name in monitored if name in self.parameter_names]
+        if not self.monitored:
+            self.monitored = list(self.parameter_names)
+        self.target_ess = target_ess
+        self.max_rhat = max_rhat
+        self.check_interval = check_interval
+        self.growth = growth
+        self.min_tau_multiple = min_tau_multiple
+        self.verbose = verbose
+
+        self.history = list()
+        self.converged = False
+        self._next_check = check_interval
+
+        return
+
+    def next_check(self):
+        """
+        Return the number of stored samples per chain at which update() should next be called.
+
+        """
+
+        return self._next_check
+
+    def update(self, samples, cpu_time):
+        """
+        Compute diagnostics of the monitored parameters from the samples stored so far.
+
+        ARGUMENTS
+          samples (numpy array of nsamples x nchains x nparameters) - all stored samples
+          cpu_time (float) - CPU-seconds spent sampling so far
+
+        RETURNS
+          converged (bool) - True if every monitored parameter has reached the target ESS with split-Rhat
+            below max_rhat
+
+        """
+
+        nsamples = samples.shape[0]
+        check = { 'nsamples' : nsamples, 'cpu_time' : cpu_time, 'tau' : dict(), 'ess' : dict(), 'rhat' : dict() }
+        for name in self.monitored:
+            x_tc = samples[:, :, self.parameter_names.index(name)]
+            (ess, tau) = effective_sample_size(x_tc)
+            check['tau'][name] = tau
+            check['ess'][name] = ess
+            check['rhat'][name] = potential_scale_reduction(x_tc)
+        self.history.append(check)
+
+        if self.target_ess is not None:
+            self.converged = all((check['ess'][name] >= self.target_ess) and (check['rhat'][name] <= self.max_rhat)
+                                 and (nsamples >= self.min_tau_multiple * check['tau'][name]) for name in self.monitored)
+        self._next_check = max(nsamples + 1, int(numpy.ceil(nsamples * self.growth)))
+
+        if self.verbose:
+            print(self._format_check(check))
+
+        return self.converged
+
+    def _format_check(self, check):
+        return "%8d samples: " % check['nsamples'] + ", ".join("%s ESS %.1f Rhat %.3f" % (name, check['ess'][name], check['rhat'][name]) for name in self.monitored)
+
+    def diagnostics(self):
+        """
+        Return the diagnostics of the last check, for recording in a results store.
+
+        RETURNS
+          diagnostics (dict) - diagnostics[key][parameter] for the keys 'autocorrelation_time', 'effective_sample_size',
+            'potential_scale_reduction', and 'effective_samples_per_second', and the scalar 'converged'
+
+        """
+
+        if not self.history:
+            return dict()
+
+        check = self.history[-1]
+        cpu_time = max(check['cpu_time'], 1.0e-9)
+        diagnostics = {
+            'autocorrelation_time' : dict(check['tau']),
+            'effective_sample_size' : dict(check['ess']),
+            'potential_scale_reduction' : dict(check['rhat']),
+            'effective_samples_per_second' : dict((name, ess / cpu_time) for (name, ess) in check['ess'].items()),
+            'converged' : float(self.converged),
+            }
+
+        return diagnostics
+
+    def report(self, outfile=None):
+        """
+        Print the diagnostics of the last check and the realized effective samples per CPU-second.
+
+        OPTIONAL ARGUMENTS
+          outfile (file) - file to write to (default: print to standard output)
+
+        """
+
+        if not self.history:
+            return
+
+        check = self.history[-1]
+        cpu_time = max(check['cpu_time'], 1.0e-9)
+        if self.target_ess is None:
+            status = "no target ESS"
+        else:
+            status = "%s target ESS %.0f after %d checks" % ('reached' if self.converged else 'did not reach', self.target_ess, len(self.history))
+
+        lines = list()
+        lines.append("%d samples per chain, %.2f CPU-seconds, %s" % (check['nsamples'], check['cpu_time'], status))
+        lines.append("%-12s %10s %12s %10s %14s" % ('parameter', 'tau', 'ESS', 'Rhat', 'ESS/CPU-s'))
+        for name in self.monitored:
+            lines.append("%-12s %10.2f %12.1f %10.4f %14.1f" % (name, check['tau'][name], check['ess'][name], check['rhat'][name], check['ess'][name] / cpu_time))
+
+        if outfile is None:
+            for line in lines:
+                print(line)
+        else:
+            for line in lines:
+                outfile.write(line + '\n')
+
+        return
+
+#=============================================================================================
+# Adaptive sampling with PyMC
+#=============================================================================================
+
+def sample_pymc(mcmc, monitor, max_iterations, nburn=0, nthin=1, **kwargs):
+    """
+    Sample a pymc.MCMC in chunks until the monitor reports convergence or max_iterations is reached.
+
+    ARGUMENTS
+      mcmc (pymc.MCMC) - sampler, with a database that keeps all chains (such as 'ram')
+      monitor (ConvergenceMonitor) - monitor of the sampled parameters
+      max_iterations (int) - largest total number of iterations, including burn-in; must exceed nburn
+
+    OPTIONAL ARGUMENTS
+      nburn (int) - number of initial iterations to discard (default: 0)
+      nthin (int) - thinning period (default: 1)
+      kwargs - passed on to mcmc.sample(), such as progress_bar
+
+    RETURNS
+      traces (dict) - traces[name] is the 1D array of stored samples of each parameter in monitor.parameter_names
+
+    NOTES
+      Each chunk continues from the state of the previous one and is stored by PyMC as a separate chain;
+      the chunks are concatenated into one chain for the diagnostics.
+
+    """
+
+    if max_iterations <= nburn:
+        raise ValueError("max_iterations (%d) must exceed nburn (%d) for any samples to be stored." % (max_iterations, nburn))
+
+    initial_time = cpu_time()
+    first_chain = mcmc.db.chains if getattr(mcmc, 'db', None) is not None else 0
+    burn = nburn
+    iterations = 0
+    nstored = 0
+    while iterations < max_iterations:
+        niter = min(max_iterations - iterations, burn + (monitor.next_check() - nstored) * nthin)
+        mcmc.sample(iter=niter, burn=burn, thin=nthin, **kwargs)
+        iterations += niter
+        burn = 0
+
+        chains = range(first_chain, mcmc.db.chains)
+        x_tp = numpy.column_stack([numpy.concatenate([numpy.ravel(mcmc.trace(name, chain=chain)[:]) for chain in chains]) for name in monitor.parameter_names])
+        nstored = x_tp.shape[0]
+        if monitor.update(x_tp[:, numpy.newaxis, :], cpu_time() - initial_time):
+            break
+
+    return dict((name, x_tp[:, index]) for (index, name) in enumerate(monitor.parameter_names))
@@ -0,0 +1,435 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# ensemble.py
+#
+# Ensemble Markov chain Monte Carlo samplers driven by a vectorized log-posterior.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Ensemble Markov chain Monte Carlo samplers driven by a vectorized log-posterior.
+
+An ensemble of walkers is advanced together.  Each iteration updates the two halves of the ensemble
+in turn, each walker proposing a move based on the positions of walkers in the other half, so the
+log-posterior is evaluated for half the ensemble in a single call.
+
+Two ensemble moves are provided in known_moves:
+
+  'stretch'                - affine-invariant stretch move (Goodman and Weare, 2010)
+  'differential-evolution' - differential evolution move (ter Braak, 2006)
+
+Model-specific moves can be mixed in; rescaling_move() builds the scale-invariant move of
+RescalingStep in ITC-sampl4.py as an update of each walker.
+
+The sampler reports the integrated autocorrelation time of each parameter and the number of
+effective samples per CPU-second spent sampling.  Given a convergence.ConvergenceMonitor, it stops
+as soon as the monitored parameters reach a target effective sample size.
+
+EXAMPLES
+
+  import numpy
+  import ensemble
+  log_posterior = lambda x: -0.5 * (x**2).sum(axis=-1)
+  sampler = ensemble.EnsembleSampler(log_posterior, ['x', 'y'], nwalkers=16)
+  sampler.sample(ensemble.disperse(numpy.ones(2), 16), niterations=1000, nburn=100)
+  sampler.report()
+  x_t = sampler.trace('x')[:]
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import time
+
+import numpy
+
+#=============================================================================================
+# Helpers
+#=============================================================================================
+
+# CPU time of this process (time.clock was replaced by time.process_time in Python 3), also used by
+# convergence to measure samplers driven from outside this module.
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+def disperse(center, nwalkers, relative_scale=1.0e-3, random_state=None):
+    """
+    Generate initial walker positions in a small ball around a point.
+
+    ARGUMENTS
+      center (numpy array of nparameters floats) - point to disperse walkers around
+      nwalkers (int) - number of walkers
+
+    OPTIONAL ARGUMENTS
+      relative_scale (float) - standard deviation of the dispersion, relative to each coordinate (default: 1e-3)
+      random_state (numpy.random.RandomState) - random number generator (default: numpy.random)
+
+    RETURNS
+      positions (numpy array of nwalkers x nparameters) - initial walker positions
+
+    """
+
+    if random_state is None:
+        random_state = numpy.random
+
+    center = numpy.asarray(center, numpy.float64)
+    scale = relative_scale * numpy.abs(center)
+    scale[scale == 0.0] = relative_scale
+    return center + scale * random_state.normal(size=(nwalkers, center.size))
+
+def integrated_autocorrelation_time(x_tw, c=5.0):
+    """
+    Estimate the integrated autocorrelation time of a scalar quantity sampled by an ensemble of walkers.
+
+    ARGUMENTS
+      x_tw (numpy array of nsamples x nwalkers) - x_tw[t,w] is the sample at iteration t of walker w
+
+    OPTIONAL ARGUMENTS
+      c (float) - window factor for the automatic windowing of Sokal (default: 5)
+
+    RETURNS
+      tau (float) - integrated autocorrelation time, in iterations
+
+    NOTES
+      The autocorrelation functions of the walkers are averaged before summing, and the sum is truncated
+      at the smallest window M with M >= c * tau(M).
+
+    """
+
+    x_tw = numpy.asarray(x_tw, numpy.float64)
+    if x_tw.ndim == 1:
+        x_tw = x_tw[:, numpy.newaxis]
+    nsamples = x_tw.shape[0]
+    if nsamples < 2:
+        return 1.0
+
+    # Autocorrelation function of each walker by FFT, zero-padded to avoid wrap-around.
+    dx_tw = x_tw - x_tw.mean(axis=0)
+    nfft = 1 << int(numpy.ceil(numpy.log2(2 * nsamples)))
+    f_kw = numpy.fft.rfft(dx_tw, n=nfft, axis=0)
+    acf_t = numpy.fft.irfft(f_kw * numpy.conjugate(f_kw), n=nfft, axis=0)[:nsamples].real.mean(axis=1)
+    if acf_t[0] <= 0.0:
+        return 1.0
+    acf_t /= acf_t[0]
+
+    taus = 2.0 * numpy.cumsum(acf_t) - 1.0
+    windows = numpy.arange(nsamples) < c * taus
+    if windows.all():
+        return taus[-1]
+    return taus[numpy.argmin(windows)]
+
+#=============================================================================================
+# Ensemble moves
+#=============================================================================================
+
+def stretch_move(positions, complement, log_posterior, random_state, a=2.0):
+    """
+    Propose affine-invariant stretch moves for a set of walkers.
+
+    ARGUMENTS
+      positions (numpy array of nwalkers x nparameters) - walkers to move
+      complement (numpy array of ncomplement x nparameters) - walkers of the other half of the ensemble
+      log_posterior (function) - unused; present for a common move signature
+      random_state (numpy.random.RandomState) - random number generator
+
+    OPTIONAL ARGUMENTS
+      a (float) - stretch scale parameter (default: 2)
+
+    RETURNS
+      proposed (numpy array of nwalkers x nparameters) - proposed positions
+      log_factor (numpy array of nwalkers) - log of the proposal factor entering the acceptance test
+
+    """
+
+    (nwalkers, nparameters) = positions.shape
+    z = ((a - 1.0) * random_state.uniform(size=nwalkers) + 1.0)**2 / a
+    partners = complement[random_state.randint(complement.shape[0], size=nwalkers)]
+    proposed = partners + z[:, numpy.newaxis] * (positions - partners)
+    return (proposed, (nparameters - 1) * numpy.log(z))
+
+def differential_evolution_move(positions, complement, log_posterior, random_state, sigma=1.0e-5):
+    """
+    Propose differential evolution moves for a set of walkers.
+
+    ARGUMENTS
+      positions (numpy array of nwalkers x nparameters) - walkers to move
+      complement (numpy array of ncomplement x nparameters) - walkers of the other half of the ensemble
+      log_posterior (function) - unused; present for a common move signature
+      random_state (numpy.random.RandomState) - random number generator
+
+    OPTIONAL ARGUMENTS
+      sigma (float) - relative scale of the random jitter added to each difference vector (default: 1e-5)
+
+    RETURNS
+      proposed (numpy array of nwalkers x nparameters) - proposed positions
+      log_factor (numpy array of nwalkers) - log of the proposal factor entering the acceptance test (zero)
+
+    """
+
+    (nwalkers, nparameters) = positions.shape
+    gamma = 2.38 / numpy.sqrt(2.0 * nparameters)
+    ncomplement = complement.shape[0]
+    first = random_state.randint(ncomplement, size=nwalkers)
+    second = (first + random_state.randint(1, ncomplement, size=nwalkers)) % ncomplement # distinct from first
+    difference = complement[first] - complement[second]
+    proposed = positions + gamma * difference * (1.0 + sigma * random_state.normal(size=(nwalkers, 1)))
+    return (proposed, numpy.zeros(nwalkers))
+
+def rescaling_move(parameter_names, beta, max_scale=1.03):
+    """
+    Build the scale-invariant rescaling move of RescalingStep as a walker update.
+
+    Concentrations Ls and P0 are multiplied by a common factor f, DeltaH is divided by f, and
+    DeltaG is shifted by log(f) / beta, which leaves the binding isotherm nearly unchanged.
+
+    ARGUMENTS
+      parameter_names (list of String) - names of the sampled parameters, which must include 'Ls', 'P0', 'DeltaH', 'DeltaG'
+      beta (float) - inverse temperature 1/(kcal/mol)
+
+    OPTIONAL ARGUMENTS
+      max_scale (float) - largest scaling factor (default: 1.03)
+
+    RETURNS
+      move (function) - move with the signature of stretch_move()
+
+    NOTES
+      Unlike RescalingStep, the acceptance test includes the Jacobian f of the transformation.
+
+    """
+
+    index = dict((name, parameter_names.index(name)) for name in ['Ls', 'P0', 'DeltaH', 'DeltaG'])
+
+    def move(positions, complement, log_posterior, random_state):
+        nwalkers = positions.shape[0]
+        # Choose trial scaling factor or its inverse with equal probability, so that proposal move is symmetric.
+        factor = (max_scale - 1.0) * random_state.uniform(size=nwalkers) + 1.0
+        invert = random_state.uniform(size=nwalkers) < 0.5
+        factor[invert] = 1.0 / factor[invert]
+
+        proposed = positions.copy()
+        proposed[:, index['Ls']] *= factor
+        proposed[:, index['P0']] *= factor
+        proposed[:, index['DeltaH']] /= factor
+        proposed[:, index['DeltaG']] += (1.0 / beta) * numpy.log(factor)
+        return (proposed, numpy.log(factor))
+
+    return move
+
+known_moves = {
+    'stretch' : stretch_move,
+    'differential-evolution' : differential_evolution_move,
+    }
+
+#=============================================================================================
+# Ensemble sampler
+#=============================================================================================
+
+class EnsembleSampler(object):
+    """
+    An ensemble MCMC sampler advancing many walkers per iteration with a vectorized log-posterior.
+
+    The samples are kept in memory; trace(name)[:] returns the samples of one parameter, pooled over
+    walkers, in the same way as a pymc.MCMC trace.
+
+    """
+
+    def __init__(self, log_posterior, parameter_names, nwalkers=None, moves=None, random_state=None, verbose=False):
+        """
+        Create an ensemble sampler.
+
+        ARGUMENTS
+          log_posterior (function) - log_posterior(x) returns the log-posterior for each row of x (nwalkers x nparameters),
+            and -inf outside the support of the prior
+          parameter_names (list of String) - names of the parameters, in the order of the columns of x
+
+        OPTIONAL ARGUMENTS
+          nwalkers (int) - number of walkers; must be even and at least 2 * nparameters (default: 4 * nparameters)
+          moves (list of (move, weight)) - moves, given by a name in known_moves or a function, and the probability with
+            which each iteration uses them (default: [('stretch', 1.0)])
+          random_state (numpy.random.RandomState) - random number generator (default: a new RandomState seeded from numpy.random)
+          verbose (bool) - if True, print progress (default: False)
+
+        """
+
+        self.log_posterior = log_posterior
+        self.parameter_names = list(parameter_names)
+        self.nparameters = len(self.parameter_names)
+
+        if nwalkers is None:
+            nwalkers = 4 * self.nparameters
+        if (nwalkers % 2) or (nwalkers < 2 * self.nparameters):
+            raise ValueError("Number of walkers must be even and at least twice the number of parameters (%d)." % self.nparameters)
+        self.nwalkers = nwalkers
+
+        if moves is None:
+            moves = [('stretch', 1.0)]
+        self.moves = [known_moves[move] if move in known_moves else move for (move, weight) in moves]
+        weights = numpy.array([weight for (move, weight) in moves], numpy.float64)
+        self.move_probabilities = weights / weights.sum()
+
+        if random_state is None:
+            random_state = numpy.random.RandomState(numpy.random.randint(2**31 - 1))
+        self.random_state = random_state
+        self.verbose = verbose
+
+        self.samples = None
+        self.naccepted = 0
+        self.nproposed = 0
+        self.cpu_time = 0.0
+
+    def sample(self, initial_positions, niterations, nburn=0, nthin=1, monitor=None):
+        """
+        Advance the ensemble and store samples.
+
+        ARGUMENTS
+          initial_positions (numpy array of nwalkers x nparameters) - starting walker positions, with finite log-posterior
+          niterations (int) - total number of iterations, including burn-in; the largest number if a monitor is given
+
+        OPTIONAL ARGUMENTS
+          nburn (int) - number of initial iterations to discard (default: 0)
+          nthin (int) - store every nthin-th iteration after burn-in (default: 1)
+          monitor (convergence.ConvergenceMonitor) - if specified, the samples stored by this call are passed to
+            monitor.update() as they grow, with the walkers as chains, and sampling stops once it reports convergence;
+            the CPU time passed to the monitor is that of this call
+
+        RETURNS
+          samples (numpy array of nsamples x nwalkers x nparameters) - stored walker positions
+
+        """
+
+        positions = numpy.array(initial_positions, numpy.float64)
+        if positions.shape != (self.nwalkers, self.nparameters):
+            raise ValueError("Initial positions must have shape (%d, %d)." % (self.nwalkers, self.nparameters))
+        log_posteriors = self.log_posterior(positions)
+        if not numpy.all(numpy.isfinite(log_posteriors)):
+            raise ValueError("Initial positions must all have finite log-posterior.")
+
+        initial_time = cpu_time()
+
+        nsamples = max(0, (niterations - nburn + nthin - 1) // nthin)
+        samples = numpy.zeros([nsamples, self.nwalkers, self.nparameters], numpy.float64)
+        halves = [numpy.arange(0, self.nwalkers // 2), numpy.arange(self.nwalkers // 2, self.nwalkers)]
+        random_state = self.random_state
+
+        nstored = 0
+        for iteration in range(niterations):
+            move = self.moves[random_state.choice(len(self.moves), p=self.move_probabilities)]
+            for (active, other) in [(halves[0], halves[1]), (halves[1], halves[0])]:
+                (proposed, log_factor) = move(positions[active], positions[other], self.log_posterior, random_state)
+                proposed_log_posteriors = self.log_posterior(proposed)
+
+                # Metropolis acceptance test for all walkers of this half at once.
+                with numpy.errstate(invalid='ignore'):
+                    log_ratio = log_factor + proposed_log_posteriors - log_posteriors[active]
+                accept = numpy.log(random_state.uniform(size=active.size)) < log_ratio
+                positions[active[accept]] = proposed[accept]
+                log_posteriors[active[accept]] = proposed_log_posteriors[accept]
+
+                if iteration >= nburn:
+                    self.naccepted += accept.sum()
+                    self.nproposed += active.size
+
+            if (iteration >= nburn) and ((iteration - nburn) % nthin == 0):
+                samples[nstored] = positions
+                nstored += 1
+
+            if self.verbose and ((iteration + 1) % max(1, niterations // 10) == 0):
+                print("iteration %8d / %8d" % (iteration + 1, niterations))
+
+            if (monitor is not None) and (nstored >= monitor.next_check()):
+                if monitor.update(samples[:nstored], cpu_time() - initial_time):
+                    samples = samples[:nstored]
+                    break
+
+        # Diagnose the full run if it ended between checks.
+        if (monitor is not None) and (not monitor.converged) and (nstored > 0) and ((not monitor.history) or (monitor.history[-1]['nsamples'] < nstored)):
+            monitor.update(samples[:nstored], cpu_time() - initial_time)
+
+        self.cpu_time += cpu_time() - initial_time
+        self.positions = positions
+        self.log_posteriors = log_posteriors
+
+        if self.samples is None:
+            self.samples = samples
+        else:
+            self.samples = numpy.concatenate([self.samples, samples])
+
+        return samples
+
+    def trace(self, name):
+        """
+        Return the stored samples of one parameter, pooled over walkers.
+
+        ARGUMENTS
+          name (String) - parameter name
+
+        RETURNS
+          x_n (numpy array) - samples, ordered by iteration and then by walker
+
+        """
+
+        return self.samples[:, :, self.parameter_names.index(name)].ravel()
+
+    def acceptance_fraction(self):
+        """
+        Return the fraction of proposals accepted after burn-in.
+
+        """
+
+        if self.nproposed == 0:
+            return 0.0
+        return float(self.naccepted) / float(self.nproposed)
+
+    def autocorrelation_times(self):
+        """
+        Return the integrated autocorrelation time of each parameter, in stored samples.
+
+        RETURNS
+          tau (dict) - tau[name] is the integrated autocorrelation time of parameter name
+
+        """
+
+        return dict((name, integrated_autocorrelation_time(self.samples[:, :, index])) for (index, name) in enumerate(self.parameter_names))
+
+    def effective_sample_sizes(self):
+        """
+        Return the number of effective samples of each parameter, pooled over walkers.
+
+        RETURNS
+          ess (dict) - ess[name] is the effective sample size of parameter name
+
+        """
+
+        nsamples = self.samples.shape[0] * self.nwalkers
+        tau = self.autocorrelation_times()
+        return dict((name, nsamples / max(1.0, tau[name])) for name in self.parameter_names)
+
+    def report(self, outfile=None):
+        """
+        Print a summary of sampling efficiency: acceptance, autocorrelation times, and effective samples per CPU-second.
+
+        OPTIONAL ARGUMENTS
+          outfile (file) - file to write to (default: print to standard output)
+
+        """
+
+        tau = self.autocorrelation_times()
+        ess = self.effective_sample_sizes()
+        cpu_time = max(self.cpu_time, 1.0e-9)
+
+        lines = list()
+        lines.append("%d walkers, %d samples per walker, acceptance %.3f, %.2f CPU-seconds" % (self.nwalkers, self.samples.shape[0], self.acceptance_fraction(), self.cpu_time))
+        lines.append("%-12s %10s %12s %14s" % ('parameter', 'tau', 'ESS', 'ESS/CPU-s'))
+        for name in self.parameter_names:
+            lines.append("%-12s %10.2f %12.1f %14.1f" % (name, tau[name], ess[name], ess[name] / cpu_time))
+        lines.append("%-12s %10s %12.1f %14.1f" % ('minimum', '', min(ess.values()), min(ess.values()) / cpu_time))
+
+        if outfile is None:
+            for line in lines:
+                print(line)
+        else:
+            for line in lines:
+                outfile.write(line + '\n')
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# integration.py
+#
+# Integration of baseline-corrected differential power into heats evolved per injection.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Integration of baseline-corrected differential power into heats evolved per injection.
+
+All injections are integrated together: the baseline-corrected power is computed for the whole trace,
+and summed over the measurements of each injection with a single numpy.add.reduceat call.
+The heats, injection end times, and noise estimates are returned as arrays with one entry per injection.
+
+Two quadratures are provided in known_quadratures:
+
+  'rectangle' - each measurement is the average power over one filter period (the VP-ITC convention)
+  'trapezoid' - trapezoid rule on the recorded measurement times, for traces with irregular spacing
+
+EXAMPLES
+
+  import integration
+  data = integration.integrate_injections(time, power, baseline_power, first_index, last_index, filter_period)
+  print data['evolved_heat'] / Units.ucal
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import numpy
+
+#=============================================================================================
+# Segment sums
+#=============================================================================================
+
+def segment_sums(x, first_index, last_index):
+    """
+    Sum an array over the index ranges [first_index, last_index] of each injection.
+
+    ARGUMENTS
+      x (numpy array) - values to sum
+      first_index (numpy array of int) - index of the first element of each range
+      last_index (numpy array of int) - index of the last element of each range, in increasing order
+
+    RETURNS
+      sums (numpy array) - sum of x over each range; zero for empty ranges
+
+    """
+
+    first_index = numpy.asarray(first_index, numpy.int64)
+    last_index = numpy.asarray(last_index, numpy.int64)
+    if first_index.size == 0:
+        return numpy.zeros([0], x.dtype)
+
+    # Interleave range starts and ends, so every other reduceat sum is one range.
+    # A trailing zero makes an end of len(x) a valid index.
+    x = numpy.append(x, 0)
+    boundaries = numpy.empty([2 * first_index.size], numpy.int64)
+    boundaries[0::2] = first_index
+    boundaries[1::2] = last_index + 1
+    sums = numpy.add.reduceat(x, boundaries)[0::2]
+    sums[last_index < first_index] = 0
+
+    return sums
+
+#=============================================================================================
+# Quadratures
+#=============================================================================================
+
+def rectangle_rule(time, excess_power, filter_period_n, first_index, last_index):
+    """
+    Integrate the excess power of each injection, assuming each measurement averages the power over one filter period.
+
+    ARGUMENTS
+      time (numpy array) - time at the end of the filter period of each measurement
+      excess_power (numpy array) - baseline-corrected differential power of each measurement
+      filter_period_n (numpy array) - filter period of each injection
+      first_index, last_index (numpy arrays of int) - measurement ranges of the injections
+
+    RETURNS
+      energy (numpy array) - excess energy input of each injection
+
+    """
+
+    return filter_period_n * segment_sums(excess_power, first_index, last_index)
+
+def trapezoid_rule(time, excess_power, filter_period_n, first_index, last_index):
+    """
+    Integrate the excess power of each injection by the trapezoid rule on the recorded measurement times.
+
+    Each measurement closes the interval since the previous measurement, so the intervals of consecutive
+    injections tile the trace without overlap.  The interval closed by the first measurement of the trace
+    is taken to be one filter period.
+
+    ARGUMENTS
+      time (numpy array) - time at the end of the filter period of each measurement
+      excess_power (numpy array) - baseline-corrected differential power of each measurement
+      filter_period_n (numpy array) - filter period of each injection
+      first_index, last_index (numpy arrays of int) - measurement ranges of the injections
+
+    RETURNS
+      energy (numpy array) - excess energy input of each injection
+
+    """
+
+    interval_energy = numpy.empty(excess_power.shape, numpy.float64)
+    interval_energy[1:] = 0.5 * (excess_power[1:] + excess_power[:-1]) * numpy.diff(time)
+    if interval_energy.size:
+        interval_energy[0] = excess_power[0] * (filter_period_n[0] if filter_period_n.size else 0.0)
+    return segment_sums(interval_energy, first_index, last_index)
+
+known_quadratures = {
+    'rectangle' : rectangle_rule,
+    'trapezoid' : trapezoid_rule,
+    }
+
+#=============================================================================================
+# Integration of injections
+#=============================================================================================
+
+def integrate_injections(time, power, baseline_power, first_index, last_index, filter_period_n, quadrature='rectangle'):
+    """
+    Integrate the heat evolved by each injection, with end times and noise estimates.
+
+    ARGUMENTS
+      time (numpy array) - time at the end of the filter period of each measurement
+      power (numpy array) - differential power of each measurement
+      baseline_power (numpy array) - baseline power at each measurement
+      first_index (numpy array of int) - index of the first measurement following each injection
+      last_index (numpy array of int) - index of the last measurement following each injection
+      filter_period_n (numpy array) - filter period of each injection
+
+    OPTIONAL ARGUMENTS
+      quadrature (String) - name of quadrature in known_quadratures (default: 'rectangle')
+
+    RETURNS
+      data (dict) - arrays with one entry per injection:
+        'evolved_heat' - heat evolved by the injection (negative of the excess energy input into the sample cell)
+        'end_time' - time of the last measurement of the injection
+        'power_noise' - standard deviation of the measurement noise, from successive differences of the excess power
+        'heat_noise' - standard deviation of the evolved heat due to that noise, treated as uncorrelated
+
+    """
+
+    time = numpy.asarray(time, numpy.float64)
+    first_index = numpy.asarray(first_index, numpy.int64)
+    last_index = numpy.asarray(last_index, numpy.int64)
+    filter_period_n = numpy.asarray(filter_period_n, numpy.float64)
+
+    # Determine excess energy input into sample cell (with respect to reference cell) throughout each injection and measurement period.
+    excess_power = numpy.asarray(power, numpy.float64) - numpy.asarray(baseline_power, numpy.float64)
+    excess_energy_input = known_quadratures[quadrature](time, excess_power, filter_period_n, first_index, last_index)
+
+    # Noise from successive differences, which removes the slowly varying heat signal.
+    nsamples = numpy.maximum(last_index - first_index + 1, 0)
+    squared_differences = numpy.append(numpy.diff(excess_power)**2, 0.0)
+    ndifferences = numpy.maximum(nsamples - 1, 1)
+    power_noise = numpy.sqrt(segment_sums(squared_differences, first_index, last_index - 1) / (2.0 * ndifferences))
+
+    data = dict()
+    data['evolved_heat'] = - excess_energy_input
+    data['end_time'] = time[last_index]
+    data['power_noise'] = power_noise
+    data['heat_noise'] = filter_period_n * power_noise * numpy.sqrt(nsamples)
+    return data
@@ -0,0 +1,707 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# itcfile.py
+#
+# Fast readers for MicroCal VP-ITC and Auto iTC-200 text-formatted .itc files.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Fast readers for MicroCal VP-ITC and Auto iTC-200 text-formatted .itc files.
+
+An .itc file consists of a header (lines beginning with '$', '#', '%', '?') followed by a block
+of comma-separated power measurements.  Each injection is announced by a line beginning with
+'@n', where '@0' marks the measurements collected before the first injection.
+
+The power measurement block is read in a single pass: the column layout is determined once from
+the first row following '@0', the block is split only at injection markers, and all numeric data
+is converted by numpy in one bulk call.
+
+Three column layouts are currently recognized:
+
+  9 columns - Berkeley Auto iTC-200 (time, power, temperature, a, jacket temperature, c, d, e, f)
+  7 columns - Shoichet lab VP-ITC (time, power, temperature, a, jacket temperature, c, d)
+  3 columns - David Minh's VP-ITC (time, power, temperature)
+
+EXAMPLES
+
+  import Units
+  import itcfile
+  data = itcfile.read_itc_file('01232015/20150123a1.itc')
+  print data['differential_power'].mean() / (Units.ucal/Units.s)
+
+Parsed power measurements can be kept in a binary sidecar cache next to each .itc file, so that
+later reads memory-map the columns instead of re-parsing the text:
+
+  data = itcfile.read_itc_file('01232015/20150123a1.itc', cache=True)
+
+Runs that are still in progress can be followed with ITCFileFollower, which reports each injection
+as soon as its block of measurements closes:
+
+  python itcfile.py 20150123a1.itc
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import os
+import json
+import time
+import Units
+import Constants
+
+import numpy
+
+#=============================================================================================
+# Constants
+#=============================================================================================
+
+# Index of the jacket temperature column, for layouts that record it.
+JACKET_TEMPERATURE_COLUMN = 4
+
+#=============================================================================================
+# Parsing of header
+#=============================================================================================
+
+def parse_injections(header):
+    """
+    Extract metadata about the programmed injections from the header of an .itc file.
+
+    ARGUMENTS
+      header (list of String) - lines of the file preceding the '@0' injection marker
+
+    RETURNS
+      injections (list of dict) - one dict per injection, with keys 'number', 'volume', 'duration', 'spacing', 'filter_period'
+
+    """
+
+    injections = list()
+    injection_number = 0
+    for line in header[10:]:
+        if line[0] != '$':
+            break
+
+        # Increment injection counter.
+        injection_number += 1
+
+        # Read data about injection.
+        (injection_volume, injection_duration, spacing, filter_period) = line[1:].strip().split(",")
+
+        # Extract data for injection and apply appropriate unit conversions.
+        injection = dict()
+        injection['number'] = injection_number
+        injection['volume'] = float(injection_volume) * Units.ul # volume of injection
+        injection['duration'] = float(injection_duration) * Units.s # duration of injection
+        injection['spacing'] = float(spacing) * Units.s # time between beginning of injection and beginning of next injection
+        injection['filter_period'] = float(filter_period) * Units.s # time over which data channel is averaged to produce a single measurement
+
+        # Store injection.
+        injections.append(injection)
+
+    return injections
+
+#=============================================================================================
+# Injection table
+#=============================================================================================
+
+# Fields of the injection table, in units of Units.py.
+INJECTION_DTYPE = numpy.dtype([
+    ('number', numpy.int64), # sequence number of injection
+    ('volume', numpy.float64), # programmed volume of injection
+    ('duration', numpy.float64), # duration of injection
+    ('spacing', numpy.float64), # time between beginning of injection and beginning of next injection
+    ('filter_period', numpy.float64), # time over which data channel is averaged to produce a single measurement
+    ('first_index', numpy.int64), # index of first measurement following injection
+    ('last_index', numpy.int64), # index of last measurement following injection
+    ('evolved_heat', numpy.float64), # heat evolved by injection (NaN until integrated)
+    ])
+
+class Injection(object):
+    """
+    Dict-style view of one row of an InjectionTable.
+
+    Reading or assigning injection['volume'] reads or writes the table itself.
+
+    """
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._table.data[key][self._index]
+
+    def __setitem__(self, key, value):
+        if key not in INJECTION_DTYPE.names:
+            raise KeyError("Injection table has no field '%s'." % key)
+        self._table.data[key][self._index] = value
+
+    def __contains__(self, key):
+        return key in INJECTION_DTYPE.names
+
+    def keys(self):
+        return list(INJECTION_DTYPE.names)
+
+    def get(self, key, default=None):
+        if key in INJECTION_DTYPE.names:
+            return self[key]
+        return default
+
+    def __repr__(self):
+        return repr(dict((key, self[key]) for key in INJECTION_DTYPE.names))
+
+class InjectionTable(object):
+    """
+    Injections of an experiment, stored as one numpy structured array with a column per field.
+
+    Indexing with a field name returns (or assigns) a whole column, so models and writers can read
+    columns directly.  Indexing with an integer returns a dict-style Injection view of one row, and
+    iteration yields such views, so code written for a list of injection dicts keeps working.
+    Slicing returns a table sharing the same storage.
+
+    EXAMPLES
+
+      injections = InjectionTable.from_dicts(parse_injections(header))
+      volumes = injections['volume']
+      injections[0]['evolved_heat'] = 0.0
+
+    """
+
+    def __init__(self, ninjections=0):
+        """
+        Create a table of injections with default values.
+
+        OPTIONAL ARGUMENTS
+          ninjections (int) - number of injections (default: 0)
+
+        """
+
+        self.data = numpy.zeros([ninjections], INJECTION_DTYPE)
+        self.data['number'] = numpy.arange(1, ninjections + 1)
+        self.data['evolved_heat'] = numpy.nan
+
+    @classmethod
+    def from_dicts(cls, injections):
+        """
+        Create a table from a list of injection dicts, such as returned by parse_injections().
+
+        ARGUMENTS
+          injections (list of dict) - injections; fields missing from the dicts keep their default values
+
+        RETURNS
+          table (InjectionTable) - the table
+
+        """
+
+        table = cls(len(injections))
+        for name in INJECTION_DTYPE.names:
+            if injections and all(name in injection for injection in injections):
+                table.data[name] = [injection[name] for injection in injections]
+        return table
+
+    def __len__(self):
+        return self.data.size
+
+    def __iter__(self):
+        for index in range(self.data.size):
+            yield Injection(self, index)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[key]
+        if isinstance(key, slice):
+            table = InjectionTable()
+            table.data = self.data[key]
+            return table
+        if key < 0:
+            key += self.data.size
+        if not 0 <= key < self.data.size:
+            raise IndexError("injection index out of range")
+        return Injection(self, key)
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError("Assign injection fields by name, e.g. table['evolved_heat'] = heats.")
+        self.data[key] = value
+
+    def to_dicts(self):
+        """
+        Return the injections as a list of dicts.
+
+        """
+
+        return [dict((name, row[name].item()) for name in INJECTION_DTYPE.names) for row in self.data]
+
+#=============================================================================================
+# Parsing of power measurements
+#=============================================================================================
+
+def parse_power_data(block):
+    """
+    Parse the block of power measurements that follows the header of an .itc file.
+
+    ARGUMENTS
+      block (bytes) - the file contents starting at the '@0' injection marker
+
+    RETURNS
+      data (dict) - power measurements, with keys:
+        'ncolumns' (int) - number of columns in the data layout
+        'filter_period_end_time' (numpy array) - time at end of filtering period
+        'differential_power' (numpy array) - "differential" power applied to sample cell
+        'cell_temperature' (numpy array) - cell temperature
+        'jacket_temperature' (numpy array) - adiabatic jacket temperature
+        'first_index' (numpy int array) - index of first measurement of injections 1..n
+        'last_index' (numpy int array) - index of last measurement of injections 1..n
+
+    NOTES
+      Measurements collected before the first injection ('@0') are not included in 'first_index' or 'last_index'.
+      If no jacket temperature column is present, the jacket temperature is reported as 0 C.
+
+    """
+
+    # Split the block at injection markers.  Markers are rare, so only they are visited in Python;
+    # the measurement rows between them are handled as whole byte strings.
+    segments = list()
+    injection_labels = list()
+    nmeasurements = 0
+    marker = 0
+    while marker >= 0:
+        start = block.find(b'\n', marker) + 1
+        if start == 0:
+            start = len(block)
+        marker = block.find(b'\n@', start - 1)
+        end = len(block) if (marker < 0) else (marker + 1)
+        segment = block[start:end].strip()
+        injection_labels.append(nmeasurements)
+        if segment:
+            nmeasurements += segment.count(b'\n') + 1
+            segments.append(segment)
+        if marker >= 0:
+            marker += 1
+    if nmeasurements == 0:
+        raise ValueError("No power measurements found.")
+
+    # Detect the column layout once, from the first measurement.
+    first_row = segments[0].split(b'\n', 1)[0]
+    ncolumns = first_row.count(b',') + 1
+    if ncolumns < 3:
+        raise ValueError("Unrecognized power measurement layout with %d columns." % ncolumns)
+
+    # Convert all measurements in one bulk call.
+    text = b','.join(segments).replace(b'\n', b',')
+    values = numpy.fromstring(text, dtype=numpy.float64, sep=',')
+    if values.size != nmeasurements * ncolumns:
+        raise ValueError("Expected %d x %d power measurements but read %d values; all rows must share the layout of the first row." % (nmeasurements, ncolumns, values.size))
+    table = values.reshape([nmeasurements, ncolumns])
+
+    # Store data about measured heat liberated during each injection, applying unit conversions.
+    data = dict()
+    data['ncolumns'] = ncolumns
+    data['filter_period_end_time'] = table[:,0] * Units.s # time at end of filtering period (s)
+    data['differential_power'] = table[:,1] * (Units.ucal/Units.s) # "differential" power applied to sample cell (ucal/s)
+    data['cell_temperature'] = table[:,2] + Constants.absolute_zero # cell temperature (K)
+    if ncolumns > JACKET_TEMPERATURE_COLUMN:
+        data['jacket_temperature'] = table[:,JACKET_TEMPERATURE_COLUMN] + Constants.absolute_zero # adiabatic jacket temperature (K)
+    else:
+        data['jacket_temperature'] = numpy.zeros([nmeasurements], numpy.float64) + Constants.absolute_zero
+
+    # Determine the range of measurements belonging to each injection, excluding '@0'.
+    boundaries = numpy.array(injection_labels + [nmeasurements], numpy.int64)
+    data['first_index'] = boundaries[1:-1]
+    data['last_index'] = boundaries[2:] - 1
+
+    return data
+
+#=============================================================================================
+# Binary sidecar cache
+#=============================================================================================
+
+# Version of the sidecar cache layout; caches written with a different version are ignored.
+CACHE_VERSION = 1
+
+# Power measurement columns stored in the sidecar cache, in unit-converted form.
+CACHED_COLUMNS = ['filter_period_end_time', 'differential_power', 'cell_temperature', 'jacket_temperature']
+
+def cache_filenames(filename, cache_directory=None):
+    """
+    Return the names of the sidecar cache files for an .itc file.
+
+    ARGUMENTS
+      filename (String) - the name of the .itc file
+
+    OPTIONAL ARGUMENTS
+      cache_directory (String) - if specified, the cache is kept in this directory instead of alongside the .itc file
+
+    RETURNS
+      columns_filename (String) - the .npy file holding the power measurement columns
+      metadata_filename (String) - the .json file holding the header, injection indices, and source file signature
+
+    """
+    if cache_directory is None:
+        basename = filename
+    else:
+        basename = os.path.join(cache_directory, os.path.basename(filename))
+    return (basename + '.cache.npy', basename + '.cache.json')
+
+def _file_signature(filename):
+    """
+    Return the (size, mtime) signature used to invalidate the sidecar cache of a file.
+
+    """
+    stat = os.stat(filename)
+    return (stat.st_size, stat.st_mtime)
+
+def _read_cache(filename, cache_directory):
+    """
+    Memory-map the sidecar cache for an .itc file, returning None if it is missing or stale.
+
+    """
+    (columns_filename, metadata_filename) = cache_filenames(filename, cache_directory)
+    try:
+        infile = open(metadata_filename, 'r')
+        metadata = json.load(infile)
+        infile.close()
+
+        (size, mtime) = _file_signature(filename)
+        if (metadata['version'] != CACHE_VERSION) or (metadata['size'] != size) or (metadata['mtime'] != mtime):
+            return None
+
+        # Columns are only paged in from disk as they are accessed.
+        table = numpy.load(columns_filename, mmap_mode='r')
+        if table.shape != (len(CACHED_COLUMNS), metadata['nmeasurements']):
+            return None
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+    data = dict()
+    for (index, column) in enumerate(CACHED_COLUMNS):
+        data[column] = table[index]
+    data['ncolumns'] = metadata['ncolumns']
+    data['first_index'] = numpy.array(metadata['first_index'], numpy.int64)
+    data['last_index'] = numpy.array(metadata['last_index'], numpy.int64)
+    data['header'] = metadata['header']
+
+    return data
+
+def _write_cache(filename, data, signature, cache_directory):
+    """
+    Write the sidecar cache for an .itc file.  Failure to write the cache is not an error.
+
+    """
+    (columns_filename, metadata_filename) = cache_filenames(filename, cache_directory)
+
+    metadata = dict()
+    metadata['version'] = CACHE_VERSION
+    metadata['size'] = signature[0]
+    metadata['mtime'] = signature[1]
+    metadata['nmeasurements'] = int(data['differential_power'].size)
+    metadata['ncolumns'] = data['ncolumns']
+    metadata['first_index'] = [int(index) for index in data['first_index']]
+    metadata['last_index'] = [int(index) for index in data['last_index']]
+    metadata['header'] = data['header']
+
+    # Write to temporary files first so that readers never see a partially-written cache.
+    # The metadata is written last, since its presence marks the cache as complete.
+    try:
+        outfile = open(columns_filename + '.tmp', 'wb')
+        numpy.save(outfile, numpy.array([data[column] for column in CACHED_COLUMNS], numpy.float64))
+        outfile.close()
+        os.rename(columns_filename + '.tmp', columns_filename)
+
+        outfile = open(metadata_filename + '.tmp', 'w')
+        json.dump(metadata, outfile)
+        outfile.close()
+        os.rename(metadata_filename + '.tmp', metadata_filename)
+    except (IOError, OSError):
+        pass
+
+    return
+
+#=============================================================================================
+# Reading of .itc files
+#=============================================================================================
+
+def read_itc_file(filename, cache=False, cache_directory=None):
+    """
+    Read the header and power measurements from a MicroCal VP-ITC or Auto iTC-200 formatted .itc file.
+
+    ARGUMENTS
+      filename (String) - the name of the .itc file to read
+
+    OPTIONAL ARGUMENTS
+      cache (bool) - if True, power measurements are memory-mapped from a binary sidecar cache, which is
+        written the first time the file is parsed and rewritten whenever the file size or mtime changes (default: False)
+      cache_directory (String) - if specified, sidecar caches are kept in this directory instead of alongside the .itc file
+
+    RETURNS
+      data (dict) - the power measurements described in parse_power_data(), plus:
+        'header' (list of String) - lines of the file preceding the '@0' injection marker
+
+    NOTES
+      Power measurements read from the cache are read-only numpy.memmap views.
+
+    """
+
+    # Check to make sure we can access the file.
+    if not os.access(filename, os.R_OK):
+        raise IOError("The file '%s' cannot be opened." % filename)
+
+    if cache:
+        data = _read_cache(filename, cache_directory)
+        if data is not None:
+            return data
+        # Take the signature before reading, so a file modified while being parsed is not cached as current.
+        signature = _file_signature(filename)
+
+    infile = open(filename, 'rb')
+    contents = infile.read()
+    infile.close()
+
+    # Check the header to make sure it is a VP-ITC text-formatted .itc file.
+    if contents[0:4] != b'$ITC':
+        raise ValueError("File '%s' doesn't appear to be a Microcal VP-ITC data file." % filename)
+
+    # Split the header from the block of power measurements.
+    start = contents.find(b'\n@0')
+    if start < 0:
+        raise ValueError("File '%s' contains no power measurements." % filename)
+
+    try:
+        data = parse_power_data(contents[start+1:])
+    except ValueError as e:
+        raise ValueError("File '%s': %s" % (filename, str(e)))
+    data['header'] = contents[:start+1].decode('latin-1').splitlines(True)
+
+    if cache:
+        _write_cache(filename, data, signature, cache_directory)
+
+    return data
+
+#=============================================================================================
+# Streaming reader for in-progress runs
+#=============================================================================================
+
+class ITCFileFollower(object):
+    """
+    Incrementally read an .itc file that is still being written by the instrument.
+
+    Each time the block of power measurements following an '@n' injection marker closes, a record
+    for that injection is produced, with a local baseline and integrated heat computed from that
+    injection's measurements alone.  A block closes when the next injection marker is written, or,
+    for the last programmed injection, once its measurements span the programmed spacing.
+
+    The local baseline is a straight line through the mean of the last baseline_fraction of the
+    measurements preceding the injection and the mean of the last baseline_fraction of the
+    measurements of the injection itself, mirroring the windows used by Experiment.fit_baseline().
+
+    EXAMPLES
+
+      follower = ITCFileFollower('20150123a1.itc')
+      for injection in follower.follow(poll_interval=30.0, timeout=1800.0):
+          print "%5d %12.3f ucal" % (injection['number'], injection['evolved_heat'] / Units.ucal)
+      if not follower.complete:
+          print "Run stopped after %d injections." % len(follower.completed)
+
+    """
+
+    def __init__(self, filename, baseline_fraction=0.05):
+        """
+        ARGUMENTS
+          filename (String) - the name of the .itc file to follow
+
+        OPTIONAL ARGUMENTS
+          baseline_fraction (float) - fraction of each block used to estimate the local baseline (default: 0.05)
+
+        """
+
+        self.filename = filename
+        self.baseline_fraction = baseline_fraction
+
+        self.header = None # lines of the file preceding the '@0' injection marker, once written
+        self.injections = list() # programmed injections, from the header
+        self.completed = list() # records of completed injections
+        self.ncolumns = None # number of columns in the data layout
+        self.nmeasurements = 0 # number of power measurements in closed blocks
+
+        self._offset = 0 # number of bytes of the file consumed so far
+        self._pending = b'' # bytes read but not yet processed
+        self._block_number = None # number of the currently open block
+        self._block_rows = list() # power measurement rows of the currently open block
+        self._previous_block = None # (time, power) of the last closed block
+
+    @property
+    def complete(self):
+        """
+        True once all programmed injections have been read.
+
+        """
+        return (self.header is not None) and (len(self.completed) == len(self.injections))
+
+    def poll(self):
+        """
+        Read any data appended to the file since the last poll.
+
+        RETURNS
+          records (list of dict) - records of injections whose blocks closed during this poll
+
+        """
+
+        infile = open(self.filename, 'rb')
+        infile.seek(self._offset)
+        contents = infile.read()
+        infile.close()
+        self._offset += len(contents)
+
+        # Only process complete lines.
+        self._pending += contents
+        end = self._pending.rfind(b'\n') + 1
+        if end == 0:
+            return list()
+        lines = self._pending[:end]
+        self._pending = self._pending[end:]
+
+        # Wait until the header is complete.
+        if self.header is None:
+            start = lines.find(b'\n@0')
+            if start < 0:
+                self._pending = lines + self._pending
+                return list()
+            self.header = lines[:start+1].decode('latin-1').splitlines(True)
+            self.injections = parse_injections(self.header)
+            lines = lines[start+1:]
+
+        records = list()
+        for line in lines.split(b'\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0:1] == b'@':
+                records += self._close_block()
+                self._block_number = int(line[1:].split(b',')[0])
+            else:
+                if self.ncolumns is None:
+                    self.ncolumns = line.count(b',') + 1
+                self._block_rows.append(line)
+
+        # The last programmed injection has no following marker, so close it once its measurements span the programmed spacing.
+        if (self._block_number == len(self.injections)) and (len(self._block_rows) > 1):
+            first_time = float(self._block_rows[0].split(b',')[0]) * Units.s
+            second_time = float(self._block_rows[1].split(b',')[0]) * Units.s
+            last_time = float(self._block_rows[-1].split(b',')[0]) * Units.s
+            if (last_time - first_time) + (second_time - first_time) >= self.injections[-1]['spacing']:
+                records += self._close_block()
+
+        return records
+
+    def finish(self):
+        """
+        Close the currently open block, for use once the file is known to be finished.
+
+        RETURNS
+          records (list of dict) - the record of the final injection, if one was open
+
+        """
+        records = self.poll()
+        records += self._close_block()
+        return records
+
+    def follow(self, poll_interval=30.0, timeout=None):
+        """
+        Generate injection records as the file grows, until all programmed injections have been read.
+
+        OPTIONAL ARGUMENTS
+          poll_interval (float) - time to wait between polls of the file, in seconds (default: 30)
+          timeout (float) - if specified, stop once the file has not grown for this many seconds; the open block is closed (default: None)
+
+        """
+
+        last_growth = time.time()
+        while not self.complete:
+            offset = self._offset
+            for record in self.poll():
+                yield record
+            if self._offset != offset:
+                last_growth = time.time()
+            elif (timeout is not None) and (time.time() - last_growth > timeout):
+                for record in self.finish():
+                    yield record
+                return
+            if not self.complete:
+                time.sleep(poll_interval)
+
+        return
+
+    def _close_block(self):
+        """
+        Close the currently open block, returning a list containing the record for its injection (if any).
+
+        """
+
+        nrows = len(self._block_rows)
+        if (self._block_number is None) or (nrows == 0):
+            self._block_number = None
+            return list()
+
+        values = numpy.fromstring(b','.join(self._block_rows), dtype=numpy.float64, sep=',')
+        table = values.reshape([nrows, self.ncolumns])
+        filter_period_end_time = table[:,0] * Units.s
+        differential_power = table[:,1] * (Units.ucal/Units.s)
+
+        records = list()
+        if 0 < self._block_number <= len(self.injections):
+            injection = dict(self.injections[self._block_number-1])
+            injection['first_index'] = self.nmeasurements
+            injection['last_index'] = self.nmeasurements + nrows - 1
+
+            # Fit a local baseline through the end of the preceding block and the end of this one.
+            nfit = max(1, int(nrows * self.baseline_fraction))
+            t1 = filter_period_end_time[-nfit:].mean()
+            y1 = differential_power[-nfit:].mean()
+            if self._previous_block is not None:
+                (previous_time, previous_power) = self._previous_block
+                nfit = max(1, int(previous_time.size * self.baseline_fraction))
+                t0 = previous_time[-nfit:].mean()
+                y0 = previous_power[-nfit:].mean()
+                baseline_power = y0 + (y1 - y0) * (filter_period_end_time - t0) / (t1 - t0)
+            else:
+                baseline_power = y1 + 0.0 * filter_period_end_time
+
+            injection['filter_period_end_time'] = filter_period_end_time
+            injection['differential_power'] = differential_power
+            injection['baseline_power'] = baseline_power
+            injection['evolved_heat'] = - injection['filter_period'] * (differential_power - baseline_power).sum()
+
+            self.completed.append(injection)
+            records.append(injection)
+
+        self.nmeasurements += nrows
+        self._previous_block = (filter_period_end_time, differential_power)
+        self._block_number = None
+        self._block_rows = list()
+
+        return records
+
+#=============================================================================================
+# MAIN
+#=============================================================================================
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("usage: python itcfile.py <file.itc>")
+        print("Follow an in-progress run, reporting each injection as it completes.")
+        sys.exit(1)
+
+    follower = ITCFileFollower(sys.argv[1])
+    for injection in follower.follow(poll_interval=10.0, timeout=1800.0):
+        print("%5d %8d %8d %16.3f ucal" % (injection['number'], injection['first_index'], injection['last_index'], injection['evolved_heat'] / Units.ucal))
+    if not follower.complete:
+        print("WARNING: file stopped growing after %d of %d programmed injections." % (len(follower.completed), len(follower.injections)))
+        sys.exit(1)
@@ -0,0 +1,493 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# plots.py
+#
+# Headless rendering of ITC data, enthalpograms, and baseline fits.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Headless rendering of ITC data, enthalpograms, and baseline fits.
+
+Figures are drawn with the object-oriented matplotlib API on an Agg canvas, without touching the
+pyplot state machine, so plots can be written from worker processes and without a display.
+Each page layout is a FigureTemplate whose figure and axes are created once per process and
+cleared between experiments.  Per-injection markers are drawn as single collections
+(vlines, LineCollection, scatter) rather than one artist per injection.
+
+Traces written to files are decimated to at most MAX_POINTS_PER_PANEL points per panel before
+plotting: the minimum and maximum of equal-width buckets are kept, which preserves the envelope
+of the noise, and the injection spikes and baseline-fit measurements are always kept exactly.
+Pass max_points=0 to a render function to plot every measurement; plots shown on screen are
+not decimated unless max_points is given.
+
+Page layouts are registered in known_layouts:
+
+  'analysis'     - differential power, enthalpogram, cell temperature, and jacket temperature
+  'enthalpogram' - differential power and integrated heats, with an optional posterior predictive band
+  'baseline'     - close-up of the baseline fit
+
+Passing filename=None to a render function shows the plot on screen through pyplot instead.
+
+EXAMPLES
+
+  import plots
+  plots.render_analysis(experiment, '20140707a6', 'analysis/20140707a6.pdf')
+  plots.render_baseline(experiment, 'analysis/20140707a6-baseline.png')
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import numpy
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+
+import Units
+import Constants
+
+#=============================================================================================
+# Decimation
+#=============================================================================================
+
+MAX_POINTS_PER_PANEL = 2000 # default cap on the points of a trace drawn into one panel of a file
+
+def decimate_indices(values, max_points, keep=None):
+    """
+    Select the indices of a trace to plot, keeping the minimum and maximum of equal-width buckets.
+
+    ARGUMENTS
+      values (numpy array) - trace values
+      max_points (int) - maximum number of indices to return; 0 or None to return all indices
+
+    OPTIONAL ARGUMENTS
+      keep (numpy array of int) - indices that are always returned (default: None)
+
+    RETURNS
+      indices (numpy array of int) - sorted indices of the points to plot; the first and last points are always included
+
+    NOTES
+      If keep holds more than max_points indices, all of them are still returned.
+
+    """
+
+    values = numpy.asarray(values)
+    npoints = values.size
+    if not max_points or npoints <= max_points:
+        return numpy.arange(npoints)
+
+    if keep is None:
+        keep = numpy.zeros([0], numpy.int64)
+    keep = numpy.unique(numpy.asarray(keep, numpy.int64))
+
+    # Each bucket contributes its minimum and maximum; the kept points and endpoints take up the remainder.
+    nbuckets = max((max_points - keep.size - 2) // 2, 1)
+    bucket_size = -(-npoints // nbuckets)
+    nbuckets = -(-npoints // bucket_size)
+
+    # Pad the last bucket with the last value, so the buckets form a rectangular array.
+    padded = numpy.empty([nbuckets * bucket_size], values.dtype)
+    padded[:npoints] = values
+    padded[npoints:] = values[-1]
+    buckets = padded.reshape([nbuckets, bucket_size])
+    offsets = numpy.arange(nbuckets) * bucket_size
+    extrema = numpy.concatenate([offsets + buckets.argmin(axis=1), offsets + buckets.argmax(axis=1)])
+    extrema = numpy.minimum(extrema, npoints - 1)
+
+    return numpy.unique(numpy.concatenate([[0, npoints - 1], extrema, keep]))
+
+def spike_indices(experiment):
+    """
+    Return the indices of the measurements marking each injection: its first measurement and its largest excess power.
+
+    ARGUMENTS
+      experiment (Experiment) - experiment with fitted baseline
+
+    RETURNS
+      indices (numpy array of int) - sorted measurement indices
+
+    """
+
+    first_index = numpy.asarray(experiment.injections['first_index'], numpy.int64)
+    last_index = numpy.asarray(experiment.injections['last_index'], numpy.int64)
+    excess_power = numpy.abs(experiment.differential_power - experiment.baseline_power)
+    peaks = [first + numpy.argmax(excess_power[first:last+1]) for (first, last) in zip(first_index, last_index) if last >= first]
+
+    return numpy.unique(numpy.concatenate([first_index, numpy.asarray(peaks, numpy.int64)]))
+
+def _resolve_max_points(max_points, filename):
+    """
+    Return the decimation cap of a page: MAX_POINTS_PER_PANEL for files, none on screen, unless given.
+
+    """
+
+    if max_points is None:
+        return MAX_POINTS_PER_PANEL if filename is not None else 0
+
+    return max_points
+
+#=============================================================================================
+# Figure templates
+#=============================================================================================
+
+known_layouts = {
+    'analysis' : 4,
+    'enthalpogram' : 2,
+    'baseline' : 1,
+    }
+
+class FigureTemplate(object):
+    """
+    A figure with a fixed stack of axes, which is cleared and redrawn for each experiment.
+
+    """
+
+    def __init__(self, nrows, fontsize=8, interactive=False):
+        """
+        ARGUMENTS
+          nrows (int) - number of axes, stacked vertically
+
+        OPTIONAL ARGUMENTS
+          fontsize (int) - font size of axis labels, tick labels, and titles (default: 8)
+          interactive (bool) - if True, create the figure through pyplot so it can be shown on screen (default: False)
+
+        """
+
+        if interactive:
+            import pylab
+            self.figure = pylab.figure()
+        else:
+            self.figure = Figure()
+            FigureCanvasAgg(self.figure)
+
+        self.fontsize = fontsize
+        self.axes = [self.figure.add_subplot(nrows, 1, row + 1) for row in range(nrows)]
+        self.reset()
+
+        return
+
+    def reset(self):
+        """
+        Remove all artists from the axes.
+
+        """
+
+        for axes in self.axes:
+            axes.cla()
+            axes.tick_params(labelsize=self.fontsize)
+
+        return
+
+    def label(self, axes, xlabel, ylabel, title=None):
+        """
+        Label an axes of the template in the template font size.
+
+        """
+
+        axes.set_xlabel(xlabel, fontsize=self.fontsize)
+        axes.set_ylabel(ylabel, fontsize=self.fontsize)
+        if title is not None:
+            axes.set_title(title, fontsize=self.fontsize)
+
+        return
+
+    def save(self, filename, **kwargs):
+        """
+        Write the figure to a file, in the format given by the filename extension or the 'format' keyword.
+
+        """
+
+        self.figure.savefig(filename, **kwargs)
+
+        return
+
+_templates = dict()
+
+def get_template(layout, interactive=False):
+    """
+    Return the figure template for a page layout, creating it on first use in this process.
+
+    ARGUMENTS
+      layout (String) - name of layout in known_layouts
+
+    OPTIONAL ARGUMENTS
+      interactive (bool) - if True, return a new on-screen figure instead of the shared Agg template (default: False)
+
+    RETURNS
+      template (FigureTemplate) - the template, with all axes cleared
+
+    """
+
+    if interactive:
+        return FigureTemplate(known_layouts[layout], interactive=True)
+
+    if layout not in _templates:
+        _templates[layout] = FigureTemplate(known_layouts[layout])
+    template = _templates[layout]
+    template.reset()
+
+    return template
+
+def _finish(template, filename, **kwargs):
+    """
+    Write the template to a file, or show it on screen if no filename is given.
+
+    """
+
+    if filename is not None:
+        template.save(filename, **kwargs)
+    else:
+        import pylab
+        pylab.show()
+
+    return
+
+#=============================================================================================
+# Panels
+#=============================================================================================
+
+def plot_injection_markers(axes, injection_times, color='r'):
+    """
+    Mark injection times with vertical lines spanning the full height of the axes.
+
+    The lines do not take part in autoscaling, so they can be drawn before or after the data.
+
+    ARGUMENTS
+      axes (matplotlib.axes.Axes) - axes to draw into
+      injection_times (numpy array) - time of each injection (s)
+
+    """
+
+    segments = numpy.zeros([len(injection_times), 2, 2], numpy.float64)
+    segments[:, :, 0] = numpy.asarray(injection_times, numpy.float64)[:, numpy.newaxis]
+    segments[:, 1, 1] = 1.0
+    markers = LineCollection(segments, colors=color, transform=axes.get_xaxis_transform())
+    axes.add_collection(markers, autolim=False)
+
+    return markers
+
+def plot_power(axes, time, power, baseline_power, injection_times, markersize=5):
+    """
+    Plot differential power and the baseline fit versus time, with injection markers.
+
+    ARGUMENTS
+      axes (matplotlib.axes.Axes) - axes to draw into
+      time (numpy array) - time of each measurement (s)
+      power (numpy array) - differential power of each measurement (ucal/s)
+      baseline_power (numpy array) - baseline power at each measurement (ucal/s)
+      injection_times (numpy array) - time of each injection (s)
+
+    OPTIONAL ARGUMENTS
+      markersize (float) - size of measurement markers (default: 5)
+
+    """
+
+    axes.plot(time, baseline_power, 'g-')
+    axes.plot(time, power, 'k.', markersize=markersize)
+    plot_injection_markers(axes, injection_times)
+
+    return
+
+def plot_heats(axes, injection_end_times, evolved_heats, numbers, bars=False, markersize=5, band=None):
+    """
+    Plot the heat evolved by each injection, labelled with the injection number.
+
+    ARGUMENTS
+      axes (matplotlib.axes.Axes) - axes to draw into
+      injection_end_times (numpy array) - time at the end of each injection (s)
+      evolved_heats (numpy array) - heat evolved by each injection (ucal)
+      numbers (sequence of int) - injection numbers used as labels
+
+    OPTIONAL ARGUMENTS
+      bars (bool) - if True, draw bars from zero instead of points (default: False)
+      markersize (float) - size of heat markers (default: 5)
+      band (tuple of numpy arrays) - (median, lower, upper) expected heats of a model fit to overlay as a line and shaded band (ucal);
+        these may cover only the first injections (default: None)
+
+    """
+
+    if band is not None:
+        (median, lower, upper) = band
+        t = injection_end_times[:len(median)]
+        axes.fill_between(t, lower, upper, color='r', alpha=0.3, linewidth=0)
+        axes.plot(t, median, 'r-', linewidth=1)
+
+    if bars:
+        axes.vlines(injection_end_times, 0.0, evolved_heats, colors='k')
+    else:
+        axes.scatter(injection_end_times, evolved_heats, s=markersize**2, c='k', marker='.', edgecolors='none')
+
+    for (t, y, number) in zip(injection_end_times, evolved_heats, numbers):
+        axes.text(t, y, '%d' % number, fontsize=6)
+
+    axes.axhline(0.0, color='g') # zero line
+    axes.autoscale_view()
+
+    return
+
+def plot_temperature(axes, time, temperature, color, markersize=1):
+    """
+    Plot a temperature trace versus time.
+
+    ARGUMENTS
+      axes (matplotlib.axes.Axes) - axes to draw into
+      time (numpy array) - time of each measurement (s)
+      temperature (numpy array) - temperature of each measurement (C)
+      color (String) - matplotlib color of the markers
+
+    """
+
+    axes.plot(time, temperature, '.', color=color, markersize=markersize)
+
+    return
+
+#=============================================================================================
+# Pages
+#=============================================================================================
+
+def _injection_times(experiment):
+    """
+    Return the time at the start of each syringe injection, in s.
+
+    """
+
+    return experiment.filter_period_end_time[experiment.injections['first_index']] / Units.s
+
+def render_analysis(experiment, title, filename=None, max_points=None):
+    """
+    Render differential power, enthalpogram, cell temperature, and jacket temperature on one page.
+
+    ARGUMENTS
+      experiment (Experiment) - experiment with fitted baseline and integrated heats
+      title (String) - title of the page
+
+    OPTIONAL ARGUMENTS
+      filename (String) - if specified, a landscape letter-size PDF is written here instead of shown on screen
+      max_points (int) - maximum number of points per trace; 0 to plot all (default: MAX_POINTS_PER_PANEL if writing a file)
+
+    """
+
+    template = get_template('analysis', interactive=(filename is None))
+    (power_axes, heat_axes, cell_axes, jacket_axes) = template.axes
+    max_points = _resolve_max_points(max_points, filename)
+
+    time = experiment.filter_period_end_time / Units.s
+
+    indices = decimate_indices(experiment.differential_power, max_points, keep=spike_indices(experiment))
+    plot_power(power_axes, time[indices], experiment.differential_power[indices] / (Units.ucal/Units.s), experiment.baseline_power[indices] / (Units.ucal/Units.s), _injection_times(experiment), markersize=1)
+    template.label(power_axes, 'time / s', 'differential power / ucal/s', title)
+
+    plot_heats(heat_axes, experiment.injection_end_times / Units.s, experiment.evolved_heats / Units.ucal, experiment.injections['number'], bars=True)
+    template.label(heat_axes, 'time / s', 'evolved heat / ucal')
+
+    indices = decimate_indices(experiment.cell_temperature, max_points)
+    plot_temperature(cell_axes, time[indices], experiment.cell_temperature[indices] / Units.K - Constants.absolute_zero, 'r')
+    template.label(cell_axes, 'time / s', 'cell temperature / C')
+
+    indices = decimate_indices(experiment.jacket_temperature, max_points)
+    plot_temperature(jacket_axes, time[indices], experiment.jacket_temperature[indices] / Units.K - Constants.absolute_zero, 'b')
+    template.label(jacket_axes, 'time / s', 'jacket temperature / C')
+
+    # Match time axes to the first panel.
+    xlim = power_axes.get_xlim()
+    for axes in template.axes[1:]:
+        axes.set_xlim(xlim)
+
+    _finish(template, filename, orientation='landscape', papertype='letter', format='pdf')
+
+    return
+
+def render_enthalpogram(experiment, filename=None, predictive=None, title=None, max_points=None):
+    """
+    Render differential power and the integrated heats, with optional model fits to the heats.
+
+    ARGUMENTS
+      experiment (Experiment) - experiment with fitted baseline and integrated heats
+
+    OPTIONAL ARGUMENTS
+      filename (String) - if specified, the plot is written here (at 150 dpi) instead of shown on screen
+      predictive (dict) - 'median', 'lower', and 'upper' expected injection heats of a model fit to overlay, as from computePosteriorPredictive()
+      title (String) - title of the plot (default: the data filename)
+      max_points (int) - maximum number of points of the power trace; 0 to plot all (default: MAX_POINTS_PER_PANEL if writing a file)
+
+    """
+
+    template = get_template('enthalpogram', interactive=(filename is None))
+    (power_axes, heat_axes) = template.axes
+    max_points = _resolve_max_points(max_points, filename)
+
+    if title is None:
+        title = experiment.data_filename
+
+    indices = decimate_indices(experiment.differential_power, max_points, keep=spike_indices(experiment))
+    plot_power(power_axes, experiment.filter_period_end_time[indices] / Units.s, experiment.differential_power[indices] / (Units.ucal/Units.s), experiment.baseline_power[indices] / (Units.ucal/Units.s), _injection_times(experiment))
+    template.label(power_axes, 'time / s', 'differential power / ucal/s', title)
+
+    band = None
+    if predictive is not None:
+        band = tuple(predictive[key] / Units.ucal for key in ['median', 'lower', 'upper'])
+
+    plot_heats(heat_axes, experiment.injection_end_times / Units.s, experiment.evolved_heats / Units.ucal, experiment.injections['number'], band=band)
+    template.label(heat_axes, 'time / s', 'evolved heat / ucal')
+    heat_axes.set_xlim(power_axes.get_xlim())
+
+    _finish(template, filename, dpi=150)
+
+    return
+
+def render_baseline(experiment, filename=None, title=None, max_points=None):
+    """
+    Render a close-up of the baseline fit, with the measurements used in the fit in red.
+
+    ARGUMENTS
+      experiment (Experiment) - experiment with fitted baseline
+
+    OPTIONAL ARGUMENTS
+      filename (String) - if specified, the plot is written here (at 150 dpi) instead of shown on screen
+      title (String) - title of the plot (default: the data filename)
+      max_points (int) - maximum number of points of the power trace; 0 to plot all (default: MAX_POINTS_PER_PANEL if writing a file)
+
+    """
+
+    template = get_template('baseline', interactive=(filename is None))
+    (axes,) = template.axes
+    max_points = _resolve_max_points(max_points, filename)
+
+    if title is None:
+        title = experiment.data_filename
+
+    time = experiment.filter_period_end_time / Units.s
+    power = experiment.differential_power / (Units.ucal/Units.s)
+    baseline_power = experiment.baseline_power / (Units.ucal/Units.s)
+
+    fit_indices = numpy.asarray(experiment.baseline_fit_data['indices'], numpy.int64)
+    fit = numpy.zeros(power.shape, bool)
+    fit[fit_indices] = True
+
+    # Decimate the power trace, keeping every measurement used in the baseline fit.
+    indices = decimate_indices(power, max_points, keep=numpy.concatenate([fit_indices, spike_indices(experiment)]))
+    shown = numpy.zeros(power.shape, bool)
+    shown[indices] = True
+
+    axes.plot(time[indices], baseline_power[indices], 'g-')
+    axes.plot(time[shown & ~fit], power[shown & ~fit], 'k.', markersize=5)
+    axes.plot(time[fit], power[fit], 'r.', markeredgecolor='r', markersize=5)
+    plot_injection_markers(axes, _injection_times(experiment))
+
+    # Zoom in on baseline.
+    ymin = baseline_power.min()
+    ymax = baseline_power.max()
+    width = ymax - ymin
+    axes.set_ylim(ymin - width/2, ymax + width/2)
+
+    template.label(axes, 'time / s', 'differential power / ucal/s', title)
+
+    _finish(template, filename, dpi=150)
+
+    return
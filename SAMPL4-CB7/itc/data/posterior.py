@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# posterior.py
+#
+# Compiled log-posteriors of binding models as functions of a flat parameter vector.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Compiled log-posteriors of binding models as functions of a flat parameter vector.
+
+A PyMC model evaluates its log-posterior by walking the model graph: every Metropolis step
+recomputes the deterministic nodes in Python and evaluates each likelihood through the PyMC
+distribution machinery.  The functions here evaluate the same log-posterior as one loop over the
+injections, with all priors, dilution factors, and observed heats fixed when the function is
+built, so an optimizer or a sampler that proposes one parameter vector at a time pays only for
+the arithmetic.
+
+If numba is installed, the loop is JIT-compiled to machine code; otherwise it is run on Python
+floats, which still avoids the per-call overhead of numpy on short arrays.
+
+EXAMPLES
+
+  import posterior
+  log_posterior = posterior.compile_two_component(lower, upper, uniform_index, mu, tau, lognormal_index,
+                                                  injection_heats, sqrt_duration_n, V0, d_n, dcum_n, beta)
+  logp = log_posterior(x)
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import math
+
+import numpy
+
+import Units
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#=============================================================================================
+# Two-component binding model
+#=============================================================================================
+
+# Order of the parameters in the flat vector, as in the log-posterior built by buildLogPosterior() in ITC-sampl4.py.
+TWO_COMPONENT_PARAMETERS = ['DeltaG', 'DeltaH', 'DeltaH_0', 'P0', 'Ls', 'log_sigma', 'P_purity', 'L_purity']
+
+def _two_component_log_posterior(x, lower, upper, uniform_index, mu, tau, lognormal_index, log_uniform_density,
+                                 injection_heats, sqrt_duration_n, V0, d_n, dcum_n, beta, C0, heat_precision_unit):
+    """
+    Log-posterior of the two-component binding model at one parameter vector, as one loop over the injections.
+
+    Written with scalar arithmetic only, so that the same code runs on Python floats or compiled by numba.
+
+    """
+
+    # Uniform priors.
+    for k in range(len(uniform_index)):
+        value = x[uniform_index[k]]
+        if (value < lower[k]) or (value > upper[k]):
+            return -numpy.inf
+    logp = log_uniform_density
+
+    # Lognormal priors on concentrations.
+    for k in range(len(lognormal_index)):
+        value = x[lognormal_index[k]]
+        if value <= 0.0:
+            return -numpy.inf
+        log_value = math.log(value)
+        logp += 0.5 * math.log(0.5 * tau[k] / math.pi) - log_value - 0.5 * tau[k] * (log_value - mu[k])**2
+
+    DeltaG = x[0]
+    DeltaH = x[1]
+    DeltaH_0 = x[2]
+    P0 = x[3] * x[6]
+    Ls = x[4] * x[7]
+    precision = math.exp(-2.0 * x[5]) / heat_precision_unit
+
+    # Normal likelihood of integrated injection heats.
+    Kd = math.exp(beta * DeltaG) * C0
+    PL_before = 0.0
+    for n in range(len(injection_heats)):
+        P = P0 * dcum_n[n]
+        L = Ls * (1.0 - dcum_n[n])
+        b = P + L + Kd
+        c = P * L
+        PL = 2.0 * c / (b + math.sqrt(b * b - 4.0 * c))
+        q = (-DeltaH) * V0 * (PL - PL_before) + (-DeltaH_0)
+        tau_n = precision * sqrt_duration_n[n]
+        logp += 0.5 * math.log(0.5 * tau_n / math.pi) - 0.5 * tau_n * (injection_heats[n] - q)**2
+        if n + 1 < len(injection_heats):
+            PL_before = d_n[n + 1] * PL
+
+    return logp
+
+_compiled = dict()
+
+def compile_two_component(lower, upper, uniform_index, mu, tau, lognormal_index, injection_heats, sqrt_duration_n,
+                          V0, d_n, dcum_n, beta, C0=1.0*Units.M, use_numba=None):
+    """
+    Build the log-posterior of the two-component binding model as a function of one flat parameter vector.
+
+    ARGUMENTS
+      lower, upper (numpy arrays) - bounds of the uniform priors
+      uniform_index (numpy array of int) - positions in the parameter vector of the uniformly distributed parameters
+      mu, tau (numpy arrays) - log-mean and log-precision of the lognormal priors
+      lognormal_index (numpy array of int) - positions in the parameter vector of the lognormally distributed parameters
+      injection_heats (numpy array of N floats) - observed integrated injection heats (cal)
+      sqrt_duration_n (numpy array of N floats) - square roots of the injection durations, which scale the heat precision
+      V0 (float) - volume of the sample cell (L)
+      d_n, dcum_n (numpy arrays of N floats) - dilution factors from binding.compute_dilution_factors()
+      beta (float) - inverse temperature 1/(kcal/mol)
+
+    OPTIONAL ARGUMENTS
+      C0 (float) - standard concentration (default: 1 M)
+      use_numba (bool) - if True, JIT-compile with numba, raising ImportError if it is not installed; if False, run
+        on Python floats (default: use numba if it is installed)
+
+    RETURNS
+      log_posterior (function) - log_posterior(x) returns the log-posterior (float) of the parameter vector x, ordered as
+        TWO_COMPONENT_PARAMETERS, and -inf outside the support of the prior
+
+    NOTES
+      The first call of a numba-compiled function includes its compilation; later calls, also of functions built for
+      other experiments, reuse the compiled code.
+
+    """
+
+    if use_numba is None:
+        use_numba = numba is not None
+    if use_numba and (numba is None):
+        raise ImportError("numba is not installed")
+
+    lower = numpy.asarray(lower, numpy.float64)
+    upper = numpy.asarray(upper, numpy.float64)
+    arguments = (lower, upper, numpy.asarray(uniform_index, numpy.int64), numpy.asarray(mu, numpy.float64), numpy.asarray(tau, numpy.float64),
+                 numpy.asarray(lognormal_index, numpy.int64), float(-numpy.log(upper - lower).sum()),
+                 numpy.asarray(injection_heats, numpy.float64), numpy.asarray(sqrt_duration_n, numpy.float64),
+                 float(V0), numpy.asarray(d_n, numpy.float64), numpy.asarray(dcum_n, numpy.float64), float(beta), float(C0),
+                 float(Units.cal**2 / Units.second))
+
+    if use_numba:
+        if 'two_component' not in _compiled:
+            _compiled['two_component'] = numba.njit(cache=True)(_two_component_log_posterior)
+        kernel = _compiled['two_component']
+        def log_posterior(x):
+            return kernel(numpy.asarray(x, numpy.float64), *arguments)
+    else:
+        # Python floats and lists are faster than numpy scalars for scalar arithmetic.
+        arguments = tuple(argument.tolist() if isinstance(argument, numpy.ndarray) else argument for argument in arguments)
+        def log_posterior(x):
+            return _two_component_log_posterior(numpy.asarray(x, numpy.float64).tolist(), *arguments)
+
+    return log_posterior
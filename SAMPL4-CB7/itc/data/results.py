@@ -0,0 +1,479 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# results.py
+#
+# Indexed store of ITC analysis results.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Indexed store of ITC analysis results.
+
+Every analysis of a data file is one row of the 'analyses' table of an SQLite database, keyed by
+the data file and the analysis configuration; analysing the same file with the same configuration
+again replaces the earlier results.  Each analysis also records the sample name of the run, such as
+'host into guest07', taken from the Auto iTC-200 spreadsheet next to the data file, and the syringe
+and cell solution names it is made of.  The results of an analysis are kept in child tables:
+
+  metadata    - scalar experiment settings and baseline parameters, with units
+  injections  - injection protocol and integrated heat of each injection
+  posteriors  - posterior mean, standard deviation, and 95% confidence interval of each parameter
+  diagnostics - sampler diagnostics, such as autocorrelation times and effective sample sizes
+
+The posterior summaries are indexed by parameter, so collecting one parameter across all runs is
+a single query.  Several processes may write to the same store; SQLite serializes the writes.
+
+EXAMPLES
+
+  import results
+  store = results.ResultsStore('analysis/results.db')
+  analysis_id = store.begin_analysis('01232015/20150123a6.itc', '20150123a6', { 'sampler' : 'ensemble' })
+  store.record_experiment(analysis_id, experiment)
+  for row in store.query_posteriors('DeltaG', cell='guest07'):
+      print row['sample_name'], row['mean'], row['std']
+
+Names are matched exactly, ignoring case, or by prefix with a pattern ending in '%', such as
+sample_name='host into guest%'; both are answered from an index.
+
+From the command line, for all runs with guest07 in the cell:
+
+  python results.py analysis/results.db DeltaG guest07
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import os
+import re
+import sys
+import glob
+import time
+import json
+import hashlib
+import sqlite3
+
+import numpy
+
+import Units
+import Constants
+
+#=============================================================================================
+# Schema
+#=============================================================================================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    data_filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    configuration TEXT NOT NULL,
+    configuration_key TEXT NOT NULL,
+    created REAL NOT NULL,
+    sample_name TEXT COLLATE NOCASE,
+    syringe_solution TEXT COLLATE NOCASE,
+    cell_solution TEXT COLLATE NOCASE,
+    UNIQUE (data_filename, configuration_key)
+);
+CREATE INDEX IF NOT EXISTS analyses_name ON analyses (name);
+CREATE INDEX IF NOT EXISTS analyses_configuration_key ON analyses (configuration_key);
+
+CREATE TABLE IF NOT EXISTS metadata (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value REAL,
+    unit TEXT,
+    PRIMARY KEY (analysis_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS injections (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    number INTEGER NOT NULL,
+    volume REAL,
+    duration REAL,
+    spacing REAL,
+    filter_period REAL,
+    first_index INTEGER,
+    last_index INTEGER,
+    evolved_heat REAL,
+    heat_noise REAL,
+    PRIMARY KEY (analysis_id, number)
+);
+
+CREATE TABLE IF NOT EXISTS posteriors (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    parameter TEXT NOT NULL,
+    unit TEXT,
+    mean REAL,
+    std REAL,
+    low REAL,
+    high REAL,
+    nsamples INTEGER,
+    PRIMARY KEY (analysis_id, parameter)
+);
+CREATE INDEX IF NOT EXISTS posteriors_parameter ON posteriors (parameter);
+
+CREATE TABLE IF NOT EXISTS diagnostics (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    parameter TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (analysis_id, parameter, key)
+);
+"""
+
+# Columns added to the analyses table since it was first created, and their indices.
+analyses_columns = [
+    ('sample_name', 'TEXT COLLATE NOCASE'),
+    ('syringe_solution', 'TEXT COLLATE NOCASE'),
+    ('cell_solution', 'TEXT COLLATE NOCASE'),
+    ]
+
+INDICES = """
+CREATE INDEX IF NOT EXISTS analyses_sample_name ON analyses (sample_name);
+CREATE INDEX IF NOT EXISTS analyses_syringe_solution ON analyses (syringe_solution);
+CREATE INDEX IF NOT EXISTS analyses_cell_solution ON analyses (cell_solution);
+"""
+
+# Injection columns stored, with the unit they are stored in.
+injection_units = [
+    ('volume', Units.ul, 'uL'),
+    ('duration', Units.s, 's'),
+    ('spacing', Units.s, 's'),
+    ('filter_period', Units.s, 's'),
+    ]
+
+def configuration_key(configuration):
+    """
+    Return a key identifying an analysis configuration: the SHA-1 hash of its canonical JSON encoding.
+
+    ARGUMENTS
+      configuration (dict) - analysis settings; values must be JSON-serializable
+
+    RETURNS
+      key (String) - hexadecimal hash
+
+    """
+
+    return hashlib.sha1(json.dumps(configuration, sort_keys=True).encode('utf-8')).hexdigest()
+
+#=============================================================================================
+# Sample names
+#=============================================================================================
+
+_sample_names = dict()
+
+def read_sample_names(directory):
+    """
+    Read the sample names of the runs in a directory from its Auto iTC-200 spreadsheets.
+
+    ARGUMENTS
+      directory (String) - directory with the data files and the .xlsx spreadsheets they were run from
+
+    RETURNS
+      sample_names (dict) - sample_names[datafile] is the SampleName of the run, by data file name without extension
+
+    NOTES
+      Spreadsheets are read with openpyxl; if it is not installed, no sample names are found.
+
+    """
+
+    directory = os.path.abspath(directory)
+    if directory in _sample_names:
+        return _sample_names[directory]
+
+    sample_names = dict()
+    try:
+        import openpyxl
+    except ImportError:
+        openpyxl = None
+    if openpyxl is not None:
+        for filename in sorted(glob.glob(os.path.join(directory, '*.xlsx'))):
+            rows = [[cell.value for cell in row] for row in openpyxl.load_workbook(filename, read_only=True).active.rows]
+            if not rows or 'DataFile' not in rows[0] or 'SampleName' not in rows[0]:
+                continue
+            (datafile_column, sample_name_column) = (rows[0].index('DataFile'), rows[0].index('SampleName'))
+            for row in rows[1:]:
+                if row[datafile_column] and row[sample_name_column]:
+                    sample_names[str(row[datafile_column])] = row[sample_name_column]
+
+    _sample_names[directory] = sample_names
+    return sample_names
+
+def lookup_sample_name(data_filename):
+    """
+    Return the sample name of a run, such as 'host into guest07'.
+
+    ARGUMENTS
+      data_filename (String) - data file of the run
+
+    RETURNS
+      sample_name (String) - SampleName of the run in the Auto iTC-200 spreadsheets next to the data file, or None if not found
+
+    """
+
+    (directory, filename) = os.path.split(data_filename)
+    return read_sample_names(directory or os.curdir).get(os.path.splitext(filename)[0])
+
+def solution_names(sample_name):
+    """
+    Return the syringe and cell solution names of a sample name such as 'host into guest07'.
+
+    ARGUMENTS
+      sample_name (String) - sample name of the form 'syringe into cell', optionally followed by a replicate number
+
+    RETURNS
+      syringe_solution (String) - name of the syringe solution, or None if the sample name is not of this form
+      cell_solution (String) - name of the cell solution, or None if the sample name is not of this form
+
+    """
+
+    match = re.match(r'^(?:initial |final )?(.+?) into (.+?)(?: test)?(?: \d+)?$', sample_name or '')
+    if match is None:
+        return (None, None)
+    return match.groups()
+
+def _match(column, pattern, nocase=False):
+    """
+    Return an SQL condition matching a column to a name or name prefix, and its arguments.
+
+    A pattern ending in '%' is compared with a range of its prefix, so that the index of the column is used;
+    any other pattern is an exact name, compared with '='.  '_' and other '%' characters are literal.
+
+    """
+
+    if not pattern.endswith('%'):
+        return ('%s = ?' % column, [pattern])
+    prefix = pattern[:-1]
+    if not prefix:
+        return ('%s IS NOT NULL' % column, [])
+    # Range of strings starting with the prefix; NOCASE columns compare ASCII letters in lower case.
+    if nocase:
+        prefix = prefix.lower()
+    return ('%s >= ? AND %s < ?' % (column, column), [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)])
+
+#=============================================================================================
+# Results store
+#=============================================================================================
+
+class ResultsStore(object):
+    """
+    SQLite store of analyses, keyed by data file and analysis configuration.
+
+    """
+
+    def __init__(self, filename, timeout=60.0):
+        """
+        Open a results store, creating it if it does not exist.
+
+        ARGUMENTS
+          filename (String) - name of the SQLite database file
+
+        OPTIONAL ARGUMENTS
+          timeout (float) - seconds to wait for another process to finish writing (default: 60)
+
+        """
+
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout=timeout)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(analyses)')]
+            for (column, declaration) in analyses_columns:
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE analyses ADD COLUMN %s %s' % (column, declaration))
+            self.connection.executescript(INDICES)
+
+        return
+
+    def close(self):
+        """
+        Close the store.
+
+        """
+
+        self.connection.close()
+
+        return
+
+    def begin_analysis(self, data_filename, name, configuration, sample_name=None):
+        """
+        Start recording an analysis, replacing any earlier analysis of the same file with the same configuration.
+
+        ARGUMENTS
+          data_filename (String) - data file analysed
+          name (String) - name of the experiment, such as the data file name without extension
+          configuration (dict) - analysis settings; values must be JSON-serializable
+
+        OPTIONAL ARGUMENTS
+          sample_name (String) - sample name of the run, such as 'host into guest07' (default: from the Auto iTC-200 spreadsheets next to the data file)
+
+        RETURNS
+          analysis_id (int) - identifier of the analysis, used to record its results
+
+        """
+
+        if sample_name is None:
+            sample_name = lookup_sample_name(data_filename)
+        (syringe_solution, cell_solution) = solution_names(sample_name)
+
+        key = configuration_key(configuration)
+        with self.connection:
+            self.connection.execute('DELETE FROM analyses WHERE data_filename = ? AND configuration_key = ?', (data_filename, key))
+            cursor = self.connection.execute('INSERT INTO analyses (data_filename, name, configuration, configuration_key, created, sample_name, syringe_solution, cell_solution) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                             (data_filename, name, json.dumps(configuration, sort_keys=True), key, time.time(), sample_name, syringe_solution, cell_solution))
+
+        return cursor.lastrowid
+
+    def record_metadata(self, analysis_id, metadata):
+        """
+        Record scalar values of an analysis.
+
+        ARGUMENTS
+          analysis_id (int) - identifier returned by begin_analysis()
+          metadata (dict) - metadata[key] is a value or a (value, unit) tuple
+
+        """
+
+        rows = list()
+        for (key, value) in metadata.items():
+            unit = None
+            if isinstance(value, tuple):
+                (value, unit) = value
+            rows.append((analysis_id, key, float(value), unit))
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO metadata (analysis_id, key, value, unit) VALUES (?, ?, ?, ?)', rows)
+
+        return
+
+    def record_experiment(self, analysis_id, experiment):
+        """
+        Record the settings, baseline fit, and integrated heats of an experiment.
+
+        ARGUMENTS
+          analysis_id (int) - identifier returned by begin_analysis()
+          experiment (Experiment) - experiment with fitted baseline and integrated heats
+
+        """
+
+        metadata = {
+            'number_of_injections' : (experiment.number_of_injections, None),
+            'target_temperature' : (experiment.target_temperature / Units.K - Constants.absolute_zero, 'C'),
+            'equilibration_time' : (experiment.equilibration_time / Units.s, 's'),
+            'syringe_concentration' : (experiment.syringe_concentration / Units.mM, 'mM'),
+            'cell_concentration' : (experiment.cell_concentration / Units.mM, 'mM'),
+            'cell_volume' : (experiment.cell_volume / Units.ml, 'mL'),
+            'reference_power' : (experiment.reference_power / (Units.ucal/Units.s), 'ucal/s'),
+            }
+        if getattr(experiment, 'baseline_fit_parameters', None) is not None:
+            for (key, value) in zip(['x0', 'y0', 'c', 'k'], experiment.baseline_fit_parameters):
+                metadata['baseline_' + key] = (value, None)
+        self.record_metadata(analysis_id, metadata)
+
+        injections = experiment.injections
+        columns = [injections['number']]
+        columns += [injections[column] / unit for (column, unit, unit_name) in injection_units]
+        columns += [injections['first_index'], injections['last_index']]
+        columns += [experiment.evolved_heats / Units.ucal, experiment.heat_noise / Units.ucal]
+        rows = [tuple(value.item() for value in row) for row in zip(*[numpy.asarray(column) for column in columns])]
+
+        with self.connection:
+            self.connection.execute('DELETE FROM injections WHERE analysis_id = ?', (analysis_id,))
+            self.connection.executemany('INSERT INTO injections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(analysis_id,) + row for row in rows])
+
+        return
+
+    def record_posteriors(self, analysis_id, posteriors):
+        """
+        Record posterior summaries of an analysis.
+
+        ARGUMENTS
+          analysis_id (int) - identifier returned by begin_analysis()
+          posteriors (list of dict) - one dict per parameter, with keys 'parameter', 'unit', 'mean', 'std', 'low', 'high', and 'nsamples'
+
+        """
+
+        rows = [(analysis_id, row['parameter'], row['unit'], float(row['mean']), float(row['std']), float(row['low']), float(row['high']), int(row['nsamples'])) for row in posteriors]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO posteriors VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+        return
+
+    def record_diagnostics(self, analysis_id, key, values):
+        """
+        Record one sampler diagnostic of an analysis.
+
+        ARGUMENTS
+          analysis_id (int) - identifier returned by begin_analysis()
+          key (String) - name of the diagnostic, such as 'autocorrelation_time'
+          values (dict or float) - values[parameter] for each parameter, or a single value for the whole sampler
+
+        """
+
+        if not isinstance(values, dict):
+            values = { '' : values }
+        rows = [(analysis_id, parameter, key, float(value)) for (parameter, value) in values.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO diagnostics VALUES (?, ?, ?, ?)', rows)
+
+        return
+
+    def query_posteriors(self, parameter, name=None, sample_name=None, syringe=None, cell=None, data_filename=None, configuration=None):
+        """
+        Return the posterior summaries of one parameter across analyses.
+
+        ARGUMENTS
+          parameter (String) - parameter name, such as 'DeltaG'
+
+        OPTIONAL ARGUMENTS
+          name (String) - experiment name, such as '20150123a6' (default: all)
+          sample_name (String) - sample name, such as 'host into guest07', ignoring case (default: all)
+          syringe (String) - syringe solution name, such as 'host', ignoring case (default: all)
+          cell (String) - cell solution name, such as 'guest07', ignoring case (default: all)
+          data_filename (String) - data file (default: all)
+          configuration (dict) - analysis configuration the results must come from (default: all)
+
+        Names may end in '%' to match a prefix, such as sample_name='host into guest%'.
+
+        RETURNS
+          rows (list of dict) - one dict per analysis, with the posterior summary and the analysis 'id', 'name', 'sample_name', 'syringe_solution',
+            'cell_solution', 'data_filename', 'configuration', and 'created'
+
+        """
+
+        query = 'SELECT analyses.id AS id, analyses.name AS name, analyses.sample_name AS sample_name, analyses.syringe_solution AS syringe_solution, ' \
+            'analyses.cell_solution AS cell_solution, analyses.data_filename AS data_filename, analyses.configuration AS configuration, analyses.created AS created, posteriors.* ' \
+            'FROM posteriors JOIN analyses ON posteriors.analysis_id = analyses.id WHERE posteriors.parameter = ?'
+        arguments = [parameter]
+        for (column, pattern) in [('name', name), ('sample_name', sample_name), ('syringe_solution', syringe), ('cell_solution', cell), ('data_filename', data_filename)]:
+            if pattern is not None:
+                (condition, values) = _match('analyses.' + column, pattern, nocase=column in dict(analyses_columns))
+                query += ' AND ' + condition
+                arguments += values
+        if configuration is not None:
+            query += ' AND analyses.configuration_key = ?'
+            arguments.append(configuration_key(configuration))
+        query += ' ORDER BY analyses.name, analyses.created'
+
+        return [dict(zip(row.keys(), row)) for row in self.connection.execute(query, arguments)]
+
+#=============================================================================================
+# MAIN
+#=============================================================================================
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python results.py results.db parameter [cell-solution]")
+        sys.exit(1)
+
+    store = ResultsStore(sys.argv[1])
+    cell = sys.argv[3] if len(sys.argv) > 3 else None
+    for row in store.query_posteriors(sys.argv[2], cell=cell):
+        print("%-24s %-24s %10.4f +- %10.4f %-14s [%10.4f, %10.4f] %s" % (row['name'], row['sample_name'], row['mean'], row['std'], row['unit'], row['low'], row['high'], row['data_filename']))
+    store.close()
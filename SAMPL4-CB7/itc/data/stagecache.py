@@ -0,0 +1,313 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# stagecache.py
+#
+# Content-addressed cache of analysis pipeline stages.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Content-addressed cache of analysis pipeline stages.
+
+Each stage of the analysis pipeline (parsing, baseline fitting, integration, sampling, plotting)
+is cached under a key computed from everything its result depends on: the hash of the raw data
+file, the settings that affect the stage, the key of the stage it consumes, and the hash of the
+source files of the analysis code.  A stage whose inputs have not changed is not rerun; changing a
+setting only invalidates the stages downstream of it, and changing the analysis code invalidates
+every stage.
+
+A cache entry holds the value returned by the stage and the contents of the files it wrote, which
+are restored on a hit.  Entries are single pickle files written atomically, so several processes
+can share a cache directory.  When the cache grows beyond its size bound, the least recently used
+entries are evicted.
+
+EXAMPLES
+
+  import stagecache
+  code = stagecache.source_digest([__file__, itcfile, baseline, integration])
+  cache = stagecache.StageCache('cache', max_bytes=512*1024**2, code=code)
+  raw = { 'data' : stagecache.file_digest('20150304a1.itc') }
+  (parse_key, experiment) = cache.run('parse', raw, lambda : Experiment('20150304a1.itc'))
+  (plot_key, _) = cache.run('plot', { 'parse' : parse_key }, lambda : experiment.plot('a1.png'), outputs=['a1.png'])
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+import tempfile
+
+#=============================================================================================
+# Keys
+#=============================================================================================
+
+DEFAULT_MAX_BYTES = 1024**3 # default size bound of a cache (bytes)
+
+def file_digest(filename, blocksize=1024**2):
+    """
+    Return the SHA-1 hash of the contents of a file.
+
+    ARGUMENTS
+      filename (String) - file to hash
+
+    OPTIONAL ARGUMENTS
+      blocksize (int) - number of bytes read at a time (default: 1 MB)
+
+    RETURNS
+      digest (String) - hexadecimal hash
+
+    """
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        block = infile.read(blocksize)
+        while block:
+            sha1.update(block)
+            block = infile.read(blocksize)
+
+    return sha1.hexdigest()
+
+def source_digest(sources):
+    """
+    Return the SHA-1 hash of the source files of the analysis code.
+
+    ARGUMENTS
+      sources (list of module or String) - modules, or names of source files
+
+    RETURNS
+      digest (String) - hexadecimal hash
+
+    """
+
+    sha1 = hashlib.sha1()
+    for source in sources:
+        filename = getattr(source, '__file__', source)
+        if filename.endswith('.pyc') or filename.endswith('.pyo'):
+            filename = filename[:-1]
+        sha1.update(file_digest(filename).encode('utf-8'))
+
+    return sha1.hexdigest()
+
+def stage_key(stage, inputs, code=None):
+    """
+    Return the cache key of a stage: the SHA-1 hash of the stage name and the canonical JSON encoding of its inputs.
+
+    ARGUMENTS
+      stage (String) - name of the stage
+      inputs (dict) - everything the stage result depends on; values must be JSON-serializable
+        (file digests, settings, and keys of upstream stages)
+
+    OPTIONAL ARGUMENTS
+      code (String) - digest of the analysis code, from source_digest() (default: None)
+
+    RETURNS
+      key (String) - hexadecimal hash
+
+    """
+
+    return hashlib.sha1(json.dumps([stage, inputs, code], sort_keys=True).encode('utf-8')).hexdigest()
+
+#=============================================================================================
+# Output files
+#=============================================================================================
+
+def _snapshot(directory, prefix):
+    """
+    Return the modification time and size of the files in a directory whose names start with prefix followed by '-', '.', or '_'.
+
+    """
+
+    snapshot = dict()
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename[len(prefix):len(prefix)+1] in ['-', '.', '_']:
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                status = os.stat(path)
+                snapshot[path] = (status.st_mtime, status.st_size)
+
+    return snapshot
+
+#=============================================================================================
+# Stage cache
+#=============================================================================================
+
+class StageCache(object):
+    """
+    Directory of cached stage results, bounded in size by least-recently-used eviction.
+
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, code=None):
+        """
+        ARGUMENTS
+          directory (String) - cache directory, created if it does not exist
+
+        OPTIONAL ARGUMENTS
+          max_bytes (int) - size bound of the cache (default: DEFAULT_MAX_BYTES)
+          code (String) - digest of the analysis code from source_digest(), part of the key of every stage (default: None)
+
+        """
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.code = code
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have created it.
+                if not os.path.isdir(directory):
+                    raise
+
+        return
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def load(self, key):
+        """
+        Return a cache entry, or None if it is not in the cache.
+
+        ARGUMENTS
+          key (String) - key of the entry, from stage_key()
+
+        RETURNS
+          entry (dict) - 'value' returned by the stage, and 'files' mapping each output filename to its contents
+
+        """
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                entry = pickle.load(infile)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return entry
+
+    def store(self, key, value, outputs=()):
+        """
+        Store a stage result and the contents of its output files, then evict entries beyond the size bound.
+
+        ARGUMENTS
+          key (String) - key of the entry, from stage_key()
+          value (picklable object) - value returned by the stage
+
+        OPTIONAL ARGUMENTS
+          outputs (sequence of String) - files written by the stage
+
+        """
+
+        files = dict()
+        for filename in outputs:
+            with open(filename, 'rb') as infile:
+                files[filename] = infile.read()
+
+        # Write to a temporary file and rename, so readers never see a partial entry.
+        (handle, temporary_path) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as outfile:
+            pickle.dump({ 'value' : value, 'files' : files }, outfile, protocol=2)
+        os.rename(temporary_path, self._path(key))
+
+        self.evict()
+
+        return
+
+    def run(self, stage, inputs, compute, outputs=None, output_prefix=None, output_directory='.'):
+        """
+        Return the result of a stage, from the cache if its inputs are unchanged, or by running it.
+
+        ARGUMENTS
+          stage (String) - name of the stage
+          inputs (dict) - everything the stage result depends on (see stage_key())
+          compute (function) - compute() runs the stage and returns its value, which must be picklable
+
+        OPTIONAL ARGUMENTS
+          outputs (sequence of String) - files written by the stage, restored on a hit (default: none)
+          output_prefix (String) - if specified instead of outputs, the outputs are the files in output_directory
+            named after this prefix that the stage creates or modifies
+          output_directory (String) - directory searched for outputs named by output_prefix (default: '.')
+
+        RETURNS
+          key (String) - key of the stage, to be used in the inputs of downstream stages
+          value (object) - value of the stage
+
+        """
+
+        key = stage_key(stage, inputs, code=self.code)
+        entry = self.load(key)
+        if entry is not None:
+            logging.info("Stage '%s' unchanged; using cached result %s" % (stage, key[:12]))
+            for (filename, contents) in entry['files'].items():
+                with open(filename, 'wb') as outfile:
+                    outfile.write(contents)
+            return (key, entry['value'])
+
+        if output_prefix is not None:
+            before = _snapshot(output_directory, output_prefix)
+        value = compute()
+        if output_prefix is not None:
+            after = _snapshot(output_directory, output_prefix)
+            outputs = sorted(path for path in after if before.get(path) != after[path])
+
+        self.store(key, value, outputs or ())
+
+        return (key, value)
+
+    def size(self):
+        """
+        Return the total size of the cache entries, in bytes.
+
+        """
+
+        return sum(size for (path, size, mtime) in self._entries())
+
+    def _entries(self):
+        entries = list()
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pkl'):
+                path = os.path.join(self.directory, filename)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, status.st_size, status.st_mtime))
+        return entries
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is within its size bound.
+
+        RETURNS
+          nevicted (int) - number of entries removed
+
+        """
+
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for (path, size, mtime) in entries)
+        nevicted = 0
+        for (path, size, mtime) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            nevicted += 1
+
+        return nevicted
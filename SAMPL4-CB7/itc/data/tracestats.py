@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+#=============================================================================================
+# tracestats.py
+#
+# Summary statistics of MCMC traces: mean, standard deviation, and quantiles.
+#
+# All code in this repository is released under the GNU General Public License.
+#=============================================================================================
+
+"""
+Summary statistics of MCMC traces: mean, standard deviation, and quantiles.
+
+All traced parameters are summarized together.  Quantiles are exact order statistics, interpolated
+linearly between neighbouring ranks as numpy.percentile does, but found by selection with
+numpy.partition in O(N) time rather than by sorting each trace.
+
+Traces that are too long to be held in memory, such as numpy.memmap arrays of samples on disk, are
+summarized in blocks of block_size samples.  Mean and variance are accumulated in one pass, and the
+quantiles are found exactly in two more: a histogram locates the bins holding the required ranks,
+and only the samples in those bins are kept for the final selection.
+
+EXAMPLES
+
+  import tracestats
+  summary = tracestats.summarize({ 'DeltaG' : DeltaG_t, 'DeltaH' : DeltaH_t }, quantiles=[0.025, 0.5, 0.975])
+  print summary['DeltaG']['mean'], summary['DeltaG']['quantiles']
+
+"""
+
+#=============================================================================================
+# IMPORTS
+#=============================================================================================
+
+import numpy
+
+#=============================================================================================
+# Constants
+#=============================================================================================
+
+DEFAULT_QUANTILES = (0.025, 0.5, 0.975) # central 95% interval and median
+BLOCK_SIZE = 2**22 # traces longer than this many samples are summarized in blocks
+NBINS = 2**16 # number of histogram bins used to locate quantiles of blocked traces
+
+#=============================================================================================
+# Quantile ranks
+#=============================================================================================
+
+def quantile_ranks(nsamples, quantiles):
+    """
+    Return the order statistics that determine each quantile, with linear interpolation between neighbouring ranks.
+
+    ARGUMENTS
+      nsamples (int) - number of samples
+      quantiles (sequence of float) - quantiles in [0, 1]
+
+    RETURNS
+      lower (numpy array of int) - rank of the order statistic below each quantile
+      upper (numpy array of int) - rank of the order statistic above each quantile
+      weight (numpy array) - weight of the upper order statistic
+
+    """
+
+    position = numpy.asarray(quantiles, numpy.float64) * (nsamples - 1)
+    lower = numpy.floor(position).astype(numpy.int64)
+    upper = numpy.minimum(lower + 1, nsamples - 1)
+    weight = position - lower
+
+    return (lower, upper, weight)
+
+#=============================================================================================
+# In-memory traces
+#=============================================================================================
+
+def summarize_rows(x_ps, quantiles=DEFAULT_QUANTILES):
+    """
+    Summarize each row of an array of samples.
+
+    ARGUMENTS
+      x_ps (numpy array of shape (nparameters, nsamples)) - samples, one parameter per row
+
+    OPTIONAL ARGUMENTS
+      quantiles (sequence of float) - quantiles to compute (default: DEFAULT_QUANTILES)
+
+    RETURNS
+      mean (numpy array of nparameters) - sample mean
+      std (numpy array of nparameters) - sample standard deviation
+      values (numpy array of shape (nparameters, nquantiles)) - quantiles
+
+    """
+
+    x_ps = numpy.atleast_2d(numpy.asarray(x_ps, numpy.float64))
+    nsamples = x_ps.shape[1]
+
+    # Select along the contiguous axis.
+    (lower, upper, weight) = quantile_ranks(nsamples, quantiles)
+    selected = numpy.partition(x_ps, numpy.unique(numpy.concatenate([lower, upper])), axis=1)
+    values = selected[:, lower] + weight * (selected[:, upper] - selected[:, lower])
+
+    return (x_ps.mean(axis=1), x_ps.std(axis=1), values)
+
+#=============================================================================================
+# Blocked traces
+#=============================================================================================
+
+def _blocks(x_t, block_size):
+    for start in range(0, x_t.shape[0], block_size):
+        yield numpy.asarray(x_t[start:start+block_size], numpy.float64)
+
+def summarize_blocked(x_t, quantiles=DEFAULT_QUANTILES, block_size=BLOCK_SIZE, nbins=NBINS):
+    """
+    Summarize one trace in blocks, without holding more than a block of it in memory.
+
+    ARGUMENTS
+      x_t (array-like supporting slicing, such as numpy.memmap) - samples
+
+    OPTIONAL ARGUMENTS
+      quantiles (sequence of float) - quantiles to compute (default: DEFAULT_QUANTILES)
+      block_size (int) - number of samples read at a time (default: BLOCK_SIZE)
+      nbins (int) - number of histogram bins used to locate the quantiles (default: NBINS)
+
+    RETURNS
+      mean (float) - sample mean
+      std (float) - sample standard deviation
+      values (numpy array of nquantiles) - quantiles, equal to those of summarize_rows()
+
+    NOTES
+      The samples in the histogram bins holding the required ranks are kept for the final selection;
+      for a continuous trace, these are a fraction of about nquantiles/nbins of the samples.
+
+    """
+
+    nsamples = x_t.shape[0]
+
+    # Pass 1: mean, variance (by pairwise combination of block moments), and range.
+    n = 0
+    mean = 0.0
+    M2 = 0.0
+    xmin = numpy.inf
+    xmax = -numpy.inf
+    for block in _blocks(x_t, block_size):
+        m = block.size
+        block_mean = block.mean()
+        delta = block_mean - mean
+        M2 += ((block - block_mean)**2).sum() + delta**2 * n * m / (n + m)
+        mean += delta * m / (n + m)
+        n += m
+        xmin = min(xmin, block.min())
+        xmax = max(xmax, block.max())
+    std = numpy.sqrt(M2 / n)
+
+    (lower, upper, weight) = quantile_ranks(nsamples, quantiles)
+    if xmax == xmin:
+        return (mean, std, numpy.zeros(len(lower)) + xmin)
+
+    width = (xmax - xmin) / nbins
+    def bin_index(block):
+        return numpy.minimum(((block - xmin) / width).astype(numpy.int64), nbins - 1)
+
+    # Pass 2: histogram, to find the bin holding each required rank.
+    counts = numpy.zeros([nbins], numpy.int64)
+    for block in _blocks(x_t, block_size):
+        counts += numpy.bincount(bin_index(block), minlength=nbins)
+    cumulative = numpy.cumsum(counts)
+    ranks = numpy.unique(numpy.concatenate([lower, upper]))
+    rank_bins = numpy.searchsorted(cumulative, ranks, side='right')
+    needed = numpy.unique(rank_bins)
+
+    # Pass 3: keep the samples in those bins, and select the ranks among them.
+    kept = dict((b, list()) for b in needed)
+    for block in _blocks(x_t, block_size):
+        index = bin_index(block)
+        for b in needed:
+            kept[b].append(block[index == b])
+    order_statistics = dict()
+    for (rank, b) in zip(ranks, rank_bins):
+        in_bin = numpy.concatenate(kept[b])
+        rank_in_bin = rank - (cumulative[b - 1] if b > 0 else 0)
+        order_statistics[rank] = numpy.partition(in_bin, rank_in_bin)[rank_in_bin]
+
+    values = numpy.array([order_statistics[l] + w * (order_statistics[u] - order_statistics[l]) for (l, u, w) in zip(lower, upper, weight)])
+
+    return (mean, std, values)
+
+#=============================================================================================
+# Summaries of all traced parameters
+#=============================================================================================
+
+def summarize(traces, quantiles=DEFAULT_QUANTILES, block_size=BLOCK_SIZE):
+    """
+    Summarize the traces of all parameters together.
+
+    Traces of equal length that fit in memory are stacked and summarized with one selection; longer
+    traces are summarized in blocks.
+
+    ARGUMENTS
+      traces (dict) - traces[name] is the 1D array of samples of parameter name
+
+    OPTIONAL ARGUMENTS
+      quantiles (sequence of float) - quantiles to compute (default: DEFAULT_QUANTILES)
+      block_size (int) - traces longer than this are summarized in blocks of this many samples (default: BLOCK_SIZE)
+
+    RETURNS
+      summary (dict) - summary[name] is a dict with the 'nsamples', 'mean', 'std', and 'quantiles'
+        (numpy array, in the order requested) of parameter name
+
+    EXAMPLES
+
+    >>> x = numpy.arange(101.0)
+    >>> summary = summarize({ 'x' : x, 'y' : 2*x })
+    >>> print(summary['x']['quantiles'].tolist())
+    [2.5, 50.0, 97.5]
+    >>> print(summary['y']['mean'])
+    100.0
+
+    """
+
+    summary = dict()
+
+    # Group in-memory traces by length, so each group is one stacked selection.
+    groups = dict()
+    for (name, x_t) in traces.items():
+        nsamples = x_t.shape[0]
+        if nsamples > block_size:
+            (mean, std, values) = summarize_blocked(x_t, quantiles, block_size=block_size)
+            summary[name] = { 'nsamples' : nsamples, 'mean' : mean, 'std' : std, 'quantiles' : values }
+        else:
+            groups.setdefault(nsamples, list()).append(name)
+
+    for (nsamples, names) in groups.items():
+        x_ps = numpy.vstack([numpy.asarray(traces[name], numpy.float64) for name in names])
+        (mean, std, values) = summarize_rows(x_ps, quantiles)
+        for (index, name) in enumerate(names):
+            summary[name] = { 'nsamples' : nsamples, 'mean' : mean[index], 'std' : std[index], 'quantiles' : values[index] }
+
+    return summary
+
+def confidence_interval(x_t, ci=0.95):
+    """
+    Return the mean, standard deviation, and central confidence interval of one trace.
+
+    ARGUMENTS
+      x_t (numpy array) - samples
+
+    OPTIONAL ARGUMENTS
+      ci (float) - probability mass of the interval (default: 0.95)
+
+    RETURNS
+      [x, dx, xlow, xhigh] - mean, standard deviation, and interval bounds
+
+    """
+
+    summary = summarize({ 'x' : x_t }, quantiles=[0.5 - ci/2.0, 0.5 + ci/2.0])['x']
+    (xlow, xhigh) = summary['quantiles']
+
+    return [summary['mean'], summary['std'], xlow, xhigh]
@@ -0,0 +1,103 @@
+__author__ = 'Arien Sebastiaan Rustenburg'
+
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy
+
+data_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SAMPL4-CB7', 'itc', 'data')
+sys.path.append(data_directory)
+
+import Units
+import itcfile
+import binding
+import integration
+import benchmarks
+
+# An Auto iTC-200 run sampled every second, and the longest VP-ITC run.
+itc_filenames = [os.path.join(data_directory, '01232015', '20150123a1.itc'), os.path.join(data_directory, '070702014', '20140707a6.itc')]
+
+power_fields = ['filter_period_end_time', 'differential_power', 'cell_temperature', 'jacket_temperature', 'first_index', 'last_index']
+
+
+def _legacy_integrate_heats(time, power, baseline_power, first_index, last_index, filter_period_n):
+    """Reference per-injection loop, as originally implemented in Experiment.integrate_heat."""
+    evolved_heat = numpy.zeros([len(first_index)], numpy.float64)
+    end_time = numpy.zeros([len(first_index)], numpy.float64)
+    for n in range(len(first_index)):
+        excess_energy_input = filter_period_n[n] * (power[first_index[n]:(last_index[n]+1)] - baseline_power[first_index[n]:(last_index[n]+1)]).sum()
+        evolved_heat[n] = - excess_energy_input
+        end_time[n] = time[last_index[n]]
+    return evolved_heat, end_time
+
+
+def test_read_itc_file():
+    """Parse .itc files as the reference per-line parser does."""
+    for filename in itc_filenames:
+        reference = benchmarks._legacy_read_power_data(filename)
+        data = itcfile.read_itc_file(filename)
+        for field in power_fields:
+            assert numpy.array_equal(data[field], reference[field]), "Field '%s' of '%s' differs from reference parser." % (field, filename)
+
+
+def test_sidecar_cache():
+    """Read the same power measurements from the sidecar cache as from the .itc file."""
+    cache_directory = tempfile.mkdtemp()
+    try:
+        for filename in itc_filenames:
+            reference = itcfile.read_itc_file(filename)
+            written = itcfile.read_itc_file(filename, cache=True, cache_directory=cache_directory)
+            assert all(os.path.exists(name) for name in itcfile.cache_filenames(filename, cache_directory))
+            cached = itcfile.read_itc_file(filename, cache=True, cache_directory=cache_directory)
+            assert isinstance(cached['differential_power'], numpy.memmap)
+            for data in [written, cached]:
+                for field in power_fields:
+                    assert numpy.array_equal(data[field], reference[field]), "Field '%s' of '%s' differs from cache." % (field, filename)
+                assert data['header'] == reference['header']
+                assert data['ncolumns'] == reference['ncolumns']
+    finally:
+        shutil.rmtree(cache_directory)
+
+
+def test_two_component_injection_heats():
+    """Compute the expected injection heats as the reference per-injection loop does, singly and batched."""
+    V0 = 1.4301 * Units.ml - 0.044 * Units.ml # VP-ITC sample cell, with Tellinghuisen volume correction
+    kB = 6.02214179e23 * 1.3806504e-23 / 4184.0 * Units.kcal / Units.mol / Units.K # Boltzmann constant (kcal/mol/K)
+    beta = 1.0 / (kB * 298.15 * Units.K) # inverse temperature 1/(kcal/mol)
+
+    random = numpy.random.RandomState(0)
+    nsamples = 20
+    DeltaG = random.uniform(-14.0, -6.0, size=nsamples) * Units.kcal/Units.mol
+    DeltaH = random.uniform(-15.0, -2.0, size=nsamples) * Units.kcal/Units.mol
+    DeltaH_0 = random.uniform(-1.0, 1.0, size=nsamples) * Units.ucal
+    P0 = random.lognormal(numpy.log(50.0), 0.02, size=nsamples) * Units.uM
+    Ls = random.lognormal(numpy.log(500.0), 0.005, size=nsamples) * Units.uM
+
+    for filename in itc_filenames:
+        data = itcfile.read_itc_file(filename)
+        injection_volumes = [injection['volume'] for injection in itcfile.parse_injections(data['header'])]
+        (d_n, dcum_n) = binding.compute_dilution_factors(injection_volumes, V0)
+        batch = binding.two_component_injection_heats(DeltaG, DeltaH, DeltaH_0, P0, Ls, V0, d_n, dcum_n, beta)
+        for index in range(nsamples):
+            reference = benchmarks._legacy_injection_heats(DeltaG[index], DeltaH[index], DeltaH_0[index], P0[index], Ls[index], V0, injection_volumes, beta)
+            single = binding.two_component_injection_heats(DeltaG[index], DeltaH[index], DeltaH_0[index], P0[index], Ls[index], V0, d_n, dcum_n, beta)
+            for q_n in [single, batch[index]]:
+                assert numpy.allclose(q_n, reference, rtol=1.0e-6, atol=1.0e-6 * numpy.abs(reference).max())
+
+
+def test_integrate_injections():
+    """Integrate the injection heats as the reference per-injection loop does."""
+    for filename in itc_filenames:
+        data = itcfile.read_itc_file(filename)
+        time = data['filter_period_end_time']
+        power = data['differential_power']
+        filter_period_n = numpy.array([injection['filter_period'] for injection in itcfile.parse_injections(data['header'])])
+        # A drifting baseline, so that the baseline correction is exercised.
+        baseline_power = numpy.polyval(numpy.polyfit(time, power, 1), time)
+
+        (evolved_heat, end_time) = _legacy_integrate_heats(time, power, baseline_power, data['first_index'], data['last_index'], filter_period_n)
+        heats = integration.integrate_injections(time, power, baseline_power, data['first_index'], data['last_index'], filter_period_n)
+        assert numpy.allclose(heats['evolved_heat'], evolved_heat, rtol=1.0e-10, atol=1.0e-12 * numpy.abs(evolved_heat).max())
+        assert numpy.array_equal(heats['end_time'], end_time)